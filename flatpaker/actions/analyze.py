@@ -0,0 +1,294 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Where the space in the repo goes.
+
+OSTree stores each distinct file once, however many refs contain it. This
+lists the files of every ref's head commit, streaming them into a scratch
+SQLite database rather than holding them in memory, and works out how much
+of each ref is unique to it and how much is shared with other refs.
+
+Only file content is counted, commit and directory metadata are small enough
+to ignore, and objects only reachable from older commits are left to
+`flatpaker repo prune`.
+"""
+
+from __future__ import annotations
+import configparser
+import datetime
+import json
+import os
+import pathlib
+import sqlite3
+import subprocess
+import time
+import typing
+
+from flatpaker import util
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import AnalyzeArguments
+
+_SCHEMA = '''
+    CREATE TABLE refs (
+        id INTEGER PRIMARY KEY,
+        ref TEXT NOT NULL,
+        commit_ TEXT NOT NULL,
+        candidate INTEGER NOT NULL
+    );
+    CREATE TABLE objects (
+        checksum TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        disk INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE files (
+        ref INTEGER NOT NULL,
+        checksum TEXT NOT NULL,
+        path TEXT NOT NULL
+    );
+'''
+
+# How many rows to insert at once
+_BATCH = 10000
+
+
+def default_path() -> pathlib.Path:
+    root = os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state'))
+    return pathlib.Path(root, 'flatpaker', 'analysis.json')
+
+
+class _Repo:
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(path / 'config')
+        # Archive repos compress each file object
+        mode = config.get('core', 'mode', fallback='bare')
+        self.suffix = '.filez' if mode.startswith('archive') else '.file'
+
+    def disk_size(self, checksum: str) -> int:
+        try:
+            return os.lstat(self.path / 'objects' / checksum[:2] / f'{checksum[2:]}{self.suffix}').st_size
+        except OSError:
+            return 0
+
+    def files(self, ref: str) -> typing.Iterator[typing.Tuple[int, str, str]]:
+        """The size, checksum, and path of each file in a ref, as listed by ostree."""
+        with subprocess.Popen(
+                ['ostree', f'--repo={self.path}', 'ls', '-R', '-C', ref, '/'],
+                stdout=subprocess.PIPE, text=True, errors='replace') as proc:
+            assert proc.stdout is not None, 'for mypy'
+            for line in proc.stdout:
+                # mode uid gid size checksum path, directories have two
+                # checksums and no content of their own
+                if line.startswith('d'):
+                    continue
+                fields = line.rstrip('\n').split(maxsplit=5)
+                if len(fields) != 6:
+                    continue
+                path = fields[5]
+                if line.startswith('l'):
+                    path = path.split(' -> ', 1)[0]
+                yield int(fields[3]), fields[4], path
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def _load(db: sqlite3.Connection, repo: _Repo, ref: str, commit: str, candidate: bool) -> None:
+    cur = db.execute('INSERT INTO refs (ref, commit_, candidate) VALUES (?, ?, ?)', (ref, commit, candidate))
+    ref_id = cur.lastrowid
+
+    files: typing.List[typing.Tuple[typing.Optional[int], str, str]] = []
+    objects: typing.List[typing.Tuple[str, int, int]] = []
+
+    def flush() -> None:
+        db.executemany('INSERT INTO files (ref, checksum, path) VALUES (?, ?, ?)', files)
+        db.executemany('INSERT OR IGNORE INTO objects (checksum, size, disk) VALUES (?, ?, ?)', objects)
+        files.clear()
+        objects.clear()
+
+    for size, checksum, path in repo.files(ref):
+        files.append((ref_id, checksum, path))
+        # Only stat objects that haven't been seen yet
+        if db.execute('SELECT 1 FROM objects WHERE checksum = ?', (checksum, )).fetchone() is None:
+            objects.append((checksum, size, repo.disk_size(checksum)))
+        if len(files) >= _BATCH:
+            flush()
+    flush()
+
+
+def _analyze(db: sqlite3.Connection, top: int) -> typing.Dict[str, typing.Any]:
+    db.executescript('''
+        CREATE INDEX files_checksum ON files (checksum);
+        CREATE TEMP TABLE ref_objects AS
+            SELECT DISTINCT ref, checksum FROM files;
+        CREATE INDEX temp.ref_objects_checksum ON ref_objects (checksum);
+        -- How many refs in the repo itself use each object
+        CREATE TEMP TABLE sharing AS
+            SELECT ro.checksum, COUNT(*) AS n FROM ref_objects ro
+            JOIN refs r ON r.id = ro.ref WHERE NOT r.candidate
+            GROUP BY ro.checksum;
+        CREATE UNIQUE INDEX temp.sharing_checksum ON sharing (checksum);
+    ''')
+
+    result: typing.Dict[str, typing.Any] = {'time': time.time()}
+
+    objects, size, content = db.execute(
+        'SELECT COUNT(*), COALESCE(SUM(o.disk), 0), COALESCE(SUM(o.size), 0) '
+        'FROM sharing s JOIN objects o USING (checksum)').fetchone()
+    result.update(objects=objects, size=size, content=content)
+
+    refs: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+    candidates: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+    cur = db.execute('''
+        SELECT r.ref, r.commit_, r.candidate, COUNT(*), SUM(o.disk),
+               SUM(CASE WHEN s.n IS NULL OR (s.n = 1 AND NOT r.candidate) THEN o.disk ELSE 0 END)
+        FROM ref_objects ro
+        JOIN refs r ON r.id = ro.ref
+        JOIN objects o USING (checksum)
+        LEFT JOIN sharing s USING (checksum)
+        GROUP BY ro.ref ORDER BY r.ref
+    ''')
+    for ref, commit, candidate, count, total, unique in cur:
+        entry = {'commit': commit, 'objects': count, 'size': total, 'unique': unique, 'shared': total - unique}
+        (candidates if candidate else refs)[ref] = entry
+    result['refs'] = refs
+    if candidates:
+        result['candidates'] = candidates
+
+    result['largest'] = [
+        {'path': path, 'ref': ref, 'size': disk, 'refs': n}
+        for path, ref, disk, n in db.execute('''
+            SELECT MIN(f.path), MIN(r.ref), o.disk, COUNT(DISTINCT f.ref)
+            FROM files f JOIN objects o USING (checksum) JOIN refs r ON r.id = f.ref
+            GROUP BY f.checksum ORDER BY o.disk DESC LIMIT ?
+        ''', (top, ))]
+
+    # Identical files stored once, but present at several paths or in
+    # several refs, such as assets shared between editions of a game
+    duplicates = []
+    for checksum, disk, copies, nrefs in db.execute('''
+            SELECT f.checksum, o.disk, COUNT(*) AS copies, COUNT(DISTINCT f.ref)
+            FROM files f JOIN objects o USING (checksum)
+            GROUP BY f.checksum HAVING copies > 1
+            ORDER BY o.disk * (copies - 1) DESC LIMIT ?
+    ''', (top, )).fetchall():
+        paths = [f'{ref}:{path}' for ref, path in db.execute(
+            'SELECT r.ref, f.path FROM files f JOIN refs r ON r.id = f.ref '
+            'WHERE f.checksum = ? ORDER BY r.ref, f.path LIMIT 5', (checksum, ))]
+        duplicates.append({
+            'checksum': checksum, 'size': disk, 'copies': copies, 'refs': nrefs,
+            'saved': disk * (copies - 1), 'paths': paths,
+        })
+    result['duplicates'] = duplicates
+
+    return result
+
+
+def _growth(previous: typing.Optional[typing.Dict[str, typing.Any]],
+            current: typing.Dict[str, typing.Any]) -> typing.Optional[typing.Dict[str, typing.Any]]:
+    if previous is None:
+        return None
+    before: typing.Dict[str, typing.Any] = previous['refs']
+    after: typing.Dict[str, typing.Any] = current['refs']
+    return {
+        'since': previous['time'],
+        'size': current['size'] - previous['size'],
+        'objects': current['objects'] - previous['objects'],
+        'added': sorted(after.keys() - before.keys()),
+        'removed': sorted(before.keys() - after.keys()),
+        'changed': {
+            ref: {'size': after[ref]['size'] - before[ref]['size'],
+                  'unique': after[ref]['unique'] - before[ref]['unique']}
+            for ref in sorted(after.keys() & before.keys())
+            if after[ref]['commit'] != before[ref]['commit']
+        },
+    }
+
+
+def _print(result: typing.Dict[str, typing.Any]) -> None:
+    fs = util.format_size
+    print(f'{result["objects"]} file objects, {fs(result["size"])} on disk '
+          f'({fs(result["content"])} uncompressed)')
+
+    refs: typing.Dict[str, typing.Any] = result['refs']
+    print(f'\n{"unique":>10}  {"shared":>10}  ref')
+    for ref, e in sorted(refs.items(), key=lambda r: r[1]['unique'], reverse=True):
+        print(f'{fs(e["unique"]):>10}  {fs(e["shared"]):>10}  {ref}')
+
+    if (candidates := result.get('candidates')):
+        print('\nAdding these would cost:')
+        for ref, e in candidates.items():
+            print(f'{fs(e["unique"]):>10}  of {fs(e["size"])}, {ref}')
+
+    print('\nLargest files:')
+    for f in result['largest']:
+        shared = f' (in {f["refs"]} refs)' if f['refs'] > 1 else ''
+        print(f'{fs(f["size"]):>10}  {f["ref"]}:{f["path"]}{shared}')
+
+    if result['duplicates']:
+        print('\nDuplicated files, stored once:')
+        for d in result['duplicates']:
+            print(f'{fs(d["saved"]):>10}  saved, {d["copies"]} copies of {fs(d["size"])} in {d["refs"]} ref(s)')
+            for p in d['paths']:
+                print(f'            {p}')
+            if d['copies'] > len(d['paths']):
+                print(f'            ... and {d["copies"] - len(d["paths"])} more')
+
+    if (growth := result.get('growth')):
+        when = datetime.datetime.fromtimestamp(growth['since']).strftime('%Y-%m-%d %H:%M')
+        print(f'\nSince {when}: {"+" if growth["size"] >= 0 else "-"}{fs(abs(growth["size"]))}, '
+              f'{growth["objects"]:+} objects')
+        for ref in growth['added']:
+            print(f'    added:   {ref} ({fs(refs[ref]["unique"])} unique)')
+        for ref in growth['removed']:
+            print(f'    removed: {ref}')
+        for ref, c in growth['changed'].items():
+            print(f'    rebuilt: {ref} ({"+" if c["unique"] >= 0 else "-"}{fs(abs(c["unique"]))} unique)')
+
+
+def analyze(args: AnalyzeArguments) -> bool:
+    repo = _Repo(pathlib.Path(args.repo))
+    if not (repo.path / 'config').exists():
+        print(f'{args.repo} is not an ostree repo')
+        return False
+    candidates = [_Repo(pathlib.Path(c)) for c in args.candidates]
+
+    history = pathlib.Path(args.history)
+    key = repo.path.absolute().as_posix()
+    snapshots: typing.Dict[str, typing.Any] = {}
+    if history.exists():
+        with history.open('r') as f:
+            snapshots = json.load(f)
+
+    with util.tmpdir(f'analyze-{os.getpid()}') as d:
+        db = sqlite3.connect(d / 'objects.sqlite')
+        db.executescript(_SCHEMA)
+        with db:
+            with util.repo_lock(args.repo):
+                for ref, commit in sorted(util.repo_refs(repo.path).items()):
+                    _load(db, repo, ref, commit, False)
+            for c in candidates:
+                for ref, commit in sorted(util.repo_refs(c.path).items()):
+                    _load(db, c, ref, commit, True)
+        result = _analyze(db, args.top)
+        db.close()
+
+    growth = _growth(snapshots.get(key), result)
+
+    # Candidates aren't in the repo, so they're not part of its history
+    snapshots[key] = {k: v for k, v in result.items() if k != 'candidates'}
+    history.parent.mkdir(parents=True, exist_ok=True)
+    tmp = history.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(snapshots, f)
+    os.replace(tmp, history)
+
+    if growth is not None:
+        result['growth'] = growth
+    if args.format == 'json':
+        print(json.dumps(result, indent=2))
+    else:
+        _print(result)
+    return True
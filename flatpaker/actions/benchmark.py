@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Compare builds of the Ren'Py runtime against each other.
+
+A synthetic game, generated here so that nothing needs to be downloaded, is
+run against each installed variant of a runtime (see the profiles in
+build_runtime). The game times its own startup, image decoding, and
+transitions, and writes them out before quitting.
+
+The game needs a display, so on a headless machine run it under a wrapper
+such as `xvfb-run -a`.
+"""
+
+from __future__ import annotations
+import asyncio
+import importlib.resources
+import json
+import os
+import pathlib
+import random
+import shlex
+import statistics
+import struct
+import subprocess
+import time
+import typing
+import zlib
+
+from flatpaker import run, util
+from flatpaker.actions.build_runtime import renpy_branch
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import BenchmarkArguments
+
+_PLATFORM = 'com.github.dcbaker.flatpaker.RenPy.Platform'
+
+# Noise, as it's the worst case for decoding, and the size of a typical background
+_IMAGES = 12
+_WIDTH = 1280
+_HEIGHT = 720
+
+_METRICS = ['startup', 'decode', 'transitions', 'frame p50', 'frame p95']
+
+
+def _png(width: int, height: int, rng: random.Random) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # Each scanline starts with its filter type, 0 for none
+    raw = b''.join(b'\0' + rng.randbytes(width * 3) for _ in range(height))
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw, 6)),
+        chunk(b'IEND', b''),
+    ])
+
+
+def _write_game(root: pathlib.Path) -> None:
+    """Lay the game out the way the runtime expects it in /app."""
+    game = root / 'lib' / 'game' / 'game'
+    (game / 'bench').mkdir(parents=True, exist_ok=True)
+    script = importlib.resources.files('flatpaker') / 'data' / 'benchmark' / 'script.rpy'
+    (game / 'script.rpy').write_bytes(script.read_bytes())
+
+    # The same seed every time, so every run decodes the same images
+    rng = random.Random(0)
+    for i in range(_IMAGES):
+        image = game / 'bench' / f'{i:02}.png'
+        if not image.exists():
+            image.write_bytes(_png(_WIDTH, _HEIGHT, rng))
+
+
+def _summarize(results: typing.List[typing.Dict[str, typing.Any]]) -> typing.Dict[str, float]:
+    frames = sorted(f for r in results for f in r['frames'])
+    summary = {k: statistics.median(r[k] for r in results) for k in ['startup', 'decode', 'transitions']}
+    summary['frame p50'] = frames[len(frames) // 2] if frames else 0.0
+    summary['frame p95'] = frames[int(len(frames) * 0.95)] if frames else 0.0
+    return summary
+
+
+def _run_once(args: BenchmarkArguments, reporter: run.Reporter, job: str, appdir: pathlib.Path,
+              data: pathlib.Path, branch: str, out: pathlib.Path) -> typing.Dict[str, typing.Any]:
+    out.unlink(missing_ok=True)
+    command = [
+        *shlex.split(args.wrapper),
+        'flatpak', 'run', '--user',
+        f'--app-path={appdir.as_posix()}',
+        '--socket=x11', '--share=ipc', '--device=dri',
+        f'--filesystem={data.as_posix()}',
+        f'--env=XDG_DATA_HOME={data.as_posix()}',
+        f'--env=XDG_STATE_HOME={data.as_posix()}',
+        f'--env=FLATPAKER_BENCH_OUT={out.as_posix()}',
+        f'--env=FLATPAKER_TRACE_START={time.time()}',
+        # Don't wait for the display, or the frame times are the refresh rate
+        '--env=RENPY_GL_VSYNC=0',
+        '--env=SDL_AUDIODRIVER=dummy',
+        '--command=renpy-bin',
+        f'{_PLATFORM}//{branch}',
+        '/app/lib/game', 'flatpaker-bench',
+    ]
+    run.run(reporter, job, command, args.timeout)
+    with out.open('r') as f:
+        result: typing.Dict[str, typing.Any] = json.load(f)
+    return result
+
+
+def _print(summaries: typing.Dict[str, typing.Dict[str, float]]) -> None:
+    baseline = next(iter(summaries.values()))
+    width = max(len(p) for p in summaries)
+    print(f'{"":<{width}}  ' + '  '.join(f'{m:>16}' for m in _METRICS))
+    for profile, summary in summaries.items():
+        cells = []
+        for m in _METRICS:
+            value = f'{summary[m] * 1000:.1f}ms'
+            if summary is not baseline and baseline[m]:
+                value += f' {(summary[m] - baseline[m]) / baseline[m]:+.0%}'
+            cells.append(f'{value:>16}')
+        print(f'{profile:<{width}}  ' + '  '.join(cells))
+
+
+def benchmark_runtimes(args: BenchmarkArguments) -> bool:
+    profiles = args.profiles or ['default', 'optimized']
+    summaries: typing.Dict[str, typing.Dict[str, float]] = {}
+    success = True
+
+    with util.tmpdir('benchmark', cleanup=False) as appdir, \
+            util.tmpdir(f'benchmark-{os.getpid()}') as results, \
+            run.Reporter.from_args(args) as reporter:
+        _write_game(appdir)
+
+        for profile in profiles:
+            branch = renpy_branch(args.engine, profile)
+            job = f'benchmark-{branch}'
+            # Each profile gets its own data, so the first run compiles the
+            # scripts into its cache overlay, and none of the others pay for it
+            data = results / branch
+            data.mkdir()
+            out = data / 'result.json'
+            try:
+                reporter.event(job, 'stage', stage='warming up')
+                _run_once(args, reporter, job, appdir, data, branch, out)
+                runs = []
+                for i in range(args.runs):
+                    reporter.event(job, 'stage', stage=f'run {i + 1} of {args.runs}')
+                    runs.append(_run_once(args, reporter, job, appdir, data, branch, out))
+            except (subprocess.CalledProcessError, asyncio.TimeoutError, OSError, ValueError) as e:
+                reporter.message(f'{_PLATFORM}//{branch}: failed: {e}')
+                success = False
+                continue
+            summaries[profile] = _summarize(runs)
+
+    if not summaries:
+        return False
+    if args.format == 'json':
+        print(json.dumps(summaries, indent=2))
+    else:
+        _print(summaries)
+    return success
@@ -2,18 +2,21 @@
 # Copyright © 2025 Dylan Baker
 
 from __future__ import annotations
+import asyncio
+import contextlib
 import importlib
 import pathlib
 import shutil
-import subprocess
 import typing
 
-from flatpaker import util
+from flatpaker import cache, native, run, stats, util
+from flatpaker.dependencies import DependencyIndex
 from flatpaker.description import load_description
+from flatpaker.journal import Journal
 
 if typing.TYPE_CHECKING:
     from flatpaker.description import Description, EngineName
-    from flatpaker.entry import BaseBuildArguments, BuildArguments
+    from flatpaker.entry import AppBuildArguments, BaseBuildArguments, BuildArguments
 
     JsonWriterImpl = typing.Callable[[Description, pathlib.Path, str, pathlib.Path, pathlib.Path], None]
 
@@ -29,45 +32,173 @@ def select_impl(name: EngineName) -> JsonWriterImpl:
     return mod.write_rules
 
 
-def _build(args: BaseBuildArguments, description: Description) -> None:
-    # TODO: This could be common
-    appid = f"{description.common.reverse_url}.{util.sanitize_name(description.common.name)}"
+T = typing.TypeVar('T')
 
-    write_build_rules = select_impl(description.common.engine)
 
-    with util.tmpdir(description.common.name, args.cleanup) as d:
-        workdir = pathlib.Path(d)
-        desktop_file = util.create_desktop(description, workdir, appid)
-        appdata_file = util.create_appdata(description, workdir, appid)
-        write_build_rules(description, workdir, appid, desktop_file, appdata_file)
+async def _enter(stack: contextlib.AsyncExitStack, cm: typing.ContextManager[T]) -> T:
+    """Enter a blocking context manager, such as a lock, in a worker thread.
 
-        build_command: typing.List[str] = [
-            'flatpak-builder', '--force-clean', '--user', 'build',
-            (workdir / f'{appid}.json').absolute().as_posix(),
-        ]
+    It is exited in one as well, so that waiting for a lock or cleaning up
+    doesn't stall every other build running on the event loop.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(cm.__enter__))
+    try:
+        value = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The thread can't be interrupted, so release whatever it acquires
+        def release(t: asyncio.Future[T]) -> None:
+            if not t.cancelled() and t.exception() is None:
+                asyncio.ensure_future(asyncio.to_thread(cm.__exit__, None, None, None))
+        task.add_done_callback(release)
+        raise
+    stack.push_async_exit(lambda *exc: asyncio.to_thread(cm.__exit__, *exc))
+    return value
 
-        if args.export:
-            build_command.extend(['--repo', args.repo])
-            if args.gpg:
-                build_command.extend(['--gpg-sign', args.gpg])
-        if args.install:
-            build_command.extend(['--install'])
 
-        subprocess.run(build_command, check=True)
-        if args.cleanup:
-            shutil.rmtree('build', ignore_errors=True)
+def _ensure_space(appid: str, description: Description) -> None:
+    cache.ensure_space(stats.StatsDB().expected_disk(appid, stats.source_bytes(description)))
 
 
-def build_flatpak(args: BuildArguments) -> bool:
+async def build_description(args: AppBuildArguments, description: Description,
+                            reporter: run.Reporter, path: str) -> None:
+    appid = util.appid(description)
+
+    write_build_rules = select_impl(description.common.engine)
+
+    # This may have to evict from the caches, which walks them
+    await asyncio.to_thread(_ensure_space, appid, description)
+
+    async with contextlib.AsyncExitStack() as stack:
+        workdir = await _enter(stack, util.tmpdir(description.common.name, args.cleanup))
+        builddir = await _enter(stack, cache.entry('build', appid, args.cleanup))
+        statedir = await _enter(stack, cache.entry('state', appid))
+
+        desktop_file = util.create_desktop(description, workdir, appid)
+        appdata_file = util.create_appdata(description, workdir, appid)
+        # This hashes the sources, which can take a while for large games
+        await asyncio.to_thread(write_build_rules, description, workdir, appid, desktop_file, appdata_file)
+
+        # The workdir is removed after the build, keep this with the log
+        if (overlay := workdir / 'overlay.txt').exists():
+            report = reporter.log_path(appid).with_suffix('.overlay.txt')
+            shutil.copyfile(overlay, report)
+            reporter.message(f'{description.common.name}: archives overlap, see {report}')
+
+        manifest = workdir / f'{appid}.json'
+        async with contextlib.AsyncExitStack() as build:
+            if args.export:
+                # Repo maintenance holds this exclusively for as long as it runs
+                await _enter(build, util.repo_lock(args.repo))
+            await _enter(build, stats.record_build(description, args.builder))
+            if args.builder == 'native':
+                await native.build(args, manifest, builddir, statedir, reporter)
+            else:
+                await _flatpak_builder(args, manifest, builddir, statedir, reporter, appid)
+        await DependencyIndex().record(appid, description, path, manifest)
+
+
+async def _flatpak_builder(args: AppBuildArguments, manifest: pathlib.Path, builddir: pathlib.Path,
+                           statedir: pathlib.Path, reporter: run.Reporter, appid: str) -> None:
+    # Each app gets its own build and state directory so that several can
+    # be built at once
+    build_command: typing.List[str] = [
+        'flatpak-builder', '--force-clean', '--user',
+        f'--state-dir={statedir.as_posix()}',
+        builddir.as_posix(),
+        manifest.absolute().as_posix(),
+    ]
+
+    if args.export:
+        build_command.extend(['--repo', args.repo])
+        if args.gpg:
+            build_command.extend(['--gpg-sign', args.gpg])
+    if args.install:
+        build_command.extend(['--install'])
+
+    await run.run_async(reporter, appid, build_command, args.timeout)
+
+
+def _exported_commit(args: BaseBuildArguments, description: Description) -> typing.Optional[str]:
+    if not args.export:
+        return None
+    prefix = f'app/{util.appid(description)}/'
+    refs = util.repo_refs(pathlib.Path(args.repo))
+    return next((c for r, c in refs.items() if r.startswith(prefix)), None)
+
+
+def _can_start(args: BuildArguments, journal: Journal, reporter: run.Reporter) -> bool:
+    """Refuse to forget a batch that still needs resuming, unless asked to."""
+    left = journal.select(failed=True, unfinished=True)
+    if not left or args.discard:
+        return True
+    reporter.message(
+        f'The journal has {len(left)} description(s) from the previous batch that did not finish or '
+        'failed. Build them with --resume or --retry-failed, or pass --discard to start over')
+    return False
+
+
+async def _build_all(args: BuildArguments, reporter: run.Reporter) -> bool:
+    journal = Journal(pathlib.Path(args.journal))
+    if args.resume or args.retry_failed:
+        descriptions = journal.select(failed=True, unfinished=args.resume)
+        if not descriptions:
+            reporter.message('Nothing to resume')
+            return True
+    elif args.affected_by:
+        affected = await DependencyIndex().affected(args.affected_by)
+        for app in affected:
+            reporter.message(f'{app.appid} was built against an older {args.affected_by}')
+        descriptions = [a.description for a in affected]
+        if not descriptions:
+            reporter.message(f'Nothing needs to be rebuilt for {args.affected_by}')
+            return True
+        if not _can_start(args, journal, reporter):
+            return False
+        journal.start(descriptions)
+    else:
+        descriptions = [pathlib.Path(d).absolute().as_posix() for d in args.descriptions]
+        if not _can_start(args, journal, reporter):
+            return False
+        journal.start(descriptions)
+
+    if not args.keep_order:
+        descriptions = stats.schedule(descriptions)
+    jobs = asyncio.Semaphore(args.jobs)
     success = True
 
-    for d in args.descriptions:
-        try:
-            description = load_description(d)
-            _build(args, description)
-        except Exception:
-            if not args.keep_going:
-                raise
-            success = False
+    async def build_one(d: str) -> None:
+        nonlocal success
+        async with jobs:
+            journal.update(d, 'running')
+            try:
+                description = load_description(d)
+                await build_description(args, description, reporter, d)
+            except Exception as e:
+                journal.update(d, 'failed', error=str(e))
+                reporter.message(f'{d}: failed: {e}')
+                if not args.keep_going:
+                    raise
+                success = False
+            else:
+                journal.update(d, 'done', commit=_exported_commit(args, description))
+                reporter.message(f'{d}: done')
+
+    tasks = [asyncio.ensure_future(build_one(d)) for d in descriptions]
+    try:
+        # Stop everything on the first failure, unless asked to keep going
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in done:
+            t.result()
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        counts = journal.counts()
+        reporter.message(', '.join(f'{counts.get(s, 0)} {s}' for s in ['done', 'failed', 'pending', 'running']))
 
     return success
+
+
+def build_flatpak(args: BuildArguments) -> bool:
+    with run.Reporter.from_args(args) as reporter:
+        return asyncio.run(_build_all(args, reporter))
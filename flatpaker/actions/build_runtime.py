@@ -2,49 +2,157 @@
 # Copyright © 2025 Dylan Baker
 
 from __future__ import annotations
+import contextlib
 import importlib.resources
 import pathlib
 import subprocess
 import typing
 
-from flatpaker import util
+from flatpaker import cache, run, util
 
 if typing.TYPE_CHECKING:
-    from ..entry import BaseBuildArguments, BuildRuntimeArguments
-
-
-def _build_runtime(args: BaseBuildArguments, sdk: pathlib.Path) -> None:
-    build_command: typing.List[str] = [
-        'flatpak-builder', '--force-clean', '--user', 'build', sdk.as_posix()]
-
-    if args.export:
-        build_command.extend(['--repo', args.repo])
-        if args.gpg:
-            build_command.extend(['--gpg-sign', args.gpg])
-    if args.install:
-        build_command.extend(['--install'])
-
-    subprocess.run(build_command, check=True)
-
-    # Work around https://github.com/flatpak/flatpak-builder/issues/630
-    if args.install and 'Sdk' in sdk.name:
-        if '8' in sdk.name:
-            branch = '8'
-        elif '7.py2' in sdk.name:
-            branch = '7'
-        elif '7.py3' in sdk.name:
-            branch = '7-PY3'
+    from importlib.resources.abc import Traversable
+
+    from ..entry import BuildRuntimeArguments
+
+
+class Profile(typing.NamedTuple):
+
+    help: str
+
+    # Added to the Sdk's default flags for everything built in the runtime
+    cflags: str = ''
+    ldflags: str = ''
+
+    # Run Ren'Py with this optimization level, with bytecode for it
+    # precompiled in parallel for everything in the runtime. Python 3 only.
+    python_optimize: int = 0
+
+
+PROFILES: typing.Dict[str, Profile] = {
+    'default': Profile('The flags and bytecode of the Sdk'),
+    'lto': Profile(
+        'Link time optimization for pygame_sdl2, Ren\'Py, and the other C modules',
+        cflags='-O2 -flto=auto -fno-semantic-interposition',
+        ldflags='-O2 -flto=auto'),
+    'bytecode': Profile(
+        'Run Ren\'Py with -O, as upstream does, with optimized bytecode for the whole runtime',
+        python_optimize=1),
+}
+PROFILES['optimized'] = Profile(
+    'Both lto and bytecode',
+    cflags=PROFILES['lto'].cflags,
+    ldflags=PROFILES['lto'].ldflags,
+    python_optimize=PROFILES['bytecode'].python_optimize)
+
+_RENPY_BRANCHES = {'8': '8', '7.py2': '7', '7.py3': '7-PY3'}
+
+
+def renpy_branch(sdk: str, profile: str) -> str:
+    """The branch a Ren'Py runtime is built as, for an Sdk manifest or an engine name."""
+    version = sdk.removeprefix('com.github.dcbaker.flatpaker.RenPy.').removesuffix('.Sdk.yml')
+    version = {'renpy8': '8', 'renpy7': '7.py2', 'renpy7-py3': '7.py3'}.get(version, version)
+    if version not in _RENPY_BRANCHES:
+        raise RuntimeError('Unexpected Sdk')
+    branch = _RENPY_BRANCHES[version]
+    # Variants get their own branch, so that they can be installed alongside
+    # the default one and compared
+    return branch if profile == 'default' else f'{branch}-{profile}'
+
+
+def _copy_tree(src: Traversable, dest: pathlib.Path) -> None:
+    dest.mkdir(parents=True, exist_ok=True)
+    for child in src.iterdir():
+        if child.name == '__pycache__':
+            continue
+        if child.is_dir():
+            _copy_tree(child, dest / child.name)
         else:
-            raise RuntimeError('Unexpected Sdk')
-
-        repo = args.repo if args.export else pathlib.Path('.flatpak-builder/cache').absolute().as_posix()
-        platform_id = '.'.join(sdk.name.split('.', maxsplit=5)[:-1])
-
-        install_command = [
-            'flatpak', 'install', '--user', '-y', '--noninteractive',
-            '--reinstall', repo, f'{platform_id}.Platform//{branch}',
-        ]
-        subprocess.run(install_command, check=True)
+            (dest / child.name).write_bytes(child.read_bytes())
+
+
+def _variant(sdk: pathlib.Path, profile: str) -> None:
+    """Rewrite a copied Sdk manifest in place to build it with a profile.
+
+    The manifests are YAML, which there is no parser for here, so this only
+    relies on the top level layout they all share.
+    """
+    prof = PROFILES[profile]
+    lines = sdk.read_text().splitlines()
+
+    branch = next(i for i, l in enumerate(lines) if l.startswith('branch:'))
+    lines[branch] = f'branch: "{renpy_branch(sdk.name, profile)}"'
+
+    modules = lines.index('modules:')
+    assert not any(l.startswith('build-options:') for l in lines), 'profiles would override the build-options'
+    options: typing.List[str] = []
+    if prof.cflags:
+        options.extend([
+            f'  cflags: "{prof.cflags}"',
+            f'  cxxflags: "{prof.cflags}"',
+            f'  ldflags: "{prof.ldflags}"',
+        ])
+    if options:
+        lines[modules:modules] = ['build-options:', *options]
+        modules += len(options) + 1
+
+    # Python 2 writes optimized bytecode as .pyo, and has no parallel
+    # compileall, so it keeps the bytecode the Sdk builds
+    if prof.python_optimize and '.py2.' not in sdk.name:
+        item = lines[modules + 1]
+        indent = item[:len(item) - len(item.lstrip())]
+        flag = '-' + 'O' * prof.python_optimize
+        levels = ' '.join(f'-o {n}' for n in range(prof.python_optimize + 1))
+        while lines and not lines[-1].strip():
+            lines.pop()
+        lines.extend([
+            f'{indent}- name: flatpaker-bytecode',
+            f'{indent}  buildsystem: simple',
+            f'{indent}  build-commands:',
+            # unchecked-hash bytecode is never compared against its source,
+            # which can't change in a runtime anyway
+            f'{indent}    - python3 -m compileall -q -f -j0 {levels} --invalidation-mode unchecked-hash '
+            '${FLATPAK_DEST}/lib/python3.12 || exit 1',
+            f"{indent}    - sed -i '1s@.*@#!/usr/bin/python3 {flag}@' ${{FLATPAK_DEST}}/bin/renpy-bin || exit 1",
+        ])
+
+    sdk.write_text('\n'.join(lines) + '\n')
+
+
+def _build_runtime(args: BuildRuntimeArguments, sdk: pathlib.Path, reporter: run.Reporter) -> None:
+    job = sdk.name.removesuffix('.yml')
+    if args.profile != 'default':
+        job = f'{job}.{args.profile}'
+
+    # The runtimes share a state directory, as they share many modules
+    with cache.entry('build', job, args.cleanup) as builddir, \
+            cache.entry('state', 'runtimes') as statedir:
+        build_command: typing.List[str] = [
+            'flatpak-builder', '--force-clean', '--user', f'--state-dir={statedir.as_posix()}',
+            builddir.as_posix(), sdk.as_posix()]
+
+        if args.export:
+            build_command.extend(['--repo', args.repo])
+            if args.gpg:
+                build_command.extend(['--gpg-sign', args.gpg])
+        if args.install:
+            build_command.extend(['--install'])
+
+        with util.repo_lock(args.repo) if args.export else contextlib.nullcontext():
+            run.run(reporter, job, build_command, args.timeout)
+
+        # Work around https://github.com/flatpak/flatpak-builder/issues/630
+        if args.install and 'Sdk' in sdk.name:
+            branch = renpy_branch(sdk.name, args.profile)
+
+            repo = args.repo if args.export else (statedir / 'cache').as_posix()
+            platform_id = '.'.join(sdk.name.split('.', maxsplit=5)[:-1])
+
+            install_command = [
+                'flatpak', 'install', '--user', '-y', '--noninteractive',
+                '--reinstall', repo, f'{platform_id}.Platform//{branch}',
+            ]
+            run.run(reporter, job, install_command, args.timeout)
 
 
 def build_runtimes(args: BuildRuntimeArguments) -> bool:
@@ -69,13 +177,27 @@ def build_runtimes(args: BuildRuntimeArguments) -> bool:
     success = True
 
     datadir =  importlib.resources.files('flatpaker') / 'data'
-    for runtime in runtimes:
-        try:
-            with importlib.resources.as_file(datadir / runtime) as sdk:
-                _build_runtime(args, sdk)
-        except Exception:
-            if not args.keep_going:
-                raise
-            success = False
+    with run.Reporter.from_args(args) as reporter, contextlib.ExitStack() as stack:
+        if args.profile != 'default':
+            # Profiles rewrite the manifests, which refer to modules, patches,
+            # and files relative to themselves, so work on a copy of them all
+            variants = stack.enter_context(util.tmpdir(f'runtimes-{args.profile}', args.cleanup))
+            _copy_tree(datadir, variants)
+            runtimes = [r for r in runtimes if 'RenPy' in r]
+            for runtime in runtimes:
+                _variant(variants / runtime, args.profile)
+
+        for runtime in runtimes:
+            try:
+                if args.profile != 'default':
+                    _build_runtime(args, variants / runtime, reporter)
+                    continue
+                with importlib.resources.as_file(datadir / runtime) as sdk:
+                    _build_runtime(args, sdk, reporter)
+            except Exception as e:
+                reporter.message(f'{runtime}: failed: {e}')
+                if not args.keep_going:
+                    raise
+                success = False
 
     return success
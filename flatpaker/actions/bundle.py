@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Export single file bundles from the repo, for installing without it.
+
+Each bundle records the commit it was made from, so that running this again
+after a build only writes the bundles whose apps (or runtimes) changed.
+"""
+
+from __future__ import annotations
+import asyncio
+import configparser
+import fnmatch
+import json
+import os
+import pathlib
+import subprocess
+import time
+import typing
+
+from flatpaker import run, util
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import BundleArguments
+
+# Where the commit each bundle was made from is recorded, in the output directory
+_STATE = '.flatpaker-bundles.json'
+
+# Extensions flatpak-builder may export alongside an app, which are not useful offline
+_EXTENSIONS = ('.Debug', '.Locale', '.Sources')
+
+
+class _Ref(typing.NamedTuple):
+
+    kind: str
+    id: str
+    arch: str
+    branch: str
+    commit: str
+
+    @property
+    def ref(self) -> str:
+        return f'{self.kind}/{self.id}/{self.arch}/{self.branch}'
+
+    @property
+    def filename(self) -> str:
+        return f'{self.id}-{self.branch}-{self.arch}.flatpak'
+
+
+def _parse(ref: str, commit: str) -> _Ref:
+    kind, id_, arch, branch = ref.split('/')
+    return _Ref(kind, id_, arch, branch, commit)
+
+
+def _runtime(repo: pathlib.Path, ref: _Ref) -> typing.Optional[str]:
+    """Find the runtime an app was built for, from its metadata."""
+    proc = subprocess.run(
+        ['ostree', f'--repo={repo}', 'cat', ref.commit, '/metadata'],
+        capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    metadata = configparser.ConfigParser(interpolation=None)
+    metadata.read_string(proc.stdout)
+    runtime = metadata.get('Application', 'runtime', fallback=None)
+    return f'runtime/{runtime}' if runtime else None
+
+
+def _select(args: BundleArguments, refs: typing.Dict[str, str]) -> typing.List[_Ref]:
+    apps = [_parse(r, c) for r, c in sorted(refs.items()) if r.startswith('app/')]
+    if args.apps:
+        selected = [a for a in apps if any(fnmatch.fnmatch(a.id, p) for p in args.apps)]
+    else:
+        selected = [a for a in apps if not a.id.endswith(_EXTENSIONS)]
+
+    if args.runtimes:
+        needed: typing.Set[str] = set()
+        for a in selected:
+            if (runtime := _runtime(pathlib.Path(args.repo), a)) is None:
+                continue
+            if runtime in refs:
+                needed.add(runtime)
+            else:
+                print(f'{a.id}: runtime {runtime} is not in {args.repo}, not bundling it')
+        selected.extend(_parse(r, refs[r]) for r in sorted(needed))
+
+    return selected
+
+
+class _State:
+
+    def __init__(self, output: pathlib.Path):
+        self.path = output / _STATE
+        self.commits: typing.Dict[str, str] = {}
+        if self.path.exists():
+            with self.path.open('r') as f:
+                self.commits = json.load(f)
+
+    def current(self, ref: _Ref) -> bool:
+        return (self.commits.get(ref.filename) == ref.commit
+                and (self.path.parent / ref.filename).exists())
+
+    def update(self, ref: _Ref) -> None:
+        self.commits[ref.filename] = ref.commit
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump(self.commits, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+async def _bundle_all(args: BundleArguments, reporter: run.Reporter) -> bool:
+    output = pathlib.Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    state = _State(output)
+    jobs = asyncio.Semaphore(args.jobs)
+    success = True
+    written: typing.List[typing.Tuple[int, float]] = []
+
+    selected = _select(args, util.repo_refs(pathlib.Path(args.repo)))
+    if not selected:
+        reporter.message(f'Nothing to bundle in {args.repo}')
+        return True
+
+    async def bundle_one(ref: _Ref) -> None:
+        nonlocal success
+        if not args.force and state.current(ref):
+            reporter.message(f'{ref.filename}: unchanged, skipping')
+            return
+
+        # Write to a temporary name, so an interrupted bundle is never
+        # mistaken for a finished one
+        dest = output / ref.filename
+        part = dest.with_name(dest.name + '.part')
+        command = ['flatpak', 'build-bundle', f'--arch={ref.arch}']
+        if ref.kind == 'runtime':
+            command.append('--runtime')
+        if args.gpg:
+            command.append(f'--gpg-sign={args.gpg}')
+        command.extend([args.repo, part.as_posix(), ref.id, ref.branch])
+
+        async with jobs:
+            start = time.monotonic()
+            try:
+                await run.run_async(reporter, ref.filename, command, args.timeout)
+            except (subprocess.CalledProcessError, asyncio.TimeoutError):
+                part.unlink(missing_ok=True)
+                success = False
+                return
+            elapsed = time.monotonic() - start
+
+        os.replace(part, dest)
+        state.update(ref)
+        size = dest.stat().st_size
+        written.append((size, elapsed))
+        reporter.event(ref.filename, 'bundle', ref=ref.ref, commit=ref.commit, size=size, elapsed=elapsed)
+        reporter.message(f'{ref.filename}: {util.format_size(size)} in {elapsed:.1f}s '
+                         f'({util.format_size(size / elapsed if elapsed else size)}/s)')
+
+    start = time.monotonic()
+    with util.repo_lock(args.repo):
+        await asyncio.gather(*[bundle_one(r) for r in selected])
+    elapsed = time.monotonic() - start
+
+    total = sum(s for s, _ in written)
+    reporter.message(f'Wrote {len(written)} of {len(selected)} bundle(s), {util.format_size(total)} '
+                     f'in {elapsed:.1f}s ({util.format_size(total / elapsed if elapsed else total)}/s)')
+    return success
+
+
+def bundle(args: BundleArguments) -> bool:
+    if not (pathlib.Path(args.repo) / 'config').exists():
+        print(f'{args.repo} is not an ostree repo')
+        return False
+
+    with run.Reporter.from_args(args) as reporter:
+        return asyncio.run(_bundle_all(args, reporter))
@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import typing
+
+from flatpaker import cache, util
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import CacheArguments
+
+
+def _show(args: CacheArguments) -> None:
+    limits = cache.budgets()
+    print(f'{cache.root()}: {util.format_size(cache.free_space())} free, '
+          f'{util.format_size(cache.min_free())} reserved for builds')
+
+    for kind in cache.KINDS:
+        es = cache.entries(kind)
+        total = sum(e.size for e in es)
+        budget = f' of {util.format_size(limits[kind])}' if kind in limits else ', no budget'
+        print(f'{kind}: {len(es)} entries, {util.format_size(total)}{budget}')
+        if not es:
+            continue
+
+        print('    largest:')
+        for e in sorted(es, key=lambda e: e.size, reverse=True)[:args.count]:
+            print(f'        {util.format_size(e.size):>10}  {e.name}')
+        print('    least recently used:')
+        for e in es[:args.count]:
+            print(f'        {cache.last_used(e)}  {e.name}')
+
+
+def _report(evicted: typing.List[cache.Entry], dry_run: bool) -> None:
+    verb = 'Would remove' if dry_run else 'Removed'
+    for e in evicted:
+        print(f'{verb} {e.kind}/{e.name} ({util.format_size(e.size)}, last used {cache.last_used(e)})')
+    print(f'{verb} {len(evicted)} entries, {util.format_size(sum(e.size for e in evicted))}')
+
+
+def manage_cache(args: CacheArguments) -> bool:
+    if args.cache_action == 'show':
+        _show(args)
+    elif args.cache_action == 'gc':
+        _report(cache.gc(args.dry_run), args.dry_run)
+    elif args.cache_action == 'clean':
+        _report(cache.clean(args.dry_run), args.dry_run)
+    return True
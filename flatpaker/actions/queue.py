@@ -0,0 +1,231 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""A shared job queue, and workers that build from it.
+
+The queue is an SQLite database. Any number of workers, on this machine or on
+others sharing the database and repo over a filesystem with working locks,
+claim jobs with a lease. A worker renews the lease while it builds. If a
+worker dies the lease expires, and the job is claimed again by another
+worker.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+import typing
+
+from flatpaker import run, stats, util
+from flatpaker.actions.build_flatpak import build_description
+from flatpaker.actions.repo import update_summary
+from flatpaker.description import load_description
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import QueueArguments, WorkerArguments
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_expires REAL,
+        error TEXT,
+        created REAL NOT NULL,
+        finished REAL
+    )
+'''
+
+
+class JobQueue:
+
+    def __init__(self, path: str, lease: float = 300, max_attempts: int = 3):
+        self.path = os.path.abspath(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.conn = self._connect()
+        self.conn.execute(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        # WAL needs memory shared between every process using the database,
+        # which workers on other machines can't have. The mode is stored in
+        # the database, so set it explicitly to convert older queues back
+        conn.execute('PRAGMA journal_mode=DELETE')
+        return conn
+
+    def enqueue(self, description: str) -> bool:
+        """Add a job, unless that description is already waiting or building."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            cur = self.conn.execute(
+                "SELECT 1 FROM jobs WHERE description = ? AND state IN ('pending', 'running')",
+                (description, ))
+            if cur.fetchone() is not None:
+                return False
+            self.conn.execute(
+                'INSERT INTO jobs (description, created) VALUES (?, ?)', (description, time.time()))
+        return True
+
+    def claim(self, worker: str) -> typing.Optional[typing.Tuple[int, str]]:
+        """Claim the oldest pending job, or one whose lease has expired."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+
+            # Jobs whose worker died too many times are given up on
+            self.conn.execute(
+                "UPDATE jobs SET state = 'failed', error = 'lease expired', finished = ? "
+                "WHERE state = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+
+            cur = self.conn.execute(
+                "SELECT id, description FROM jobs "
+                "WHERE state = 'pending' OR (state = 'running' AND lease_expires < ?) "
+                "ORDER BY id LIMIT 1",
+                (now, ))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now + self.lease, row[0]))
+        return row[0], row[1]
+
+    def renew(self, job: int, worker: str) -> None:
+        # Called from the heartbeat thread, which needs its own connection
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time() + self.lease, job, worker))
+        finally:
+            conn.close()
+
+    def finish(self, job: int, worker: str, error: typing.Optional[str] = None) -> bool:
+        """Record the result of a job, unless another worker has taken it over."""
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if error is None:
+                cur = self.conn.execute(
+                    "UPDATE jobs SET state = 'done', error = NULL, finished = ? "
+                    "WHERE id = ? AND worker = ? AND state = 'running'",
+                    (time.time(), job, worker))
+            else:
+                # Put the job back if it has attempts left
+                cur = self.conn.execute(
+                    "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                    "error = ?, finished = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                    (self.max_attempts, error, time.time(), job, worker))
+        return cur.rowcount == 1
+
+    def status(self) -> typing.Dict[str, int]:
+        cur = self.conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state')
+        return dict(cur.fetchall())
+
+    def failures(self) -> typing.List[typing.Tuple[str, str]]:
+        cur = self.conn.execute("SELECT description, error FROM jobs WHERE state = 'failed'")
+        return cur.fetchall()
+
+
+class _Heartbeat(threading.Thread):
+
+    def __init__(self, queue: JobQueue, job: int, worker: str):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.queue.lease / 3):
+            self.queue.renew(self.job, self.worker)
+
+
+def _publish(args: WorkerArguments, local: pathlib.Path, job: str, reporter: run.Reporter) -> None:
+    """Pull the refs built into the worker's local repo into the shared repo."""
+    refs = util.repo_refs(local)
+    central = pathlib.Path(args.repo)
+    with util.repo_lock(args.repo):
+        run.run(reporter, job, ['ostree', f'--repo={central}', 'pull-local', local.as_posix(), *refs])
+        # The local repo is built unsigned, sign the commits once they are in
+        # the shared repo so that clients verifying signatures accept them
+        if args.gpg:
+            for commit in sorted(set(refs.values())):
+                run.run(reporter, job, ['ostree', f'--repo={central}', 'gpg-sign', commit, args.gpg])
+        update_summary(central, args.gpg)
+
+
+def queue(args: QueueArguments) -> bool:
+    jobs = JobQueue(args.queue)
+    # Jobs are claimed in the order they were added, so add the most
+    # expensive first to avoid one long build finishing alone
+    descriptions = args.descriptions if args.keep_order else stats.schedule(args.descriptions)
+    for d in descriptions:
+        path = pathlib.Path(d).absolute().as_posix()
+        if not jobs.enqueue(path):
+            print(f'{d} is already queued')
+
+    status = jobs.status()
+    print(', '.join(f'{status.get(s, 0)} {s}' for s in ['pending', 'running', 'done', 'failed']))
+    for description, error in jobs.failures():
+        print(f'    failed: {description}: {error}')
+    return True
+
+
+def worker(args: WorkerArguments) -> bool:
+    name = f'{socket.gethostname()}:{os.getpid()}'
+    jobs = JobQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+    success = True
+
+    # The repo may be relative to where the worker was started
+    args.repo = pathlib.Path(args.repo).absolute().as_posix()
+
+    with util.tmpdir(f'worker-{os.getpid()}', args.cleanup) as workdir:
+        os.chdir(workdir)
+        while True:
+            claimed = jobs.claim(name)
+            if claimed is None:
+                if args.exit_when_empty:
+                    break
+                time.sleep(args.poll_interval)
+                continue
+
+            job, d = claimed
+            print(f'{name}: building {d}')
+            heartbeat = _Heartbeat(jobs, job, name)
+            heartbeat.start()
+            try:
+                # Build into a fresh local repo, then publish only what this
+                # job produced
+                with util.tmpdir(f'worker-{os.getpid()}-{job}', args.cleanup) as local:
+                    bargs = typing.cast('WorkerArguments', argparse.Namespace(**vars(args)))
+                    bargs.repo = (local / 'repo').as_posix()
+                    bargs.export = True
+                    bargs.install = False
+                    bargs.gpg = None
+                    with run.Reporter.from_args(args) as reporter:
+                        description = load_description(d)
+                        asyncio.run(build_description(bargs, description, reporter, d))
+                        _publish(args, local / 'repo', util.appid(description), reporter)
+            except Exception as e:
+                print(f'{name}: building {d} failed: {e}')
+                success = False
+                if not jobs.finish(job, name, str(e)):
+                    print(f'{name}: lost the lease on {d}, leaving it to the worker that took it over')
+            else:
+                if not jobs.finish(job, name):
+                    print(f'{name}: lost the lease on {d}, leaving it to the worker that took it over')
+            finally:
+                heartbeat.stopped.set()
+                heartbeat.join()
+
+    return success
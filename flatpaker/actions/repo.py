@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Maintenance for the repo flatpaks are exported to."""
+
+from __future__ import annotations
+import fnmatch
+import json
+import os
+import pathlib
+import subprocess
+import typing
+
+from flatpaker import util
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import RepoArguments
+
+
+# Where the refs seen at the last summary update are recorded
+_REFS_STATE = '.flatpaker-refs.json'
+
+
+class _ObjectStats(typing.NamedTuple):
+
+    objects: int
+    size: int
+
+
+def _object_stats(repo: pathlib.Path) -> _ObjectStats:
+    count = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(repo / 'objects'):
+        for fn in filenames:
+            count += 1
+            size += os.lstat(os.path.join(dirpath, fn)).st_size
+    return _ObjectStats(count, size)
+
+
+def _report(before: _ObjectStats, after: _ObjectStats) -> None:
+    print(f'Objects: {before.objects} -> {after.objects} '
+          f'({before.objects - after.objects} removed, {util.format_size(before.size - after.size)} reclaimed)')
+
+
+def _ostree_prune(repo: pathlib.Path, *extra: str) -> None:
+    subprocess.run(['ostree', 'prune', f'--repo={repo}', '--refs-only', *extra], check=True)
+
+
+def _prune(args: RepoArguments, repo: pathlib.Path) -> None:
+    # Refs with an explicit depth are pruned in groups, everything else gets
+    # the default depth
+    groups: typing.Dict[int, typing.List[str]] = {}
+    for ref in util.repo_refs(repo):
+        depth = next((d for g, d in args.ref_depth.items() if fnmatch.fnmatch(ref, g)), args.depth)
+        groups.setdefault(depth, []).append(ref)
+
+    for depth, refs in sorted(groups.items()):
+        print(f'Pruning {len(refs)} ref(s) to a depth of {depth}')
+        _ostree_prune(repo, f'--depth={depth}', *[f'--only-branch={r}' for r in refs])
+
+    _gc(repo)
+
+
+def _gc(repo: pathlib.Path) -> None:
+    # With no depth, this only removes objects not reachable from any ref
+    _ostree_prune(repo)
+
+
+def update_summary(repo: pathlib.Path, gpg: typing.Optional[str], force: bool = False) -> None:
+    """Regenerate the summary and appstream data if the refs have changed.
+
+    The caller must hold the repo lock, a shared lock is enough as this
+    doesn't remove anything.
+    """
+    state = repo / _REFS_STATE
+    refs = util.repo_refs(repo)
+    if not force and state.exists():
+        with state.open('r') as f:
+            if json.load(f) == refs:
+                print('Refs are unchanged, not regenerating the summary')
+                return
+
+    command = ['flatpak', 'build-update-repo', repo.as_posix()]
+    if gpg:
+        command.extend(['--gpg-sign', gpg])
+    subprocess.run(command, check=True)
+
+    # Several updates may run at once, so replace the state atomically
+    tmp = state.with_name(f'{state.name}.{os.getpid()}')
+    with tmp.open('w') as f:
+        json.dump(refs, f)
+    tmp.replace(state)
+
+
+def maintain_repo(args: RepoArguments) -> bool:
+    path = pathlib.Path(args.repo)
+    if not (path / 'config').exists():
+        print(f'{args.repo} is not an ostree repo')
+        return False
+
+    if args.repo_action == 'update':
+        # Nothing is removed, so exporting builds may carry on meanwhile
+        with util.repo_lock(args.repo):
+            update_summary(path, args.gpg, args.force)
+        return True
+
+    with util.repo_lock(args.repo, exclusive=True):
+        before = _object_stats(path)
+        if args.repo_action == 'prune':
+            _prune(args, path)
+            update_summary(path, args.gpg, args.force)
+        else:
+            _gc(path)
+        _report(before, _object_stats(path))
+
+    return True
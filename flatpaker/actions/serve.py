@@ -0,0 +1,261 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Serve the repo over HTTP, for pulling from other machines on the network.
+
+A pull fetches every object of a commit as its own request, which can be
+hundreds of thousands of small files for a game. This keeps connections
+open between requests, sends files with sendfile(), supports range requests
+for resuming large static deltas, and marks content addressed files as
+immutable, so that proxies and clients never revalidate them. Everything
+else (the summary, refs, and config) changes when the repo is updated, and
+is revalidated with its ETag on every request.
+"""
+
+from __future__ import annotations
+import email.utils
+import http.server
+import os
+import posixpath
+import signal
+import threading
+import time
+import typing
+import urllib.parse
+
+from flatpaker import util
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import ServeArguments
+
+# Named by their checksum, so their content can never change
+_IMMUTABLE = ('objects/', 'deltas/', 'summaries/')
+
+# How long an idle keep-alive connection is held open
+_IDLE_TIMEOUT = 60
+
+
+class _Client:
+
+    def __init__(self) -> None:
+        self.connections = 0
+        self.requests = 0
+        self.bytes = 0
+        # Time spent handling requests, rather than waiting for them
+        self.busy = 0.0
+
+
+class _Stats:
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.total: typing.Dict[str, _Client] = {}
+        self.interval: typing.Dict[str, _Client] = {}
+
+    def add(self, client: str, requests: int, sent: int, busy: float, connections: int = 0) -> None:
+        with self.lock:
+            for d in [self.total, self.interval]:
+                c = d.setdefault(client, _Client())
+                c.connections += connections
+                c.requests += requests
+                c.bytes += sent
+                c.busy += busy
+
+    def take_interval(self) -> typing.Dict[str, _Client]:
+        with self.lock:
+            interval, self.interval = self.interval, {}
+        return interval
+
+
+def _report(clients: typing.Dict[str, _Client], prefix: str) -> None:
+    for client, c in sorted(clients.items(), key=lambda c: c[1].bytes, reverse=True):
+        rate = c.bytes / c.busy if c.busy else 0
+        print(f'{prefix}{client}: {c.requests} requests on {c.connections} connection(s), '
+              f'{util.format_size(c.bytes)} ({util.format_size(rate)}/s)', flush=True)
+
+
+class _Server(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+    # Many clients opening several connections each
+    request_queue_size = 128
+
+    def __init__(self, address: typing.Tuple[str, int], root: str, verbose: bool):
+        self.root = os.path.realpath(root)
+        self.verbose = verbose
+        self.stats = _Stats()
+        super().__init__(address, _Handler)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    # HTTP/1.1 for persistent connections, which requires a Content-Length
+    # on every response
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    timeout = _IDLE_TIMEOUT
+    server: _Server
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.stats.add(self.client_address[0], 0, 0, 0.0, connections=1)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self) -> None:
+        self._serve(True)
+
+    def do_HEAD(self) -> None:
+        self._serve(False)
+
+    def _resolve(self) -> typing.Optional[str]:
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        path = posixpath.normpath(path).lstrip('/')
+        if path.startswith('..'):
+            return None
+        full = os.path.realpath(os.path.join(self.server.root, path))
+        if os.path.commonpath([full, self.server.root]) != self.server.root:
+            return None
+        return full
+
+    def _empty(self, status: int, headers: typing.Optional[typing.Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        # A 304 never has a body, and its Content-Length would be taken as
+        # the length of the cached file, which a proxy may store
+        if status != 304:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _range(self, header: str, size: int) -> typing.Optional[typing.Tuple[int, int]]:
+        """Parse a single byte range, returning its start and length.
+
+        Returns None if the range can't be satisfied, several ranges are
+        treated as the whole file, which the spec allows.
+        """
+        unit, _, spec = header.partition('=')
+        if unit.strip() != 'bytes' or ',' in spec:
+            return 0, size
+        first, _, last = spec.strip().partition('-')
+        try:
+            if not first:
+                length = min(int(last), size)
+                return (size - length, length) if length > 0 else None
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return 0, size
+        if start >= size or end < start:
+            return None
+        return start, end - start + 1
+
+    def _serve(self, body: bool) -> None:
+        begin = time.monotonic()
+        sent = 0
+        try:
+            sent = self._send(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away, there's no one to report an error to
+            self.close_connection = True
+        finally:
+            self.server.stats.add(self.client_address[0], 1, sent, time.monotonic() - begin)
+
+    def _send(self, body: bool) -> int:
+        path = self._resolve()
+        if path is None or not os.path.isfile(path):
+            self._empty(404)
+            return 0
+
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            rel = os.path.relpath(path, self.server.root)
+            headers = {
+                'ETag': etag,
+                'Last-Modified': email.utils.formatdate(st.st_mtime, usegmt=True),
+                'Accept-Ranges': 'bytes',
+                'Cache-Control': ('public, max-age=31536000, immutable' if rel.startswith(_IMMUTABLE)
+                                  else 'no-cache'),
+            }
+
+            if (inm := self.headers.get('If-None-Match')) is not None:
+                if etag in [t.strip() for t in inm.split(',')] or inm.strip() == '*':
+                    self._empty(304, headers)
+                    return 0
+            elif (ims := self.headers.get('If-Modified-Since')) is not None:
+                try:
+                    if int(st.st_mtime) <= email.utils.parsedate_to_datetime(ims).timestamp():
+                        self._empty(304, headers)
+                        return 0
+                except (TypeError, ValueError):
+                    pass
+
+            start, length = 0, st.st_size
+            status = 200
+            if (rng := self.headers.get('Range')) is not None:
+                # A resumed download of a file that has since changed gets all of it
+                if_range = self.headers.get('If-Range')
+                if if_range is None or if_range == etag:
+                    if (parsed := self._range(rng, st.st_size)) is None:
+                        self._empty(416, {**headers, 'Content-Range': f'bytes */{st.st_size}'})
+                        return 0
+                    start, length = parsed
+                    if length != st.st_size:
+                        status = 206
+                        headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{st.st_size}'
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.end_headers()
+            if not body or not length:
+                return 0
+
+            # Headers are buffered, they must go out before the file
+            self.wfile.flush()
+            sent: int = self.connection.sendfile(f, start, length)
+            return sent
+
+
+def _report_periodically(server: _Server, interval: float, stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        _report(server.stats.take_interval(), f'last {interval:.0f}s: ')
+
+
+def _interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(args: ServeArguments) -> bool:
+    if not os.path.exists(os.path.join(args.repo, 'config')):
+        print(f'{args.repo} is not an ostree repo')
+        return False
+
+    server = _Server((args.bind, args.port), args.repo, args.verbose)
+    port = server.server_address[1]
+    url = f'http://{"localhost" if args.bind in {"", "0.0.0.0"} else args.bind}:{port}/'
+    print(f'Serving {server.root} at {url}', flush=True)
+    verify = '--gpg-import=KEYFILE' if args.gpg else '--no-gpg-verify'
+    print(f'Add it with: flatpak remote-add --user {verify} NAME {url}', flush=True)
+
+    # Stop cleanly, with the totals, when run as a service too
+    signal.signal(signal.SIGTERM, _interrupt)
+    stop = threading.Event()
+    if args.stats_interval:
+        threading.Thread(target=_report_periodically, args=(server, args.stats_interval, stop),
+                         daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+    _report(server.stats.total, 'total: ')
+    return True
@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import json
+import pathlib
+import statistics
+import typing
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import StartupReportArguments
+
+
+class _Run(typing.NamedTuple):
+
+    total: float
+    phases: typing.Dict[str, float]
+
+
+def _load_run(path: pathlib.Path) -> typing.Tuple[str, _Run]:
+    with path.open('r') as f:
+        data = json.load(f)
+
+    phases: typing.Dict[str, float] = {}
+    last = 0.0
+    for name, stamp in data['phases']:
+        # Phases are recorded as time since launch, convert them to durations
+        phases[name] = phases.get(name, 0.0) + stamp - last
+        last = stamp
+
+    game: str = data['game']
+    # RPG Maker games can load their plugins either way, keep them apart to
+    # compare them
+    if (plugins := data.get('plugins')) is not None:
+        game = f'{game} ({plugins} plugins)'
+
+    return game, _Run(last, phases)
+
+
+def startup_report(args: StartupReportArguments) -> bool:
+    runs: typing.Dict[str, typing.List[_Run]] = {}
+
+    for root in args.paths:
+        for log in sorted(pathlib.Path(root).expanduser().glob('**/logs/startup-*.json')):
+            try:
+                game, run = _load_run(log)
+            except (OSError, ValueError, KeyError) as e:
+                print(f'Skipping invalid log {log}: {e}')
+                continue
+            runs.setdefault(game, []).append(run)
+
+    if not runs:
+        print('No startup logs found. Run a game with FLATPAKER_TRACE=1 set to create some.')
+        return True
+
+    for game, gruns in sorted(runs.items(), key=lambda x: statistics.median(r.total for r in x[1]), reverse=True):
+        total = statistics.median(r.total for r in gruns)
+        print(f'{game}: {len(gruns)} run(s), median {total:.2f}s to last recorded phase '
+              f'(min {min(r.total for r in gruns):.2f}s, max {max(r.total for r in gruns):.2f}s)')
+
+        names = {n for r in gruns for n in r.phases}
+        medians = {n: statistics.median(r.phases.get(n, 0.0) for r in gruns) for n in names}
+        for name, duration in sorted(medians.items(), key=lambda x: x[1], reverse=True)[:args.phases]:
+            print(f'    {name:<40} {duration:6.2f}s')
+
+    return True
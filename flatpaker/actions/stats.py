@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import datetime
+import statistics
+import typing
+
+from flatpaker import util
+from flatpaker.stats import StatsDB
+
+if typing.TYPE_CHECKING:
+    from flatpaker.entry import StatsArguments
+
+
+def report_stats(args: StatsArguments) -> bool:
+    db = StatsDB()
+    found = False
+
+    for appid in db.appids():
+        if args.appids and appid not in args.appids:
+            continue
+        history = db.history(appid)
+        if not history:
+            continue
+
+        last = history[-1]
+        # Builds with a different builder aren't comparable
+        previous = [b for b in history[:-1] if b.builder == last.builder][-args.history:]
+        baseline = statistics.median(b.wall_time for b in previous) if previous else last.wall_time
+        change = (last.wall_time - baseline) / baseline if baseline else 0.0
+        regressed = change > args.threshold
+        if args.regressions and not regressed:
+            continue
+        found = True
+
+        when = datetime.datetime.fromtimestamp(last.started).strftime('%Y-%m-%d %H:%M')
+        print(f'{appid}: {len(history)} build(s), last on {when}{"  REGRESSION" if regressed else ""}')
+        print(f'    wall time:    {last.wall_time:8.1f}s ({change:+.0%} vs median of previous {len(previous)})')
+        print(f'    peak disk:    {util.format_size(last.peak_disk)}')
+        print(f'    source size:  {util.format_size(last.source_bytes)}')
+
+        builders: typing.Dict[str, typing.List[float]] = {}
+        for b in history:
+            builders.setdefault(b.builder, []).append(b.wall_time)
+        if len(builders) > 1:
+            print('    by builder:   ' + ', '.join(
+                f'{name} {statistics.median(times):.1f}s ({len(times)} builds)' for name, times in sorted(builders.items())))
+
+        if args.verbose:
+            for b in history[-args.history:]:
+                when = datetime.datetime.fromtimestamp(b.started).strftime('%Y-%m-%d %H:%M')
+                print(f'        {when}  {b.wall_time:8.1f}s  {util.format_size(b.peak_disk)}  {b.builder}')
+
+    if not found:
+        print('No matching builds recorded')
+
+    return True
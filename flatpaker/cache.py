@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Management of the caches and scratch directories flatpaker uses.
+
+Everything lives under one root, split into kinds, each holding one entry
+per app or runtime:
+
+- workdirs: generated manifests and other files for a build
+- build: flatpak-builder's build directories
+- state: flatpak-builder's state directories, including its module cache
+
+Entries are locked while in use, and each kind may be given a size budget,
+which is enforced by evicting the least recently used entries.
+"""
+
+from __future__ import annotations
+import contextlib
+import fcntl
+import functools
+import os
+import pathlib
+import re
+import shutil
+import time
+import typing
+
+from . import config
+
+if typing.TYPE_CHECKING:
+    from .config import Cache
+
+KINDS = ['workdirs', 'build', 'state']
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', re.IGNORECASE)
+
+
+class Entry(typing.NamedTuple):
+
+    kind: str
+    name: str
+    path: pathlib.Path
+    size: int
+    last_used: float
+
+
+def parse_size(size: typing.Union[str, int]) -> int:
+    """Parse a size such as 512M or 20G into bytes."""
+    if isinstance(size, int):
+        return size
+    m = _SIZE.match(size)
+    if m is None:
+        raise ValueError(f'Invalid size: {size}')
+    return int(float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2).upper() or ' '))
+
+
+@functools.lru_cache(maxsize=None)
+def _config() -> Cache:
+    """The cache section of the configuration, read once per process."""
+    return config.load_config()['cache']
+
+
+def root() -> pathlib.Path:
+    conf = _config()
+    if 'root' in conf:
+        return pathlib.Path(conf['root']).expanduser()
+    return pathlib.Path(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'flatpaker')
+
+
+def budgets() -> typing.Dict[str, int]:
+    return {k: parse_size(v) for k, v in _config().get('budgets', {}).items()}
+
+
+def min_free() -> int:
+    return parse_size(_config().get('min-free', '5G'))
+
+
+def _lockfile(kind: str, name: str) -> pathlib.Path:
+    return root() / kind / f'.{name}.lock'
+
+
+@contextlib.contextmanager
+def entry(kind: str, name: str, cleanup: bool = False) -> typing.Iterator[pathlib.Path]:
+    """Use an entry, marking it as recently used and protecting it from eviction."""
+    assert kind in KINDS, 'unknown cache kind'
+    path = root() / kind / name
+    path.mkdir(parents=True, exist_ok=True)
+    with _lockfile(kind, name).open('w') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        # The directory may have been evicted while we waited for the lock
+        path.mkdir(parents=True, exist_ok=True)
+        os.utime(path)
+        try:
+            yield path
+        finally:
+            if cleanup:
+                shutil.rmtree(path, ignore_errors=True)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _size(path: pathlib.Path) -> int:
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            with contextlib.suppress(OSError):
+                size += os.lstat(os.path.join(dirpath, fn)).st_size
+    return size
+
+
+def entries(kind: str) -> typing.List[Entry]:
+    """All entries of a kind, least recently used first."""
+    kdir = root() / kind
+    if not kdir.exists():
+        return []
+    found = [Entry(kind, p.name, p, _size(p), p.stat().st_mtime)
+             for p in kdir.iterdir() if p.is_dir()]
+    return sorted(found, key=lambda e: e.last_used)
+
+
+def evict(e: Entry) -> bool:
+    """Remove an entry, unless it is in use."""
+    with _lockfile(e.kind, e.name).open('w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            shutil.rmtree(e.path, ignore_errors=True)
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    # The lock file is left in place, removing it would allow a second
+    # evictor to lock a different file than a waiting user
+    return True
+
+
+def gc(dry_run: bool = False) -> typing.List[Entry]:
+    """Evict least recently used entries until every kind is within its budget."""
+    evicted: typing.List[Entry] = []
+    for kind, budget in budgets().items():
+        es = entries(kind)
+        total = sum(e.size for e in es)
+        for e in es:
+            if total <= budget:
+                break
+            if dry_run or evict(e):
+                evicted.append(e)
+                total -= e.size
+    return evicted
+
+
+def clean(dry_run: bool = False) -> typing.List[Entry]:
+    """Remove workdirs that are not in use, left behind by crashes or --no-cleanup."""
+    return [e for e in entries('workdirs') if dry_run or evict(e)]
+
+
+def free_space() -> int:
+    path = root()
+    path.mkdir(parents=True, exist_ok=True)
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+
+def ensure_space(needed: int) -> None:
+    """Make sure there is enough space for a build, evicting from the caches if needed.
+
+    min-free is kept in reserve on top of what the build needs.
+    """
+    needed += min_free()
+    if free_space() >= needed:
+        return
+    gc()
+    if (free := free_space()) < needed:
+        raise RuntimeError(
+            f'Not enough free space in {root()}: {free} bytes free, {needed} needed. '
+            'Free some space or lower the cache budgets.')
+
+
+def last_used(e: Entry) -> str:
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(e.last_used))
@@ -14,12 +14,38 @@ if typing.TYPE_CHECKING:
         {
             'gpg-key': str,
             'repo': str,
+            'builder': typing.Literal['flatpak-builder', 'native'],
+        },
+        total=False,
+    )
+
+    Repo = typing.TypedDict(
+        'Repo',
+        {
+            'history-depth': int,
+            'ref-depth': typing.Dict[str, int],
+        },
+        total=False,
+    )
+
+    class Queue(typing.TypedDict, total=False):
+        database: str
+
+    Cache = typing.TypedDict(
+        'Cache',
+        {
+            'root': str,
+            'min-free': typing.Union[str, int],
+            'budgets': typing.Dict[str, typing.Union[str, int]],
         },
         total=False,
     )
 
     class Config(typing.TypedDict):
         common: Common
+        repo: Repo
+        queue: Queue
+        cache: Cache
 
 
 def load_config() -> Config:
@@ -33,6 +59,7 @@ def load_config() -> Config:
     else:
         raw = {}
 
-    if 'common' not in raw:
-        raw['common'] = {}
+    for section in ['common', 'repo', 'queue', 'cache']:
+        if section not in raw:
+            raw[section] = {}
     return typing.cast('Config', raw)
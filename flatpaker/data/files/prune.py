@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Remove files a game ships that can never be used on Linux.
+
+What is dead weight depends on the engine:
+
+- RPG Maker MV and MZ ship every sound twice, as Ogg and as AAC for platforms
+  that can't play Ogg. nwjs on Linux always plays the Ogg, so any AAC file with
+  an Ogg next to it is never loaded.
+- Ren'Py games often ship the developer's saves and backups of scripts. Logs
+  are left alone, as Ren'Py writes them outside of the game directory, and a
+  file named log.txt in it may well be content.
+
+Files left by other operating systems (Thumbs.db, .DS_Store, __MACOSX) are
+removed for every engine. Anything matching a --keep glob is left alone.
+Every removed file is listed, so that a bad prune can be found in the build
+log.
+"""
+
+from __future__ import annotations
+import argparse
+import fnmatch
+import os
+import pathlib
+import typing
+
+# AAC extension -> Ogg extension, plain and encrypted for MV and MZ
+DUPLICATE_AUDIO = {
+    '.m4a': '.ogg',
+    '.rpgmvm': '.rpgmvo',
+    '.m4a_': '.ogg_',
+}
+
+OS_FILES = {'Thumbs.db', 'ehthumbs.db', 'desktop.ini', '.DS_Store'}
+OS_DIRS = {'__MACOSX'}
+
+RENPY_BACKUPS = ['*.rpy.bak', '*.rpyc.bak', '*.rpy~']
+
+
+def reason(engine: str, root: pathlib.Path, rel: pathlib.PurePosixPath) -> typing.Optional[str]:
+    """Why a file is dead weight, or None if it isn't."""
+    name = rel.name
+    if name in OS_FILES or name.startswith('._') or OS_DIRS.intersection(rel.parts):
+        return 'files from other operating systems'
+
+    if engine == 'rpgmaker':
+        suffix = rel.suffix.lower()
+        if suffix in DUPLICATE_AUDIO and 'audio' in rel.parts:
+            ogg = root / rel.with_suffix(DUPLICATE_AUDIO[suffix])
+            if ogg.exists():
+                return 'audio duplicated as Ogg'
+
+    elif engine == 'renpy':
+        if rel.parts[0] == 'saves' and len(rel.parts) > 1:
+            return 'saves shipped with the game'
+        if any(fnmatch.fnmatch(name, b) for b in RENPY_BACKUPS):
+            return 'backups'
+
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('engine', choices=['rpgmaker', 'renpy'])
+    parser.add_argument('root', type=pathlib.Path, help="The directory holding the game's assets")
+    parser.add_argument('--keep', action='append', default=[], help='Globs of files to never remove')
+    args = parser.parse_args()
+
+    removed: typing.Dict[str, typing.Tuple[int, int]] = {}
+    for dirpath, dirnames, filenames in os.walk(args.root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            p = pathlib.Path(dirpath, fn)
+            rel = pathlib.PurePosixPath(p.relative_to(args.root).as_posix())
+            if any(fnmatch.fnmatch(rel.as_posix(), k) for k in args.keep):
+                continue
+            if (why := reason(args.engine, args.root, rel)) is None:
+                continue
+            count, size = removed.get(why, (0, 0))
+            removed[why] = (count + 1, size + p.lstat().st_size)
+            print(f'Pruning {rel} ({why})')
+            p.unlink()
+
+    # Remove the directories that were emptied
+    for dirpath, _, _ in sorted(os.walk(args.root), key=lambda w: len(w[0]), reverse=True):
+        p = pathlib.Path(dirpath)
+        if p != args.root and not any(p.iterdir()):
+            rel = p.relative_to(args.root)
+            if OS_DIRS.intersection(rel.parts) or (args.engine == 'renpy' and rel.parts[0] == 'saves'):
+                p.rmdir()
+
+    total = sum(s for _, s in removed.values())
+    for why, (count, size) in sorted(removed.items(), key=lambda r: r[1][1], reverse=True):
+        print(f'Pruned {count} file(s), {size} bytes: {why}')
+    print(f'Pruned {sum(c for c, _ in removed.values())} file(s), {total} bytes ({total / 1024 / 1024:.1f} MiB) in total')
+
+
+if __name__ == '__main__':
+    main()
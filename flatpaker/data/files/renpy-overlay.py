@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Merge several game directories into the installed game directory.
+
+The directories are given lowest priority first. They are merged highest
+priority first, and files that already exist are skipped, so that every file
+is installed at most once and files overridden by a later layer are never
+installed at all.
+
+Under flatpak-builder the sources are in the module's build directory and
+$FLATPAK_DEST is a separate mount, so installing a file is a full copy, not a
+rename. That is the same cost as copying the whole directory, less the files
+that are overridden.
+
+With --replace, the game directory already holds a lower layer, installed by
+an earlier module, and files from these directories replace its files.
+"""
+
+from __future__ import annotations
+import argparse
+import glob
+import os
+import pathlib
+import shutil
+
+
+def install(src: pathlib.Path, dest: pathlib.Path) -> None:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # A rename when both are on the same mount, otherwise a copy
+    shutil.move(src, dest)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dest', type=pathlib.Path)
+    parser.add_argument('roots', nargs='+', help='game directories, lowest priority first')
+    parser.add_argument('--glob', help='Also merge directories matching this glob, after the roots')
+    parser.add_argument('--replace', action='store_true', help='Replace files already in dest')
+    args = parser.parse_args()
+
+    roots: list[str] = args.roots
+    if args.glob:
+        roots.extend(r for r in sorted(glob.glob(args.glob)) if r not in roots)
+
+    installed = 0
+    skipped = 0
+    replaced = 0
+    # What this run installed, anything else in dest is from a lower layer
+    ours: set[pathlib.Path] = set()
+    for root in reversed(roots):
+        if not os.path.isdir(root):
+            print(f'{root} does not exist, skipping')
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for fn in filenames:
+                src = pathlib.Path(dirpath, fn)
+                dest = args.dest / src.relative_to(root)
+                if os.path.lexists(dest):
+                    if dest in ours or not args.replace:
+                        skipped += 1
+                        continue
+                    dest.unlink()
+                    replaced += 1
+                install(src, dest)
+                ours.add(dest)
+                installed += 1
+
+    print(f'Installed {installed} files from {len(roots)} layer(s), {skipped} overridden files skipped, '
+          f'{replaced} files of earlier layers replaced')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Pack a Ren'Py game's loose assets into RPA archives.
+
+Every loose file becomes a separate OSTree object, which makes committing,
+pulling, and generating deltas for games with tens of thousands of assets
+slow. Ren'Py loads assets from archives transparently, so packing them costs
+nothing at runtime.
+
+Only known image, audio, video, and font types are packed. Scripts, Python
+modules, caches, and any other data stay loose, as games sometimes open those
+by path instead of through Ren'Py's loader.
+"""
+
+from __future__ import annotations
+import argparse
+import fnmatch
+import os
+import pathlib
+import pickle
+import typing
+import zlib
+
+ASSETS = {
+    # images
+    '.png', '.jpg', '.jpeg', '.webp', '.avif', '.gif', '.bmp', '.svg',
+    # audio
+    '.ogg', '.opus', '.mp3', '.wav', '.flac',
+    # video
+    '.webm', '.mkv', '.ogv', '.mp4', '.avi', '.mpg', '.mpeg',
+    # fonts
+    '.ttf', '.otf', '.ttc',
+}
+
+# Directories that are never packed
+SKIP_DIRS = {'cache', 'saves', 'python-packages'}
+
+# Ren'Py gives archives whose names sort later priority, the same priority a
+# loose file would have had over the game's own archives
+PREFIX = 'zzz_flatpaker_'
+
+KEY = 0x42424242
+
+
+def collect(gamedir: pathlib.Path, exclude: typing.List[str]) -> typing.List[pathlib.Path]:
+    files: typing.List[pathlib.Path] = []
+    for dirpath, dirnames, filenames in os.walk(gamedir):
+        if pathlib.Path(dirpath) == gamedir:
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        dirnames.sort()
+        for fn in sorted(filenames):
+            p = pathlib.Path(dirpath, fn)
+            rel = p.relative_to(gamedir).as_posix()
+            if p.suffix.lower() not in ASSETS or p.is_symlink():
+                continue
+            if any(fnmatch.fnmatch(rel, e) for e in exclude):
+                continue
+            files.append(p)
+    return files
+
+
+def count_files(gamedir: pathlib.Path) -> int:
+    """Count the files of the game directory, each of which is an OSTree object."""
+    return sum(len(filenames) for _, _, filenames in os.walk(gamedir))
+
+
+def write_archive(gamedir: pathlib.Path, name: str, files: typing.List[pathlib.Path]) -> int:
+    """Write an RPA-3.0 archive, which every supported Ren'Py can read.
+
+    Returns the size of the archive.
+    """
+    index: typing.Dict[str, typing.List[typing.Tuple[int, int]]] = {}
+    with (gamedir / name).open('wb') as f:
+        # The header is rewritten once the offset of the index is known
+        header_len = len(b'RPA-3.0 %016x %08x\n' % (0, 0))
+        f.write(b'\0' * header_len)
+        for p in files:
+            data = p.read_bytes()
+            index[p.relative_to(gamedir).as_posix()] = [(f.tell() ^ KEY, len(data) ^ KEY)]
+            f.write(data)
+
+        offset = f.tell()
+        f.write(zlib.compress(pickle.dumps(index, protocol=2)))
+        f.seek(0)
+        f.write(b'RPA-3.0 %016x %08x\n' % (offset, KEY))
+        size = f.seek(0, os.SEEK_END)
+
+    for p in files:
+        p.unlink()
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('gamedir', type=pathlib.Path, help="The game's game directory")
+    parser.add_argument('--max-size', type=int, default=1024, help='Maximum size of each archive in MiB')
+    parser.add_argument('--exclude', action='append', default=[], help='Globs of files to leave loose')
+    args = parser.parse_args()
+
+    before = count_files(args.gamedir)
+    files = collect(args.gamedir, args.exclude)
+    limit = args.max_size * 1024 * 1024
+
+    # Files are grouped in path order, so that related files (and so likely
+    # to change together) share an archive
+    groups: typing.List[typing.List[pathlib.Path]] = [[]]
+    size = 0
+    for p in files:
+        fsize = p.stat().st_size
+        if groups[-1] and size + fsize > limit:
+            groups.append([])
+            size = 0
+        groups[-1].append(p)
+        size += fsize
+
+    total = 0
+    archives = 0
+    for i, group in enumerate(g for g in groups if g):
+        name = f'{PREFIX}{i:02}.rpa'
+        packed = sum(p.stat().st_size for p in group)
+        written = write_archive(args.gamedir, name, group)
+        print(f'Wrote {name}: {len(group)} files, {packed} bytes packed, {written} bytes written')
+        total += packed
+        archives += 1
+
+    after = count_files(args.gamedir)
+    print(f'Packed {len(files)} files ({total} bytes) into {archives} archive(s)')
+    print(f'Files to commit in the game directory: {before} before, {after} after')
+
+
+if __name__ == '__main__':
+    main()
@@ -31,10 +31,19 @@
 
 from __future__ import print_function, absolute_import
 
+import atexit
+import json
 import os
+import shutil
 import sys
+import time
 import warnings
 
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser # type: ignore
+
 # Functions to be customized by distributors. ################################
 
 _game_name = ''
@@ -93,17 +102,179 @@ def path_to_logdir(basedir):
         _game_name, 'logs')
 
 
+def path_to_cache_overlay():
+    """
+    Returns the absolute path to the writable cache overlay, or None if the
+    game directory itself is writable.
+
+    The bytecode and analysis caches are generated at build time and shipped
+    read-only inside the game directory. Anything Ren'Py needs to regenerate
+    at runtime is written here instead, and found first by the loader.
+    """
+    gamedir = path_to_gamedir('', '')
+    if os.access(gamedir, os.W_OK):
+        return None
+    return os.path.join(
+        os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share')),
+        _game_name, 'cache-overlay')
+
+
+def _app_commit():
+    parser = configparser.ConfigParser()
+    try:
+        parser.read('/.flatpak-info')
+        return parser.get('Instance', 'app-commit')
+    except Exception:
+        return ''
+
+
+def _setup_cache_overlay(overlay):
+    """
+    Prepares the overlay and redirects Ren'Py's cache writes into it.
+
+    The overlay is discarded whenever the installed commit changes, so that
+    stale caches from an older build never shadow the prebuilt ones.
+    """
+    import renpy.loader
+
+    stamp = os.path.join(overlay, '.app-commit')
+    commit = _app_commit()
+    try:
+        with open(stamp) as f:
+            current = f.read()
+    except (IOError, OSError):
+        current = None
+
+    if current != commit:
+        shutil.rmtree(overlay, ignore_errors=True)
+        try:
+            os.makedirs(overlay)
+            with open(stamp, 'w') as f:
+                f.write(commit)
+        except (IOError, OSError):
+            pass
+
+    def get_path(fn):
+        fn = os.path.join(overlay, fn)
+        dn = os.path.dirname(fn)
+        try:
+            if not os.path.exists(dn):
+                os.makedirs(dn)
+        except Exception:
+            pass
+        return fn
+
+    renpy.loader.get_path = get_path
+
+
 def predefined_searchpath(commondir):
-    return [path_to_gamedir('', ''), commondir]
+    # This is called early in renpy.main.main, which makes it the first place
+    # the rest of Ren'Py can be hooked
+    if _trace is not None:
+        _trace.install_hooks()
+
+    searchpath = [path_to_gamedir('', ''), commondir]
+
+    overlay = path_to_cache_overlay()
+    if overlay is not None:
+        _setup_cache_overlay(overlay)
+        searchpath.insert(0, overlay)
+
+    return searchpath
 
 
 ##############################################################################
 
 
+class _StartupTrace(object):
+    """
+    Records timestamps of the major startup phases.
+
+    Enabled by setting FLATPAKER_TRACE in the environment. If it is set to
+    "profile" a cProfile dump of startup is written as well. The results are
+    written into the log directory on the first interaction.
+    """
+
+    def __init__(self, mode):
+        self.start = float(os.environ.get('FLATPAKER_TRACE_START') or time.time())
+        self.phases = []
+        self.hooked = False
+        self.written = False
+        self.profile = None
+        if mode == 'profile':
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def mark(self, name):
+        self.phases.append((name, time.time() - self.start))
+
+    def install_hooks(self):
+        if self.hooked:
+            return
+        self.hooked = True
+
+        import renpy.main
+        import renpy.display.core
+
+        # Ren'Py already times each phase of startup with log_clock, piggyback
+        # on that to get the phase names
+        log_clock = getattr(renpy.main, 'log_clock', None)
+        if log_clock is not None:
+            def traced_log_clock(s):
+                log_clock(s)
+                self.mark(s)
+            renpy.main.log_clock = traced_log_clock
+
+        interface = renpy.display.core.Interface
+        interact = interface.__dict__['interact']
+
+        def traced_interact(*args, **kwargs):
+            interface.interact = interact
+            self.mark('First interaction')
+            self.write()
+            return interact(*args, **kwargs)
+        interface.interact = traced_interact
+
+    def write(self):
+        if self.written:
+            return
+        self.written = True
+
+        import renpy
+
+        logdir = path_to_logdir('')
+        if not os.path.exists(logdir):
+            os.makedirs(logdir)
+        base = os.path.join(logdir, 'startup-' + time.strftime('%Y%m%d-%H%M%S'))
+
+        data = {
+            'game': _game_name,
+            'renpy': getattr(renpy, 'version_only', None),
+            'started': self.start,
+            'phases': self.phases,
+        }
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(base + '.prof')
+            data['profile'] = os.path.basename(base + '.prof')
+
+        with open(base + '.json', 'w') as f:
+            json.dump(data, f)
+
+
+_trace = None
+
 android = False
 
 def main():
-    global _game_name
+    global _game_name, _trace
+
+    if os.environ.get('FLATPAKER_TRACE'):
+        _trace = _StartupTrace(os.environ['FLATPAKER_TRACE'])
+        _trace.mark('Python main')
+        # Still write what we have if the game exits before interacting
+        atexit.register(_trace.write)
 
     # We're being a bit tricky here.
     # We're passing extra arguments, then storing and removing them
@@ -120,6 +291,9 @@ def main():
 
     import renpy.bootstrap
 
+    if _trace is not None:
+        _trace.mark('Import renpy')
+
     # Set renpy.__main__ to this module.
     renpy.__main__ = sys.modules[__name__] # type: ignore
 
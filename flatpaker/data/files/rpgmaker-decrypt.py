@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Decrypt RPG Maker MV and MZ assets at build time.
+
+MV and MZ can ship "encrypted" images and audio, which are really the original
+file with a 16 byte header prepended and the first 16 bytes XORed with a key
+stored in System.json. The engine undoes this in JavaScript every time an
+asset is loaded. Doing it once at build time means the runtime can load plain
+files directly.
+"""
+
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import typing
+
+HEADER_LEN = 16
+
+# Encrypted extension -> (plain extension, System.json flag)
+EXTENSIONS: typing.Dict[str, typing.Tuple[str, str]] = {
+    # MV
+    '.rpgmvp': ('.png', 'hasEncryptedImages'),
+    '.rpgmvo': ('.ogg', 'hasEncryptedAudio'),
+    '.rpgmvm': ('.m4a', 'hasEncryptedAudio'),
+    # MZ
+    '.png_': ('.png', 'hasEncryptedImages'),
+    '.ogg_': ('.ogg', 'hasEncryptedAudio'),
+    '.m4a_': ('.m4a', 'hasEncryptedAudio'),
+}
+
+
+def find_system(root: pathlib.Path) -> pathlib.Path:
+    for candidate in [root / 'data' / 'System.json', root / 'www' / 'data' / 'System.json']:
+        if candidate.exists():
+            return candidate
+    raise RuntimeError(f'Could not find System.json in {root}')
+
+
+def digest(path: pathlib.Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def decrypt(src: pathlib.Path, key: bytes) -> pathlib.Path:
+    data = src.read_bytes()
+    if len(data) < HEADER_LEN * 2 or not data.startswith(b'RPGMV'):
+        raise RuntimeError(f'{src} does not have an RPG Maker header')
+
+    head = bytes(b ^ k for b, k in zip(data[HEADER_LEN:HEADER_LEN * 2], key))
+    dest = src.with_suffix(EXTENSIONS[src.suffix][0])
+    # Some games also ship the plain file. The engine loads the encrypted one,
+    # so that wins. Unlinked rather than truncated, in case it is a link
+    dest.unlink(missing_ok=True)
+    with dest.open('wb') as f:
+        f.write(head)
+        f.write(data[HEADER_LEN * 2:])
+    src.unlink()
+    return dest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', type=pathlib.Path, help='The root of the game')
+    parser.add_argument('-j', '--jobs', type=int, default=int(os.environ.get('FLATPAK_BUILDER_N_JOBS', 0)) or None)
+    args = parser.parse_args()
+
+    system_json = find_system(args.root)
+    with system_json.open('r', encoding='utf-8') as f:
+        system = json.load(f)
+
+    key = bytes.fromhex(system.get('encryptionKey', ''))
+    if len(key) != HEADER_LEN:
+        print('No valid encryptionKey in System.json, nothing to do')
+        return
+
+    # Games often ship the same asset under several names, group them by
+    # content so that each distinct asset is only decrypted once. Only files
+    # the same size as another can be the same, so only those are hashed
+    by_size: typing.Dict[int, typing.List[pathlib.Path]] = {}
+    for dirpath, _, filenames in os.walk(args.root):
+        for fn in filenames:
+            p = pathlib.Path(dirpath, fn)
+            if p.suffix in EXTENSIONS:
+                by_size.setdefault(p.stat().st_size, []).append(p)
+
+    count = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        groups = [paths for paths in by_size.values() if len(paths) == 1]
+        candidates = [p for paths in by_size.values() if len(paths) > 1 for p in paths]
+        by_hash: typing.Dict[str, typing.List[pathlib.Path]] = {}
+        for p, h in zip(candidates, executor.map(digest, candidates, chunksize=16)):
+            by_hash.setdefault(h, []).append(p)
+        groups.extend(by_hash.values())
+
+        futures = {executor.submit(decrypt, paths[0], key): paths for paths in groups}
+        for future in concurrent.futures.as_completed(futures):
+            paths = futures[future]
+            try:
+                first = future.result()
+            except Exception as e:
+                # A half decrypted game is broken, so fail the build
+                sys.exit(f'{e}\nSet x_rpgmaker_decrypt_assets to false for this game')
+            for dup in paths[1:]:
+                dest = dup.with_suffix(EXTENSIONS[dup.suffix][0])
+                # As in decrypt()
+                dest.unlink(missing_ok=True)
+                os.link(first, dest)
+                dup.unlink()
+            count += len(paths)
+
+    print(f'Decrypted {count} files ({len(groups)} unique)')
+
+    system['hasEncryptedImages'] = False
+    system['hasEncryptedAudio'] = False
+    with system_json.open('w', encoding='utf-8') as f:
+        json.dump(system, f, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
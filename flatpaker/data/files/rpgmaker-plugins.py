@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Bundle the plugins of an RPG Maker MV or MZ game into one script.
+
+PluginManager.setup adds a script tag for every enabled plugin in
+js/plugins.js, so the engine reads and compiles dozens to hundreds of small
+files, one after another, every time it starts. This concatenates them, in
+the order the engine would load them, into js/flatpaker-plugins.js, and
+appends a loader to the managers that loads that instead.
+
+The plugins are left in place. If the bundle can't be loaded, doesn't parse,
+or a plugin in it throws, the loader loads the plugins it didn't get to one
+at a time, as the engine would have. It does the same for all of them if
+js/plugins.js no longer matches the bundle, and setting
+FLATPAKER_PLUGINS=separate in the environment always loads them that way.
+
+One script doesn't behave exactly like one script per plugin: strict mode
+directives only apply at the start of a script, and declarations are hoisted
+to the start of the script they're in. Games with plugins that would notice
+are not bundled, see find_unsafe. document.currentScript is faked for each
+plugin, as some use it to find their own name.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import pathlib
+import sys
+import typing
+
+BUNDLE = 'flatpaker-plugins.js'
+MARKER = '// Added by flatpaker: plugin bundle loader'
+
+LOADER = MARKER + '''
+// Load the plugins from js/flatpaker-plugins.js, made at build time, instead
+// of one script per plugin. Anything the bundle didn't load is loaded one
+// plugin at a time, as it would have been.
+(function() {
+    var setup = PluginManager.setup;
+    var loadScript = PluginManager.loadScript;
+    // The plugins in the bundle, in order
+    var bundled = @PLUGINS@;
+
+    PluginManager.setup = function(plugins) {
+        if (typeof process !== 'undefined' && process.env.FLATPAKER_PLUGINS === 'separate') {
+            window.$flatpakerPlugins = null;
+            return setup.apply(this, arguments);
+        }
+
+        // Let the engine decide what to load, and in what order
+        var names = [];
+        PluginManager.loadScript = function(name) {
+            names.push(name);
+        };
+        try {
+            setup.apply(this, arguments);
+        } finally {
+            PluginManager.loadScript = loadScript;
+        }
+
+        var self = this;
+        if (JSON.stringify(names) !== JSON.stringify(bundled)) {
+            // setup has already recorded these plugins as loaded, so calling
+            // it again would load nothing. Load them as it would have instead
+            console.warn('flatpaker: js/plugins.js does not match the plugin bundle, loading plugins separately');
+            window.$flatpakerPlugins = null;
+            names.forEach(function(name) {
+                loadScript.call(self, name);
+            });
+            return;
+        }
+
+        var state = window.$flatpakerPlugins = {
+            started: -1,
+            done: false,
+            fellBack: false,
+            begin: function(i) {
+                state.started = i;
+                var url = self.makeUrl ? self.makeUrl(names[i]) : self._path + names[i];
+                var current = document.createElement('script');
+                current.src = url;
+                current._url = url;
+                Object.defineProperty(document, 'currentScript', {
+                    configurable: true,
+                    get: function() { return current; },
+                });
+            },
+            end: function() {
+                delete document.currentScript;
+                state.done = true;
+            },
+        };
+
+        function fallback() {
+            delete document.currentScript;
+            state.fellBack = true;
+            for (var i = state.started + 1; i < names.length; i++) {
+                loadScript.call(self, names[i]);
+            }
+        }
+
+        var script = document.createElement('script');
+        script.type = 'text/javascript';
+        script.src = 'js/' + 'flatpaker-plugins.js';
+        script.async = false;
+        script.onload = function() {
+            if (!state.done) {
+                fallback();
+            }
+        };
+        script.onerror = fallback;
+        document.body.appendChild(script);
+    };
+})();
+'''
+
+# A regular expression can follow these, a division can't
+_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw',
+    'instanceof', 'yield', 'await',
+}
+
+# A function or class after these is an expression, not a declaration
+_EXPRESSION_AFTER = _REGEX_AFTER - set(';{}') | _REGEX_KEYWORDS | {'.', '/'}
+
+
+def _tokens(src: str) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Split JavaScript into tokens, coarsely.
+
+    Yields (kind, text) pairs, where kind is one of space, comment, literal,
+    word, or punct, and the texts joined back together are the source.
+    Template literals are split around their substitutions, which are
+    tokenized as code.
+    """
+    # The last token, a punctuator or a word
+    prev = ''
+    # What each open brace belongs to: code, or a ${} in a template literal
+    braces: typing.List[bool] = []
+    i = 0
+    n = len(src)
+
+    def template(start: int) -> int:
+        """Scan template text, up to its end or the start of a substitution."""
+        j = start
+        while j < n:
+            c = src[j]
+            if c == '\\':
+                j += 2
+            elif c == '`':
+                return j + 1
+            elif c == '$' and src.startswith('${', j):
+                braces.append(True)
+                return j + 2
+            else:
+                j += 1
+        return n
+
+    while i < n:
+        c = src[i]
+        if c in ' \t\r\n\f\v':
+            j = i + 1
+            while j < n and src[j] in ' \t\r\n\f\v':
+                j += 1
+            yield 'space', src[i:j]
+            i = j
+        elif src.startswith('//', i):
+            j = src.find('\n', i)
+            j = n if j == -1 else j
+            yield 'comment', src[i:j]
+            i = j
+        elif src.startswith('/*', i):
+            j = src.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            yield 'comment', src[i:j]
+            i = j
+        elif c in '\'"':
+            j = i + 1
+            while j < n and src[j] != c and src[j] != '\n':
+                j += 2 if src[j] == '\\' else 1
+            j = min(j + 1, n)
+            yield 'literal', src[i:j]
+            i = j
+            prev = 'string'
+        elif c == '`':
+            j = template(i + 1)
+            yield 'literal', src[i:j]
+            i = j
+            prev = 'string'
+        elif c == '/' and (prev == '' or prev in _REGEX_AFTER or prev in _REGEX_KEYWORDS):
+            j = i + 1
+            in_class = False
+            while j < n and src[j] != '\n':
+                if src[j] == '\\':
+                    j += 1
+                elif src[j] == '[':
+                    in_class = True
+                elif src[j] == ']':
+                    in_class = False
+                elif src[j] == '/' and not in_class:
+                    break
+                j += 1
+            if j < n and src[j] == '/':
+                yield 'literal', src[i:j + 1]
+                i = j + 1
+                prev = 'regex'
+            else:
+                # Not a regular expression after all
+                yield 'punct', c
+                i += 1
+                prev = c
+        elif c.isalnum() or c in '_$' or ord(c) > 127:
+            j = i
+            while j < n and (src[j].isalnum() or src[j] in '_$' or ord(src[j]) > 127):
+                j += 1
+            yield 'word', src[i:j]
+            prev = src[i:j]
+            i = j
+        elif c == '}' and braces and braces[-1]:
+            # The end of a substitution, back into the template
+            braces.pop()
+            j = template(i + 1)
+            yield 'literal', src[i:j]
+            i = j
+            prev = 'string'
+        else:
+            if c == '{':
+                braces.append(False)
+            elif c == '}' and braces:
+                braces.pop()
+            yield 'punct', c
+            prev = c
+            i += 1
+
+
+def minify(src: str) -> str:
+    """Remove comments, indentation, and blank lines.
+
+    This is deliberately conservative. Line breaks are kept, so that
+    automatic semicolon insertion isn't affected, and strings, template
+    literals, and regular expressions are copied as they are.
+    """
+    out: typing.List[str] = []
+    # Lines of the output that start or end inside a literal, which must be
+    # kept as they are at that end
+    starts: typing.Set[int] = set()
+    ends: typing.Set[int] = set()
+    lines = 0
+
+    for kind, text in _tokens(src):
+        if kind == 'comment':
+            if text.startswith('//'):
+                continue
+            text = '\n' if '\n' in text else ' '
+        elif kind == 'literal':
+            for _ in range(text.count('\n')):
+                ends.add(lines)
+                lines += 1
+                starts.add(lines)
+            out.append(text)
+            continue
+        lines += text.count('\n')
+        out.append(text)
+
+    result: typing.List[str] = []
+    for number, line in enumerate(''.join(out).split('\n')):
+        if number not in starts:
+            line = line.lstrip()
+        if number not in ends:
+            line = line.rstrip()
+        if line or number in starts or number in ends:
+            result.append(line)
+    return '\n'.join(result)
+
+
+class _Script(typing.NamedTuple):
+
+    strict: bool
+    # Names declared at the top level with function, class, let, or const
+    declared: typing.Set[str]
+    # Every identifier used anywhere in it
+    words: typing.Set[str]
+
+
+def _scan(src: str) -> _Script:
+    tokens = [(k, t) for k, t in _tokens(src) if k not in {'space', 'comment'}]
+
+    strict = False
+    for kind, text in tokens:
+        if kind == 'literal' and text[:1] in {"'", '"'}:
+            strict = strict or text[1:-1] == 'use strict'
+        elif text != ';':
+            break
+
+    declared: typing.Set[str] = set()
+    words: typing.Set[str] = set()
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'punct':
+            if text in '([{':
+                depth += 1
+            elif text in ')]}':
+                depth -= 1
+            continue
+        if kind != 'word':
+            continue
+        words.add(text)
+        if depth or text not in {'function', 'class', 'let', 'const'}:
+            continue
+        before = i - 1
+        if text == 'function' and before >= 0 and tokens[before][1] == 'async':
+            before -= 1
+        if before >= 0 and tokens[before][1] in _EXPRESSION_AFTER:
+            continue
+        rest = [t for t in tokens[i + 1:i + 3] if t[1] != '*']
+        if rest and rest[0][0] == 'word':
+            declared.add(rest[0][1])
+
+    return _Script(strict, declared, words)
+
+
+def find_unsafe(names: typing.List[str], sources: typing.List[str]) -> typing.List[str]:
+    """Find what would behave differently in one script than in one script each.
+
+    Each plugin's strict mode directive would no longer be at the start of a
+    script, and so would be ignored. Functions are hoisted to the start of
+    the script they are declared in, so earlier plugins would see functions
+    declared by later ones, and the last of several declarations of a
+    function by any of them. Classes, lets, and consts are not hoisted, but
+    an earlier plugin checking for one with typeof would get a ReferenceError
+    instead of undefined.
+    """
+    problems: typing.List[str] = []
+    declared_by: typing.Dict[str, str] = {}
+    earlier: typing.Set[str] = set()
+    for name, src in zip(names, sources):
+        script = _scan(src)
+        if script.strict:
+            problems.append(f'{name} is strict mode code')
+        for d in sorted(script.declared):
+            if d in declared_by:
+                problems.append(f'{name} declares {d}, as does {declared_by[d]}')
+            elif d in earlier:
+                problems.append(f'{name} declares {d}, which an earlier plugin uses')
+            declared_by.setdefault(d, name)
+        earlier |= script.words
+    return problems
+
+
+def find_plugins(root: pathlib.Path) -> typing.Optional[typing.List[str]]:
+    """The names the engine passes to PluginManager.loadScript, in order."""
+    try:
+        text = (root / 'js' / 'plugins.js').read_text(encoding='utf-8-sig')
+        plugins = json.loads(text[text.index('['):text.rindex(']') + 1])
+    except (OSError, ValueError) as e:
+        print(f'Could not read the plugin list: {e}')
+        return None
+
+    mz = (root / 'js' / 'rmmz_managers.js').exists()
+    names: typing.List[str] = []
+    seen: typing.Set[str] = set()
+    for plugin in plugins:
+        name: str = plugin['name']
+        # MZ plugins may be in subdirectories, but are only loaded once by name
+        key = name.rsplit('/', 1)[-1] if mz else name
+        if plugin.get('status') and key not in seen:
+            names.append(name if mz else f'{name}.js')
+            seen.add(key)
+    return names
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', type=pathlib.Path, help='The directory holding js/plugins.js')
+    parser.add_argument('--minify', action='store_true', help='Strip comments and whitespace from the bundle')
+    args = parser.parse_args()
+    root: pathlib.Path = args.root
+
+    managers = sorted((root / 'js').glob('*_managers.js'))
+    if not managers:
+        print('Could not find the managers, not bundling plugins')
+        return
+    if (names := find_plugins(root)) is None:
+        print('Not bundling plugins')
+        return
+    if not names:
+        print('No plugins are enabled, nothing to bundle')
+        return
+
+    paths = [root / 'js' / 'plugins' / (n if n.endswith('.js') else f'{n}.js') for n in names]
+    if (missing := [p for p in paths if not p.exists()]):
+        # The engine reports these as errors, leave that to it
+        print(f'Missing plugins, not bundling: {", ".join(p.name for p in missing)}')
+        return
+
+    sources = [p.read_text(encoding='utf-8-sig', errors='surrogateescape') for p in paths]
+    if (problems := find_unsafe(names, sources)):
+        for problem in problems:
+            print(problem)
+        print('These plugins would not behave the same in a bundle, not bundling plugins')
+        return
+
+    parts = ['// Generated by flatpaker from js/plugins.js, the plugins themselves are in js/plugins']
+    for i, source in enumerate(sources):
+        if args.minify:
+            source = minify(source)
+        # On their own lines, so that neither a comment at the end of a
+        # plugin nor a missing semicolon can swallow them
+        parts.extend([f'$flatpakerPlugins.begin({i});', source, ';'])
+    parts.append('$flatpakerPlugins.end();\n')
+
+    bundle = root / 'js' / BUNDLE
+    bundle.write_text('\n'.join(parts), encoding='utf-8', errors='surrogateescape')
+
+    for m in managers:
+        text = m.read_text(encoding='utf-8-sig', errors='surrogateescape')
+        if MARKER not in text:
+            loader = LOADER.replace('@PLUGINS@', json.dumps(names))
+            m.write_text(text + '\n' + loader, encoding='utf-8', errors='surrogateescape')
+
+    size = sum(p.stat().st_size for p in paths)
+    print(f'Bundled {len(names)} plugins into js/{BUNDLE}, {bundle.stat().st_size} bytes from {size}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+
+// Added by flatpaker: startup trace
+// Records timestamps of the major startup phases, in the same format as the
+// Ren'Py launcher, for `flatpaker startup-report`.
+//
+// Enabled by setting FLATPAKER_TRACE in the environment. The results are
+// written into the log directory when the first scene after the boot scene
+// starts.
+(function() {
+    if (typeof process === 'undefined' || !process.env.FLATPAKER_TRACE) {
+        return;
+    }
+
+    var start = parseFloat(process.env.FLATPAKER_TRACE_START) || Date.now() / 1000;
+    var phases = [];
+    var written = false;
+
+    function mark(name) {
+        phases.push([name, Date.now() / 1000 - start]);
+    }
+
+    function write() {
+        if (written) {
+            return;
+        }
+        written = true;
+
+        var fs = require('fs');
+        var path = require('path');
+        var game = 'rpgmaker';
+        try {
+            game = nw.App.manifest.name;
+        } catch (e) {
+        }
+
+        var state = process.env.XDG_STATE_HOME || path.join(require('os').homedir(), '.local', 'state');
+        var logdir = path.join(state, game, 'logs');
+        var pad = function(n) { return (n < 10 ? '0' : '') + n; };
+        var d = new Date();
+        var stamp = '' + d.getFullYear() + pad(d.getMonth() + 1) + pad(d.getDate()) + '-' +
+            pad(d.getHours()) + pad(d.getMinutes()) + pad(d.getSeconds());
+        var data = {game: game, started: start, phases: phases};
+        // Set by the plugin bundle loader, null when it loaded them separately
+        var plugins = window.$flatpakerPlugins;
+        if (plugins !== undefined) {
+            data.plugins = plugins === null ? 'separate' : plugins.fellBack ? 'fallback' : 'bundled';
+        }
+        try {
+            fs.mkdirSync(logdir, {recursive: true});
+            fs.writeFileSync(path.join(logdir, 'startup-' + stamp + '.json'), JSON.stringify(data));
+        } catch (e) {
+            console.error('flatpaker: could not write the startup trace: ' + e);
+        }
+    }
+
+    mark('Managers loaded');
+    window.addEventListener('load', function() {
+        mark('Page loaded');
+    });
+
+    var onSceneStart = SceneManager.onSceneStart;
+    SceneManager.onSceneStart = function() {
+        onSceneStart.apply(this, arguments);
+        if (typeof Scene_Boot !== 'undefined' && this._scene instanceof Scene_Boot) {
+            mark('Boot scene started');
+        } else {
+            SceneManager.onSceneStart = onSceneStart;
+            mark('First scene started');
+            write();
+        }
+    };
+    // Still write what we have if the game exits before then
+    window.addEventListener('beforeunload', write);
+})();
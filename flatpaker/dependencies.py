@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""An index of which runtime and Sdk each app was last built against.
+
+This allows rebuilding exactly the apps affected by a runtime update.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import os
+import pathlib
+import sqlite3
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from .description import Description
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS apps (
+        appid TEXT PRIMARY KEY,
+        description TEXT NOT NULL,
+        engine TEXT NOT NULL,
+        runtime TEXT NOT NULL,
+        runtime_commit TEXT,
+        sdk TEXT NOT NULL,
+        sdk_commit TEXT,
+        built REAL NOT NULL
+    )
+'''
+
+
+class App(typing.NamedTuple):
+
+    appid: str
+    description: str
+    engine: str
+    runtime: str
+    runtime_commit: typing.Optional[str]
+    sdk: str
+    sdk_commit: typing.Optional[str]
+
+
+def default_path() -> pathlib.Path:
+    root = os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share'))
+    return pathlib.Path(root, 'flatpaker', 'dependencies.sqlite')
+
+
+def manifest_refs(manifest: pathlib.Path) -> typing.Tuple[str, str]:
+    """Read the runtime and Sdk refs out of a generated manifest."""
+    with manifest.open('r') as f:
+        m = json.load(f)
+    runtime = f"{m['runtime']}//{m['runtime-version']}"
+    sdk: str = m['sdk'] if '//' in m['sdk'] else f"{m['sdk']}//{m['runtime-version']}"
+    return runtime, sdk
+
+
+async def installed_commit(ref: str) -> typing.Optional[str]:
+    proc = await asyncio.create_subprocess_exec(
+        'flatpak', 'info', '--user', '--show-commit', ref,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+    out, _ = await proc.communicate()
+    return out.decode().strip() if proc.returncode == 0 else None
+
+
+class DependencyIndex:
+
+    def __init__(self, path: typing.Optional[pathlib.Path] = None):
+        path = path or default_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        with self.conn:
+            self.conn.execute(_SCHEMA)
+
+    async def record(self, appid: str, description: Description, path: str,
+                     manifest: pathlib.Path) -> None:
+        runtime, sdk = manifest_refs(manifest)
+        runtime_commit, sdk_commit = await asyncio.gather(
+            installed_commit(runtime), installed_commit(sdk))
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO apps VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (appid, path, description.common.engine, runtime, runtime_commit, sdk,
+                 sdk_commit, time.time()))
+
+    def dependents(self, name: str) -> typing.List[App]:
+        """Apps built with an engine, or against a runtime or Sdk ref."""
+        cur = self.conn.execute(
+            'SELECT appid, description, engine, runtime, runtime_commit, sdk, sdk_commit FROM apps '
+            'WHERE engine = ? OR runtime = ? OR sdk = ? ORDER BY appid',
+            (name, name, name))
+        return [App(*r) for r in cur.fetchall()]
+
+    async def affected(self, name: str) -> typing.List[App]:
+        """Dependents that were built against a different commit than is now installed."""
+        apps = self.dependents(name)
+        refs = {r for a in apps for r in (a.runtime, a.sdk)}
+        current = dict(zip(refs, await asyncio.gather(*[installed_commit(r) for r in refs])))
+        return [a for a in apps
+                if a.runtime_commit is None or a.sdk_commit is None
+                or current[a.runtime] != a.runtime_commit or current[a.sdk] != a.sdk_commit]
@@ -71,11 +71,19 @@ class Quirks:
 
     force_window_gui_icon: bool = False
     x_configure_prologue: str | None = None
+    x_prune_keep: list[str] = dataclasses.field(default_factory=list)
     x_renpy_archived_window_gui_icon: str | None = None
+    x_rpgmaker_decrypt_assets: bool = False
+    x_rpgmaker_bundle_plugins: bool = False
+    x_rpgmaker_minify_plugins: bool = False
+    x_renpy_pack_archives: bool = False
+    x_renpy_pack_exclude: list[str] = dataclasses.field(default_factory=list)
 
     def __post_init__(self) -> None:
         if self.force_window_gui_icon and self.x_renpy_archived_window_gui_icon:
             raise RuntimeError('Cannot require both an unpacked windows_gui.png and a packed windows_gui.png!')
+        if self.x_rpgmaker_minify_plugins and not self.x_rpgmaker_bundle_plugins:
+            raise RuntimeError('Only bundled plugins can be minified, set x_rpgmaker_bundle_plugins too')
 
 
 @dataclasses.dataclass
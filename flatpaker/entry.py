@@ -3,35 +3,74 @@
 
 from __future__ import annotations
 import argparse
-import subprocess
+import os
 import sys
 import typing
 
-from flatpaker.actions.build_runtime import build_runtimes
+from flatpaker.actions.analyze import analyze
+from flatpaker.actions.benchmark import benchmark_runtimes
+from flatpaker.actions.build_runtime import PROFILES, build_runtimes
 from flatpaker.actions.build_flatpak import build_flatpak
+from flatpaker.actions.bundle import bundle
+from flatpaker.actions.cache import manage_cache
 from flatpaker.actions.generate import generate
+from flatpaker.actions.queue import queue, worker
+from flatpaker.actions.repo import maintain_repo
+from flatpaker.actions.serve import serve
+from flatpaker.actions.startup_report import startup_report
+from flatpaker.actions.stats import report_stats
+import flatpaker.actions.analyze
 import flatpaker.config
+import flatpaker.journal
+import flatpaker.run
+import flatpaker.util
 
 if typing.TYPE_CHECKING:
     from flatpaker.description import EngineName
 
     class BaseArguments(typing.Protocol):
-        action: typing.Literal['build', 'build-runtimes', 'generate']
+        action: typing.Literal['analyze', 'benchmark-runtimes', 'build', 'build-runtimes', 'bundle', 'cache', 'generate', 'queue', 'repo', 'serve', 'startup-report', 'stats', 'worker']
 
-    class BaseBuildArguments(BaseArguments, typing.Protocol):
+    class RepoBaseArguments(BaseArguments, typing.Protocol):
         repo: str
         gpg: typing.Optional[str]
+
+    class RunArguments(BaseArguments, typing.Protocol):
+        timeout: typing.Optional[float]
+        log_dir: str
+        events: typing.Optional[str]
+        verbose: bool
+
+    class BaseBuildArguments(RepoBaseArguments, RunArguments, typing.Protocol):
         install: bool
         export: bool
         cleanup: bool
         deltas: bool
         keep_going: bool
 
-    class BuildArguments(BaseBuildArguments, typing.Protocol):
+    class AppBuildArguments(BaseBuildArguments, typing.Protocol):
+        builder: typing.Literal['flatpak-builder', 'native']
+
+    class BuildArguments(AppBuildArguments, typing.Protocol):
         descriptions: typing.List[str]
+        keep_order: bool
+        jobs: int
+        journal: str
+        resume: bool
+        retry_failed: bool
+        discard: bool
+        affected_by: typing.Optional[str]
 
     class BuildRuntimeArguments(BaseBuildArguments, typing.Protocol):
         runtimes: typing.List[EngineName]
+        profile: str
+
+    class BenchmarkArguments(RunArguments, typing.Protocol):
+        engine: typing.Literal['renpy8', 'renpy7', 'renpy7-py3']
+        profiles: typing.List[str]
+        runs: int
+        wrapper: str
+        format: typing.Literal['text', 'json']
 
     class GenerateArguments(BaseArguments, typing.Protocol):
         url: str
@@ -42,6 +81,59 @@ if typing.TYPE_CHECKING:
         patches: typing.List[str]
         files: typing.List[str]
 
+    class QueueArguments(BaseArguments, typing.Protocol):
+        queue: str
+        descriptions: typing.List[str]
+        keep_order: bool
+
+    class WorkerArguments(AppBuildArguments, typing.Protocol):
+        queue: str
+        lease: float
+        max_attempts: int
+        poll_interval: float
+        exit_when_empty: bool
+
+    class RepoArguments(RepoBaseArguments, typing.Protocol):
+        repo_action: typing.Literal['prune', 'gc', 'update']
+        depth: int
+        ref_depth: typing.Dict[str, int]
+        force: bool
+
+    class AnalyzeArguments(RepoBaseArguments, typing.Protocol):
+        candidates: typing.List[str]
+        history: str
+        top: int
+        format: typing.Literal['text', 'json']
+
+    class BundleArguments(RepoBaseArguments, RunArguments, typing.Protocol):
+        apps: typing.List[str]
+        output: str
+        runtimes: bool
+        jobs: int
+        force: bool
+
+    class ServeArguments(RepoBaseArguments, typing.Protocol):
+        bind: str
+        port: int
+        stats_interval: float
+        verbose: bool
+
+    class CacheArguments(BaseArguments, typing.Protocol):
+        cache_action: typing.Literal['show', 'gc', 'clean']
+        count: int
+        dry_run: bool
+
+    class StartupReportArguments(BaseArguments, typing.Protocol):
+        paths: typing.List[str]
+        phases: int
+
+    class StatsArguments(BaseArguments, typing.Protocol):
+        appids: typing.List[str]
+        history: int
+        threshold: float
+        regressions: bool
+        verbose: bool
+
 
 def static_deltas(args: BaseBuildArguments) -> None:
     if not (args.deltas or args.export):
@@ -50,38 +142,98 @@ def static_deltas(args: BaseBuildArguments) -> None:
     if args.gpg:
         command.extend(['--gpg-sign', args.gpg])
 
-    subprocess.run(command, check=True)
+    with flatpaker.util.repo_lock(args.repo, exclusive=True), \
+            flatpaker.run.Reporter.from_args(args) as reporter:
+        flatpaker.run.run(reporter, 'static-deltas', command, args.timeout)
 
 
 def main() -> None:
     config = flatpaker.config.load_config()
 
-    # An inheritable parser instance used to add arguments to both build and build-runtimes
-    pp = argparse.ArgumentParser(add_help=False)
-    pp.add_argument(
+    # An inheritable parser instance used to add arguments to anything that touches the repo
+    rp = argparse.ArgumentParser(add_help=False)
+    rp.add_argument(
         '--repo',
         default=config['common'].get('repo', 'repo'),
         action='store',
         help='a flatpak repo to put the result in')
-    pp.add_argument(
+    rp.add_argument(
         '--gpg',
         default=config['common'].get('gpg-key'),
         action='store',
         help='A GPG key to sign the output to when writing to a repo')
+
+    # An inheritable parser instance used to add arguments to anything that runs flatpak commands
+    op = argparse.ArgumentParser(add_help=False)
+    op.add_argument(
+        '--timeout',
+        type=float,
+        help='Give up on a build command if it takes longer than this many seconds')
+    op.add_argument(
+        '--log-dir',
+        default=flatpaker.run.default_log_dir().as_posix(),
+        help='Where to write the output of each build')
+    op.add_argument(
+        '--events',
+        help="Write progress as JSON objects, one per line, to this file ('-' for stdout)")
+    op.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        help='Show the output of build commands, not just their progress')
+
+    # An inheritable parser instance used to add arguments to both build and build-runtimes
+    pp = argparse.ArgumentParser(add_help=False, parents=[rp, op])
     pp.add_argument('--export', action='store_true', help='Export to the provided repo')
     pp.add_argument('--install', action='store_true', help="Install for the user (useful for testing)")
     pp.add_argument('--no-cleanup', action='store_false', dest='cleanup', help="don't delete the temporary directory")
     pp.add_argument('--static-deltas', action='store_true', dest='deltas', help="generate static deltas when exporting")
     pp.add_argument('--keep-going', action='store_true', help="Don't stop if building a runtime or app fails.")
 
+    # An inheritable parser instance used to add arguments to build and worker, which build apps
+    ap = argparse.ArgumentParser(add_help=False, parents=[pp])
+    ap.add_argument(
+        '--builder',
+        choices=['flatpak-builder', 'native'],
+        default=config['common'].get('builder', 'flatpak-builder'),
+        help='Build with flatpak-builder, or with the faster native builder for prebuilt games')
+
+    # An inheritable parser instance for commands that take a batch of descriptions
+    sp = argparse.ArgumentParser(add_help=False)
+    sp.add_argument(
+        '--keep-order',
+        action='store_true',
+        help="Build descriptions in the order given, instead of the most expensive first")
+
     from . import __version__
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--version', action='version', version='%(prog)s {}'.format(__version__))
     subparsers = parser.add_subparsers(required=True)
     build_parser = subparsers.add_parser(
-        'build', help='Build flatpaks from descriptions', parents=[pp])
-    build_parser.add_argument('descriptions', nargs='+', help="A Toml description file")
+        'build', help='Build flatpaks from descriptions', parents=[ap, sp])
+    build_parser.add_argument('descriptions', nargs='*', help="A Toml description file")
+    build_parser.add_argument(
+        '--journal',
+        default=flatpaker.journal.default_path().as_posix(),
+        help='Where to record the state of each description in the batch')
+    build_parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Build the descriptions from the journal that were not finished or failed')
+    build_parser.add_argument(
+        '--affected-by',
+        metavar='RUNTIME',
+        help='Rebuild the previously built apps that used an older build of this engine '
+             '(such as renpy8), or runtime or Sdk ref')
+    build_parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help='Build only the descriptions from the journal that failed')
+    build_parser.add_argument(
+        '--discard',
+        action='store_true',
+        help='Start a new batch even if the journal has descriptions that did not finish or failed')
+    build_parser.add_argument('-j', '--jobs', type=int, default=1, help='How many flatpaks to build at once')
     build_parser.set_defaults(action='build')
 
     _all_runtimes = ['renpy8', 'renpy7', 'renpy7-py3', 'rpgmaker']
@@ -94,8 +246,40 @@ def main() -> None:
         default=_all_runtimes,
         help="Which runtimes to build",
     )
+    runtimes_parser.add_argument(
+        '--profile',
+        choices=sorted(PROFILES),
+        default='default',
+        help="Build the Ren'Py runtimes optimized, on their own branch. "
+             + '; '.join(f'{n}: {p.help}' for n, p in sorted(PROFILES.items())))
     runtimes_parser.set_defaults(action='build-runtimes')
 
+    benchmark_parser = subparsers.add_parser(
+        'benchmark-runtimes',
+        help="Compare the installed profiles of a Ren'Py runtime with a synthetic game",
+        parents=[op])
+    benchmark_parser.add_argument(
+        '--profile',
+        action='append',
+        default=[],
+        choices=sorted(PROFILES),
+        dest='profiles',
+        help='A profile to compare, may be given several times, the first is the baseline. '
+             'Default: default and optimized')
+    benchmark_parser.add_argument(
+        '--engine',
+        choices=['renpy8', 'renpy7', 'renpy7-py3'],
+        default='renpy8',
+        help='Which runtime to benchmark')
+    benchmark_parser.add_argument('--runs', type=int, default=5, help='How many times to run each profile')
+    benchmark_parser.add_argument(
+        '--wrapper',
+        default='',
+        help='A command to run the game under, such as "xvfb-run -a" on a headless machine')
+    benchmark_parser.add_argument(
+        '--format', choices=['text', 'json'], default='text', help='How to print the results')
+    benchmark_parser.set_defaults(action='benchmark-runtimes')
+
     generate_parser = subparsers.add_parser(
         'generate', help='Generate a new TOML description file')
     generate_parser.add_argument(
@@ -129,7 +313,155 @@ def main() -> None:
     )
     generate_parser.set_defaults(action='generate')
 
+    # An inheritable parser instance for commands that use the job queue
+    qp = argparse.ArgumentParser(add_help=False)
+    qp.add_argument(
+        '--queue',
+        default=config['queue'].get('database', 'queue.sqlite'),
+        help='The job queue database shared by workers')
+
+    queue_parser = subparsers.add_parser(
+        'queue', help='Add descriptions to the job queue and show its status', parents=[qp, sp])
+    queue_parser.add_argument('descriptions', nargs='*', help="A Toml description file")
+    queue_parser.set_defaults(action='queue')
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='Build descriptions from the job queue, exporting to the repo', parents=[ap, qp])
+    worker_parser.add_argument(
+        '--lease', type=float, default=300, help='Seconds before a job of an unresponsive worker is retried')
+    worker_parser.add_argument(
+        '--max-attempts', type=int, default=3, help='How many times to try a job before giving up')
+    worker_parser.add_argument(
+        '--poll-interval', type=float, default=10, help='Seconds to wait between checks of an empty queue')
+    worker_parser.add_argument(
+        '--exit-when-empty', action='store_true', help='Exit instead of waiting when the queue is empty')
+    worker_parser.set_defaults(action='worker')
+
+    repo_parser = subparsers.add_parser('repo', help='Maintain the flatpak repo')
+    repo_parser.set_defaults(
+        action='repo',
+        depth=-1,
+        ref_depth=config['repo'].get('ref-depth', {}),
+        force=False,
+    )
+    repo_subparsers = repo_parser.add_subparsers(required=True)
+    prune_parser = repo_subparsers.add_parser(
+        'prune',
+        help='Remove old commits beyond the history depth, then unreachable objects',
+        parents=[rp])
+    prune_parser.add_argument(
+        '--depth',
+        type=int,
+        default=config['repo'].get('history-depth', 3),
+        help='How many commits of history to keep for each ref',
+    )
+    prune_parser.set_defaults(repo_action='prune')
+    gc_parser = repo_subparsers.add_parser(
+        'gc', help='Remove objects not reachable from any ref', parents=[rp])
+    gc_parser.set_defaults(repo_action='gc')
+    update_parser = repo_subparsers.add_parser(
+        'update', help='Regenerate the summary and appstream if any refs changed', parents=[rp])
+    update_parser.add_argument('--force', action='store_true', help='Regenerate even if no refs changed')
+    update_parser.set_defaults(repo_action='update')
+
+    analyze_parser = subparsers.add_parser(
+        'analyze', help='Show how much space each ref uses, and how much is shared', parents=[rp])
+    analyze_parser.add_argument(
+        '--candidate',
+        action='append',
+        default=[],
+        dest='candidates',
+        help='Another repo, such as one a new game was exported to, to show what adding its refs would cost')
+    analyze_parser.add_argument(
+        '--history',
+        default=flatpaker.actions.analyze.default_path().as_posix(),
+        help='Where to keep the previous analysis, to report growth since then')
+    analyze_parser.add_argument(
+        '--top', type=int, default=10, help='How many of the largest and most duplicated files to show')
+    analyze_parser.add_argument(
+        '--format', choices=['text', 'json'], default='text', help='How to print the results')
+    analyze_parser.set_defaults(action='analyze')
+
+    bundle_parser = subparsers.add_parser(
+        'bundle', help='Export single file bundles from the repo, for installing offline', parents=[rp, op])
+    bundle_parser.add_argument('apps', nargs='*', help='Application IDs (or globs) to bundle, all by default')
+    bundle_parser.add_argument('-o', '--output', default='bundles', help='Where to write the bundles')
+    bundle_parser.add_argument(
+        '--runtimes', action='store_true', help='Also bundle the runtimes the applications use')
+    bundle_parser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1, help='How many bundles to write at once')
+    bundle_parser.add_argument(
+        '--force', action='store_true', help='Write bundles even if their commit has not changed')
+    bundle_parser.set_defaults(action='bundle')
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='Serve the repo over HTTP, for flatpak remotes on other machines', parents=[rp])
+    serve_parser.add_argument('--bind', default='0.0.0.0', help='The address to listen on')
+    serve_parser.add_argument('-p', '--port', type=int, default=8000, help='The port to listen on')
+    serve_parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=60,
+        help='How often to show the throughput of each client, in seconds, 0 to only show it on exit')
+    serve_parser.add_argument('-v', '--verbose', action='store_true', help='Log every request')
+    serve_parser.set_defaults(action='serve')
+
+    cache_parser = subparsers.add_parser('cache', help='Inspect and trim the build caches')
+    cache_parser.set_defaults(action='cache', count=5, dry_run=False)
+    cache_subparsers = cache_parser.add_subparsers(required=True)
+    show_parser = cache_subparsers.add_parser('show', help='Show how much space each kind of cache uses')
+    show_parser.add_argument(
+        '--count', type=int, default=5, help='How many of the largest and least recently used entries to list')
+    show_parser.set_defaults(cache_action='show')
+    cache_gc_parser = cache_subparsers.add_parser(
+        'gc', help='Evict the least recently used entries until every cache is within its budget')
+    cache_gc_parser.add_argument('--dry-run', action='store_true', help='Only show what would be removed')
+    cache_gc_parser.set_defaults(cache_action='gc')
+    clean_parser = cache_subparsers.add_parser(
+        'clean', help='Remove working directories left behind by failed or --no-cleanup builds')
+    clean_parser.add_argument('--dry-run', action='store_true', help='Only show what would be removed')
+    clean_parser.set_defaults(cache_action='clean')
+
+    stats_parser = subparsers.add_parser('stats', help='Show recorded build costs, and regressions')
+    stats_parser.add_argument('appids', nargs='*', help='Only show these applications')
+    stats_parser.add_argument(
+        '--history', type=int, default=5, help='How many previous builds to compare against')
+    stats_parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.25,
+        help='How much slower than the previous builds counts as a regression, as a fraction')
+    stats_parser.add_argument('--regressions', action='store_true', help='Only show regressions')
+    stats_parser.add_argument('-v', '--verbose', action='store_true', help='Show each recent build')
+    stats_parser.set_defaults(action='stats')
+
+    startup_parser = subparsers.add_parser(
+        'startup-report',
+        help='Summarize startup timings recorded by games run with FLATPAKER_TRACE set')
+    startup_parser.add_argument(
+        'paths',
+        nargs='*',
+        default=['~/.var/app'],
+        help='Directories to search for startup logs',
+    )
+    startup_parser.add_argument(
+        '--phases',
+        type=int,
+        default=5,
+        help='How many of the slowest phases to show per game',
+    )
+    startup_parser.set_defaults(action='startup-report')
+
     args = typing.cast('BaseArguments', parser.parse_args())
+    if args.action == 'build':
+        bargs = typing.cast('BuildArguments', args)
+        selectors = [bool(bargs.descriptions), bargs.resume or bargs.retry_failed, bool(bargs.affected_by)]
+        if sum(selectors) > 1:
+            build_parser.error('only one of descriptions, --resume/--retry-failed, or --affected-by may be given')
+        if not any(selectors):
+            build_parser.error('at least one description is required')
+        if bargs.discard and selectors[1]:
+            build_parser.error('--discard may not be given with --resume/--retry-failed')
     success = True
 
     if args.action == 'build':
@@ -142,7 +474,27 @@ def main() -> None:
         success = build_runtimes(brargs)
         if brargs.deltas:
             static_deltas(brargs)
+    if args.action == 'benchmark-runtimes':
+        success = benchmark_runtimes(typing.cast('BenchmarkArguments', args))
     if args.action == 'generate':
         success = generate(typing.cast('GenerateArguments', args))
+    if args.action == 'queue':
+        success = queue(typing.cast('QueueArguments', args))
+    if args.action == 'worker':
+        success = worker(typing.cast('WorkerArguments', args))
+    if args.action == 'repo':
+        success = maintain_repo(typing.cast('RepoArguments', args))
+    if args.action == 'analyze':
+        success = analyze(typing.cast('AnalyzeArguments', args))
+    if args.action == 'bundle':
+        success = bundle(typing.cast('BundleArguments', args))
+    if args.action == 'serve':
+        success = serve(typing.cast('ServeArguments', args))
+    if args.action == 'cache':
+        success = manage_cache(typing.cast('CacheArguments', args))
+    if args.action == 'stats':
+        success = report_stats(typing.cast('StatsArguments', args))
+    if args.action == 'startup-report':
+        success = startup_report(typing.cast('StartupReportArguments', args))
 
     sys.exit(0 if success else 1)
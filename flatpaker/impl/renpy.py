@@ -8,14 +8,18 @@ import pathlib
 import textwrap
 import typing
 
-from flatpaker import util
+from flatpaker import overlay, util
 
 if typing.TYPE_CHECKING:
-    from flatpaker.description import Description
+    from flatpaker.description import Archive, Description
 
 
 def _create_game_sh(appname: str) -> list[str]:
     return [
+        # Setting FLATPAKER_TRACE records the startup phases into the log
+        # directory, see `flatpaker startup-report`. Take the start time here
+        # so that interpreter startup is included
+        'if [ -n "${FLATPAKER_TRACE}" ]; then export FLATPAKER_TRACE_START=$(date +%s.%N); fi',
         'export RENPY_PERFORMANCE_TEST=0',
         'export RENPY_NO_STEAM=1',
         'export SDL_VIDEODRIVER=wayland',
@@ -27,7 +31,28 @@ def quote(s: str) -> str:
     return f'"{s}"'
 
 
-def bd_build_commands(description: Description) -> typing.List[str]:
+def _overlay_command(roots: typing.Sequence[str], replace: bool) -> str:
+    # Anything the plan doesn't know about, such as archives that couldn't
+    # be listed, is discovered and layered last
+    return ' '.join([
+        'python3 renpy-overlay.py $FLATPAK_DEST/lib/game/game',
+        *[quote(r) for r in roots],
+        "--glob '*/game'",
+        *(['--replace'] if replace else []),
+    ])
+
+
+def _install_files(description: Description) -> typing.List[str]:
+    commands: typing.List[str] = []
+    for p in description.sources.files:
+        dest = os.path.join('$FLATPAK_DEST/lib/game', p.dest)
+        # This could be a file or a directory for dest, so we can't use install
+        commands.append(f'install -Dm644 {p.path.name} {dest}')
+    return commands
+
+
+def bd_base_commands(description: Description, plan: overlay.Plan, archives: typing.Sequence[Archive],
+                     install_files: bool) -> typing.List[str]:
     commands: typing.List[str] = [
         'mkdir -p $FLATPAK_DEST/lib/game',
     ]
@@ -35,35 +60,23 @@ def bd_build_commands(description: Description) -> typing.List[str]:
     if (prologue := description.quirks.x_configure_prologue) is not None:
         commands.append(prologue)
 
-    commands.extend([
-        # install the main game files
-        'mv game $FLATPAK_DEST/lib/game/',
-
-        # Move archives that have not been strippped as they would conflict
-        # with the main source archive
-        'cp -r */game/* $FLATPAK_DEST/lib/game/game/ || true',
-    ])
+    # install the main game files, and then layer the game directories of
+    # any archives that were not stripped (mods and DLC) over them, in order.
+    commands.append(_overlay_command(plan.roots_for([a.path for a in archives]), False))
 
-    # Insert these commands before any rpy and py files are compiled
-    for p in description.sources.files:
-        dest = os.path.join('$FLATPAK_DEST/lib/game', p.dest)
-        # This could be a file or a directory for dest, so we can't use install
-        commands.append(f'install -Dm644 {p.path.name} {dest}')
+    if install_files:
+        # Insert these commands before any rpy and py files are compiled
+        commands.extend(_install_files(description))
 
-    if description.quirks.force_window_gui_icon:
-        commands.append(
-            'install -D -m644 $FLATPAK_DEST/lib/game/game/gui/window_icon.png $FLATPAK_DEST/share/icons/hicolor/256x256/apps/$FLATPAK_ID.png')
-    elif (arch := description.quirks.x_renpy_archived_window_gui_icon) is not None:
-        commands.extend([
-            f'rpatool $FLATPAK_DEST/lib/game/game/{arch} -x $FLATPAK_ID.png=gui/window_icon.png || exit 1',
-            'install -Dm644 ${FLATPAK_ID}.png -t ${FLATPAK_DEST}/share/icons/hicolor/256x256/apps || exit 1',
-        ])
-    else:
+    if not (description.quirks.force_window_gui_icon or description.quirks.x_renpy_archived_window_gui_icon):
         commands.append(
             # Extract the icon file from either a Windows exe or from MacOS resources.
             # This gives more sizes, and is more likely to exists than the gui/window_icon.png
-            # If neither the ICNS or the EXE approach produce anything, then we
-            # fallback to trying the window_icon
+            # If neither the ICNS or the EXE approach produce anything, then
+            # bd_compile_commands falls back to the window_icon, once any
+            # mods have been installed over the game
+            # This needs the executables of the main archive, so it has to
+            # happen in its layer
             textwrap.dedent('''
                 ICNS=$(ls *.app/Contents/Resources/icon.icns)
                 EXE=$(ls *.exe)
@@ -74,11 +87,6 @@ def bd_build_commands(description: Description) -> typing.List[str]:
                     icns2png -x "${ICNS}"
                 fi
 
-                PNG=$(ls *png)
-                if [[ ! "${PNG}" && -f "$FLATPAK_DEST/lib/game/game/gui/window_icon.png" ]]; then
-                    cp $FLATPAK_DEST/lib/game/game/gui/window_icon.png window_iconx256x256.png
-                fi
-
                 for icon in $(ls *.png); do
                     if [[ "${icon}" =~ "32x32" ]]; then
                         size="32x32"
@@ -97,32 +105,121 @@ def bd_build_commands(description: Description) -> typing.List[str]:
                 done
             '''))
 
-    commands.append(
-        # Recompile all of the rpy files
-        "XDG_STATE_HOME=/tmp/state XDG_DATA_HOME=/tmp/data renpy-bin 'dummy' 'dummy' $FLATPAK_DEST/lib/game compile --keep-orphan-rpyc"
-    )
+    return commands
+
+
+def bd_overlay_commands(description: Description, plan: overlay.Plan, archives: typing.Sequence[Archive]) -> typing.List[str]:
+    commands: typing.List[str] = []
+    if archives:
+        commands.append(_overlay_command(plan.roots_for([a.path for a in archives]), True))
+    commands.extend(_install_files(description))
+    return commands
+
+
+def bd_compile_commands(description: Description) -> typing.List[str]:
+    commands: typing.List[str] = []
+
+    if description.quirks.force_window_gui_icon:
+        commands.append(
+            'install -D -m644 $FLATPAK_DEST/lib/game/game/gui/window_icon.png $FLATPAK_DEST/share/icons/hicolor/256x256/apps/$FLATPAK_ID.png')
+    elif (arch := description.quirks.x_renpy_archived_window_gui_icon) is not None:
+        commands.extend([
+            f'rpatool $FLATPAK_DEST/lib/game/game/{arch} -x $FLATPAK_ID.png=gui/window_icon.png || exit 1',
+            'install -Dm644 ${FLATPAK_ID}.png -t ${FLATPAK_DEST}/share/icons/hicolor/256x256/apps || exit 1',
+        ])
+    else:
+        # Before packing, which may move it into an archive
+        commands.append(textwrap.dedent('''
+            if ! ls $FLATPAK_DEST/share/icons/hicolor/*/apps/$FLATPAK_ID.png >/dev/null 2>&1 && \\
+                    [[ -f "$FLATPAK_DEST/lib/game/game/gui/window_icon.png" ]]; then
+                install -D -m644 $FLATPAK_DEST/lib/game/game/gui/window_icon.png $FLATPAK_DEST/share/icons/hicolor/256x256/apps/$FLATPAK_ID.png
+            fi
+        '''))
+
+    # Prune before packing, so that nothing is packed only to be removed
+    commands.append(util.bd_prune_command('renpy', '$FLATPAK_DEST/lib/game/game', description))
+
+    if description.quirks.x_renpy_pack_archives:
+        commands.append(' '.join([
+            'python3 renpy-pack.py $FLATPAK_DEST/lib/game/game',
+            *[f"--exclude '{e}'" for e in description.quirks.x_renpy_pack_exclude],
+        ]))
+
+    commands.extend([
+        # Remove any caches shipped with the game. They were generated for a
+        # different Python, and so are dead weight, and we regenerate them
+        # below
+        'rm -rf $FLATPAK_DEST/lib/game/game/cache',
+
+        # Recompile all of the rpy files. Since the game directory is writable
+        # here this also prewarms the bytecode and analysis caches, which are
+        # installed alongside the game so that the first launch doesn't have
+        # to rebuild them
+        "XDG_STATE_HOME=/tmp/state XDG_DATA_HOME=/tmp/data renpy-bin 'dummy' 'dummy' $FLATPAK_DEST/lib/game compile --keep-orphan-rpyc",
+    ])
 
     return commands
 
 
 def write_rules(description: Description, workdir: pathlib.Path, appid: str, desktop_file: pathlib.Path, appdata_file: pathlib.Path) -> None:
-    sources = util.extract_sources(description)
+    plan = overlay.plan(description)
+    if (report := plan.report()):
+        # Kept with the build's log by build_description
+        (workdir / 'overlay.txt').write_text(report + '\n')
+
+    name = util.sanitize_name(description.common.name)
+    archives = description.sources.archives
+    overlay_file = util.data_file_source(workdir, 'renpy-overlay.py')
+
+    # The game is built in layers, each a module, so that changing a mod or
+    # file only rebuilds the layers from it on, and the (often huge) main
+    # archive is reused from flatpak-builder's cache. The prologue, patches,
+    # and commands may touch any of the sources though, so with any of them
+    # everything but compiling is done in the first layer
+    layered = util.layered(description)
+    base = archives[:1] if layered else archives
+
+    sources = util.archive_sources(base)
+    if not layered:
+        sources.extend(util.file_sources(description.sources.files))
+        sources.extend(util.patch_sources(description.sources.patches))
+    sources.append(overlay_file)
 
     # TODO: typing requires more thought
     modules: typing.List[typing.Dict[str, typing.Any]] = [
         {
             'buildsystem': 'simple',
-            'name': util.sanitize_name(description.common.name),
+            'name': name,
             'sources': sources,
-            'build-commands': bd_build_commands(description),
-            'cleanup': [
-                '*.rpy',
-                '*.rpyc.bak',
+            'build-commands': bd_base_commands(description, plan, base, not layered),
+        },
+    ]
+
+    if layered and (archives[1:] or description.sources.files):
+        modules.append({
+            'buildsystem': 'simple',
+            'name': f'{name}-overlays',
+            'sources': [
+                *util.archive_sources(archives[1:]),
+                *util.file_sources(description.sources.files),
+                overlay_file,
             ],
+            'build-commands': bd_overlay_commands(description, plan, archives[1:]),
+        })
+
+    compile_sources = [util.data_file_source(workdir, 'prune.py')]
+    if description.quirks.x_renpy_pack_archives:
+        compile_sources.append(util.data_file_source(workdir, 'renpy-pack.py'))
+    modules.extend([
+        {
+            'buildsystem': 'simple',
+            'name': f'{name}-compile',
+            'sources': compile_sources,
+            'build-commands': bd_compile_commands(description),
         },
         util.bd_metadata(desktop_file, appdata_file,
                          _create_game_sh(description.common.name)),
-    ]
+    ])
 
     engine = description.common.engine
     if engine == "renpy8":
@@ -149,6 +246,12 @@ def write_rules(description: Description, workdir: pathlib.Path, appid: str, des
             '--socket=pulseaudio',
             '--device=dri',
         ],
+        # For the whole app, as module cleanups only apply to the files that
+        # module installed
+        'cleanup': [
+            '*.rpy',
+            '*.rpyc.bak',
+        ],
         'modules': modules,
     }
 
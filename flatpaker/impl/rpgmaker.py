@@ -14,7 +14,21 @@ if typing.TYPE_CHECKING:
 
 
 def write_rules(description: Description, workdir: pathlib.Path, appid: str, desktop_file: pathlib.Path, appdata_file: pathlib.Path) -> None:
-    sources = util.extract_sources(description)
+    name = util.sanitize_name(description.common.name)
+    archives = description.sources.archives
+
+    # The game is built in layers, each a module, so that changing a mod or
+    # file only rebuilds the layers from it on, and the (often huge) main
+    # archive is reused from flatpak-builder's cache. The prologue, patches,
+    # and commands may touch any of the sources though, so with any of them
+    # every source is in the first layer
+    layered = util.layered(description)
+    base = archives[:1] if layered else archives
+
+    sources = util.archive_sources(base)
+    if not layered:
+        sources.extend(util.file_sources(description.sources.files))
+        sources.extend(util.patch_sources(description.sources.patches))
 
     commands: list[str] = ['mkdir -p $FLATPAK_DEST/lib/game']
 
@@ -22,13 +36,6 @@ def write_rules(description: Description, workdir: pathlib.Path, appid: str, des
         commands.append(prologue)
 
     commands.extend([
-        # Automatically rewrite the name and window title. This is very often
-        # blank or an ugly default
-        f'''
-            jq '.name = "{description.common.name}" | .window.title = .name' package.json > package.json.tmp
-            mv package.json.tmp package.json
-        ''',
-
         # in MV www/icon.png is usually the customized icon and icon/icon.png is
         textwrap.dedent('''
             if [[ -d "www/icon" ]]; then
@@ -38,30 +45,85 @@ def write_rules(description: Description, workdir: pathlib.Path, appid: str, des
             fi
         '''),
 
-        # The manager has a different name in MZ and MV, rmmz_managers.js in MZ and rpg_managers.js in MV
-        'find . -name "*_managers.js" -exec sed -i "s@path.dirname(process.mainModule.filename)@process.env.XDG_DATA_HOME@g" {} +',
-
         # install the main game files
         'mv package.json www $FLATPAK_DEST/lib/game/',
     ])
 
-    game_sh_contents = [
-        'exec /usr/lib/nwjs/nw /app/lib/game/ --enable-features=UseOzonePlatform --ozone-platform=wayland "$@"'
-    ]
-
     # TODO: typing requires more thought
     modules: typing.List[typing.Dict[str, typing.Any]] = [
         {
             'buildsystem': 'simple',
-            'name': util.sanitize_name(description.common.name),
+            'name': name,
             'sources': sources,
             'build-commands': commands,
-            'cleanup': [
-                'www/save',
+        },
+    ]
+
+    if layered and (archives[1:] or description.sources.files):
+        modules.append({
+            'buildsystem': 'simple',
+            'name': f'{name}-overlays',
+            'sources': [
+                *util.archive_sources(archives[1:]),
+                *util.file_sources(description.sources.files),
+            ],
+            'build-commands': [
+                # Mods and DLC replace the files of the main game
+                'if [[ -f package.json ]]; then install -Dm644 package.json -t $FLATPAK_DEST/lib/game; fi',
+                'if [[ -d www ]]; then cp -a --remove-destination www/. $FLATPAK_DEST/lib/game/www/; fi',
             ],
+        })
+
+    finish_sources = [
+        util.data_file_source(workdir, 'prune.py'),
+    ]
+    finish_commands = [
+        # Automatically rewrite the name and window title. This is very often
+        # blank or an ugly default
+        f'''
+            jq '.name = "{description.common.name}" | .window.title = .name' $FLATPAK_DEST/lib/game/package.json > package.json.tmp
+            mv package.json.tmp $FLATPAK_DEST/lib/game/package.json
+        ''',
+
+        # The manager has a different name in MZ and MV, rmmz_managers.js in MZ and rpg_managers.js in MV
+        'find $FLATPAK_DEST/lib/game/www -name "*_managers.js" -exec sed -i "s@path.dirname(process.mainModule.filename)@process.env.XDG_DATA_HOME@g" {} +',
+
+        # Prune before decrypting, so that nothing is decrypted only to be removed
+        util.bd_prune_command('rpgmaker', '$FLATPAK_DEST/lib/game/www', description),
+    ]
+
+    if description.quirks.x_rpgmaker_decrypt_assets:
+        finish_sources.append(util.data_file_source(workdir, 'rpgmaker-decrypt.py'))
+        finish_commands.append('python3 rpgmaker-decrypt.py $FLATPAK_DEST/lib/game/www')
+
+    if description.quirks.x_rpgmaker_bundle_plugins:
+        finish_sources.extend([
+            util.data_file_source(workdir, 'rpgmaker-plugins.py'),
+            util.data_file_source(workdir, 'rpgmaker-trace.js'),
+        ])
+        # Setting FLATPAKER_TRACE records the startup phases into the log
+        # directory, to compare loading the plugins bundled and separately
+        # with `flatpaker startup-report`
+        finish_commands.append(
+            'find $FLATPAK_DEST/lib/game/www -name "*_managers.js" -exec sh -c \'cat rpgmaker-trace.js >> "$0"\' {} \\;')
+        minify = ' --minify' if description.quirks.x_rpgmaker_minify_plugins else ''
+        finish_commands.append(f'python3 rpgmaker-plugins.py $FLATPAK_DEST/lib/game/www{minify}')
+
+    game_sh_contents = [
+        # Take the start time here so that starting nwjs is included in the trace
+        'if [ -n "${FLATPAKER_TRACE}" ]; then export FLATPAKER_TRACE_START=$(date +%s.%N); fi',
+        'exec /usr/lib/nwjs/nw /app/lib/game/ --enable-features=UseOzonePlatform --ozone-platform=wayland "$@"'
+    ]
+
+    modules.extend([
+        {
+            'buildsystem': 'simple',
+            'name': f'{name}-finish',
+            'sources': finish_sources,
+            'build-commands': finish_commands,
         },
         util.bd_metadata(desktop_file, appdata_file, game_sh_contents),
-    ]
+    ])
 
     struct = {
         'sdk': 'org.freedesktop.Sdk//24.08',
@@ -78,6 +140,11 @@ def write_rules(description: Description, workdir: pathlib.Path, appid: str, des
             '--socket=wayland',
             '--device=dri',
         ],
+        # For the whole app, as module cleanups only apply to the files that
+        # module installed
+        'cleanup': [
+            'www/save',
+        ],
         'modules': modules,
     }
 
@@ -0,0 +1,81 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""A persistent record of the state of each description in a batch build."""
+
+from __future__ import annotations
+import json
+import os
+import pathlib
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    State = typing.Literal['pending', 'running', 'done', 'failed']
+
+    class Entry(typing.TypedDict, total=False):
+        state: State
+        updated: float
+        commit: typing.Optional[str]
+        error: str
+
+
+def default_path() -> pathlib.Path:
+    root = os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state'))
+    return pathlib.Path(root, 'flatpaker', 'build-journal.json')
+
+
+class Journal:
+
+    """The state of each description in the most recent batch.
+
+    The journal is rewritten atomically after every change, so that whatever
+    stops the batch it can be resumed.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.entries: typing.Dict[str, Entry] = {}
+        if path.exists():
+            with path.open('r') as f:
+                self.entries = json.load(f)['entries']
+
+    def _write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        with tmp.open('w') as f:
+            json.dump({'entries': self.entries}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def start(self, descriptions: typing.Iterable[str]) -> None:
+        """Begin a new batch, forgetting the previous one.
+
+        Check that nothing would be lost with :meth:`select` first.
+        """
+        now = time.time()
+        self.entries = {d: {'state': 'pending', 'updated': now} for d in descriptions}
+        self._write()
+
+    def select(self, failed: bool, unfinished: bool) -> typing.List[str]:
+        states: typing.Set[State] = set()
+        if failed:
+            states.add('failed')
+        if unfinished:
+            states.update({'pending', 'running'})
+        return [d for d, e in self.entries.items() if e['state'] in states]
+
+    def update(self, description: str, state: State, *, commit: typing.Optional[str] = None,
+               error: typing.Optional[str] = None) -> None:
+        entry: Entry = {'state': state, 'updated': time.time()}
+        if commit is not None:
+            entry['commit'] = commit
+        if error is not None:
+            entry['error'] = error
+        self.entries[description] = entry
+        self._write()
+
+    def counts(self) -> typing.Dict[str, int]:
+        counts: typing.Dict[str, int] = {}
+        for e in self.entries.values():
+            counts[e['state']] = counts.get(e['state'], 0) + 1
+        return counts
@@ -0,0 +1,287 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Build an app from its manifest without flatpak-builder.
+
+The manifests generated for games only contain `simple` modules that unpack
+prebuilt files and move them into place. flatpak-builder handles these
+correctly, but spends much of the build copying sources into its downloads
+and build directories, going through rofiles-fuse, and committing each module
+to its cache.
+
+This interprets those manifests directly. Sources are unpacked on the host
+into a directory inside the app's `files`, so that build commands moving them
+into `/app` are renames rather than copies, and only the build commands and
+the appstream compose step run in the Sdk, each module's commands in a single
+`flatpak build` call. The app is then finished and exported with
+`flatpak build-finish` and `flatpak build-export`.
+
+Only what flatpaker's manifests use is supported. Module cleanup patterns are
+applied to all of `/app` rather than only the files the module installed, and
+nothing is stripped, as every manifest disables that anyway.
+"""
+
+from __future__ import annotations
+import asyncio
+import fnmatch
+import json
+import os
+import pathlib
+import shlex
+import shutil
+import stat
+import typing
+import zipfile
+
+from . import run, util
+
+if typing.TYPE_CHECKING:
+    from .entry import AppBuildArguments
+
+# Where sources are unpacked, relative to the app's files
+_SRC = '.flatpaker-src'
+
+_TAR = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar.zst')
+
+
+def _strip(name: str, components: int) -> typing.Optional[pathlib.PurePosixPath]:
+    parts = pathlib.PurePosixPath(name).parts[components:]
+    if not parts:
+        return None
+    if parts[0] == '/' or '..' in parts:
+        raise RuntimeError(f'Refusing to extract {name}, it is outside of the archive')
+    return pathlib.PurePosixPath(*parts)
+
+
+def _extract_zip(archive: pathlib.Path, dest: pathlib.Path, components: int) -> None:
+    """Extract a zip straight into place, stripping components as we go."""
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if (rel := _strip(info.filename, components)) is None:
+                continue
+            target = dest / rel
+            mode = info.external_attr >> 16
+            if info.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if target.is_symlink() or target.exists():
+                target.unlink()
+            if stat.S_ISLNK(mode):
+                os.symlink(zf.read(info).decode(), target)
+                continue
+            with zf.open(info) as src, target.open('wb') as f:
+                shutil.copyfileobj(src, f, 1024 * 1024)
+            # Archives made on Windows have no permissions
+            target.chmod(mode & 0o777 if mode & 0o777 else 0o644)
+
+
+def _matches(path: typing.Sequence[str], pattern: str) -> bool:
+    """Match a path in /app against a cleanup pattern, the way flatpak-builder does.
+
+    Patterns starting with a / are relative to /app, others may match
+    starting at any directory. Either way, matching a directory matches
+    everything in it.
+    """
+    absolute = pattern.startswith('/')
+    parts = pattern.strip('/').split('/')
+    starts = [0] if absolute else range(len(path))
+    for start in starts:
+        candidate = path[start:start + len(parts)]
+        if len(candidate) == len(parts) and all(fnmatch.fnmatchcase(c, p) for c, p in zip(candidate, parts)):
+            return True
+    return False
+
+
+def _cleanup(files: pathlib.Path, patterns: typing.Sequence[str]) -> None:
+    if not patterns:
+        return
+    for dirpath, dirnames, filenames in os.walk(files):
+        rel = pathlib.Path(dirpath).relative_to(files).parts
+        for d in list(dirnames):
+            if any(_matches([*rel, d], p) for p in patterns):
+                shutil.rmtree(pathlib.Path(dirpath, d))
+                dirnames.remove(d)
+        for fn in filenames:
+            if any(_matches([*rel, fn], p) for p in patterns):
+                pathlib.Path(dirpath, fn).unlink()
+
+
+def _clean(builddir: pathlib.Path) -> None:
+    """The equivalent of --force-clean."""
+    for p in builddir.iterdir():
+        if p.is_dir() and not p.is_symlink():
+            shutil.rmtree(p)
+        else:
+            p.unlink()
+
+
+async def _default_arch() -> str:
+    proc = await asyncio.create_subprocess_exec(
+        'flatpak', '--default-arch', stdout=asyncio.subprocess.PIPE)
+    out, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError('Could not get the default architecture from flatpak')
+    return out.decode().strip()
+
+
+class _Builder:
+
+    def __init__(self, args: AppBuildArguments, manifest: typing.Dict[str, typing.Any],
+                 builddir: pathlib.Path, reporter: run.Reporter, arch: str):
+        self.args = args
+        self.manifest = manifest
+        self.appid: str = manifest['id']
+        self.builddir = builddir
+        self.files = builddir / 'files'
+        self.reporter = reporter
+        self.arch = arch
+
+    def stage(self, stage: str) -> None:
+        self.reporter.event(self.appid, 'stage', stage=stage)
+
+    async def run(self, command: typing.Sequence[str]) -> None:
+        await run.run_async(self.reporter, self.appid, command, self.args.timeout)
+
+    async def sandbox(self, cwd: str, command: typing.Sequence[str]) -> None:
+        await self.run([
+            'flatpak', 'build', '--die-with-parent', f'--build-dir={cwd}',
+            f'--env=FLATPAK_ID={self.appid}',
+            '--env=FLATPAK_DEST=/app',
+            f'--env=FLATPAK_ARCH={self.arch}',
+            f'--env=FLATPAK_BUILDER_BUILDDIR={cwd}',
+            f'--env=FLATPAK_BUILDER_N_JOBS={os.cpu_count() or 1}',
+            self.builddir.as_posix(), *command,
+        ])
+
+    async def init(self) -> None:
+        await asyncio.to_thread(_clean, self.builddir)
+        self.stage('initializing')
+        await self.run([
+            'flatpak', 'build-init', '--type=app', self.builddir.as_posix(), self.appid,
+            self.manifest['sdk'], self.manifest['runtime'], self.manifest['runtime-version'],
+        ])
+
+    async def source(self, name: str, index: int, src: typing.Dict[str, typing.Any], dest: pathlib.Path) -> None:
+        kind = src['type']
+        dest = dest / src.get('dest', '')
+        dest.mkdir(parents=True, exist_ok=True)
+        path = pathlib.Path(src['path']) if 'path' in src else None
+
+        if path is not None and 'sha256' in src:
+            if await asyncio.to_thread(util.sha256, path) != src['sha256']:
+                raise RuntimeError(f'{path} does not match its sha256')
+
+        if kind == 'archive':
+            assert path is not None, 'for mypy'
+            components = src.get('strip-components', 1)
+            if path.suffix.lower() == '.zip':
+                await asyncio.to_thread(_extract_zip, path, dest, components)
+            elif path.name.lower().endswith(_TAR):
+                await self.run(['tar', '-xf', path.as_posix(), '-C', dest.as_posix(),
+                                f'--strip-components={components}'])
+            else:
+                raise RuntimeError(f'The native builder cannot extract {path.name}, use flatpak-builder')
+        elif kind == 'file':
+            assert path is not None, 'for mypy'
+            await asyncio.to_thread(shutil.copy2, path, dest / src.get('dest-filename', path.name))
+        elif kind == 'script':
+            script = dest / src.get('dest-filename', 'autogen.sh')
+            script.write_text('#!/bin/sh\n' + '\n'.join(src['commands']) + '\n')
+            script.chmod(0o755)
+        elif kind == 'patch':
+            assert path is not None, 'for mypy'
+            await self.run(['patch', '-d', dest.as_posix(), f'-p{src.get("strip-components", 1)}',
+                            '-i', path.as_posix()])
+        elif kind == 'shell':
+            await self.commands(name, f'shell-{index}', src['commands'])
+        else:
+            raise RuntimeError(f'The native builder does not support {kind} sources, use flatpak-builder')
+
+    async def commands(self, name: str, tag: str, commands: typing.Sequence[str]) -> None:
+        """Run commands in the Sdk, each in its own shell as flatpak-builder does, but in one sandbox."""
+        if not commands:
+            return
+        scripts = self.files / _SRC / '.commands' / f'{name}-{tag}'
+        scripts.mkdir(parents=True, exist_ok=True)
+        driver = ['set -e']
+        for i, c in enumerate(commands):
+            (scripts / f'{i}.sh').write_text(c + '\n')
+            driver.append(f'/bin/sh {shlex.quote(f"/app/{_SRC}/.commands/{name}-{tag}/{i}.sh")}')
+        (scripts / 'run.sh').write_text('\n'.join(driver) + '\n')
+        await self.sandbox(f'/app/{_SRC}/{name}', ['/bin/sh', f'/app/{_SRC}/.commands/{name}-{tag}/run.sh'])
+
+    async def module(self, module: typing.Dict[str, typing.Any]) -> None:
+        if module.get('buildsystem') != 'simple':
+            raise RuntimeError('The native builder only supports simple modules, use flatpak-builder')
+        name: str = module['name']
+        srcdir = self.files / _SRC / name
+
+        srcdir.mkdir(parents=True)
+
+        self.stage(f'unpacking {name}')
+        for i, src in enumerate(module.get('sources', [])):
+            await self.source(name, i, src, srcdir)
+
+        self.stage(f'building {name}')
+        await self.commands(name, 'build', module.get('build-commands', []))
+
+    async def finish(self, manifest_path: pathlib.Path) -> None:
+        await asyncio.to_thread(shutil.rmtree, self.files / _SRC)
+
+        self.stage('cleaning up')
+        patterns = [p for m in self.manifest['modules'] for p in m.get('cleanup', [])]
+        await asyncio.to_thread(_cleanup, self.files, [*self.manifest.get('cleanup', []), *patterns])
+        shutil.copy2(manifest_path, self.files / 'manifest.json')
+
+        if (self.files / 'share' / 'metainfo' / f'{self.appid}.metainfo.xml').exists():
+            await self.sandbox('/app', [
+                'appstreamcli', 'compose', '--prefix=/', f'--origin={self.appid}',
+                '--result-root=/app', '--data-dir=/app/share/app-info/xmls',
+                '--icons-dir=/app/share/app-info/icons/flatpak', f'--components={self.appid}', '/app',
+            ])
+
+        self.stage('finishing')
+        await self.run([
+            'flatpak', 'build-finish', f'--command={self.manifest["command"]}',
+            *self.manifest.get('finish-args', []), self.builddir.as_posix(),
+        ])
+
+    async def export(self, repo: str) -> None:
+        self.stage('exporting')
+        command = ['flatpak', 'build-export']
+        if self.args.gpg and repo == self.args.repo:
+            command.append(f'--gpg-sign={self.args.gpg}')
+        command.extend([repo, self.builddir.as_posix(), self.manifest.get('branch', 'master')])
+        await self.run(command)
+
+    async def install(self, repo: str) -> None:
+        self.stage('installing')
+        await self.run([
+            'flatpak', 'install', '--user', '-y', '--noninteractive', '--reinstall', repo,
+            f'app/{self.appid}/{self.arch}/{self.manifest.get("branch", "master")}',
+        ])
+
+
+async def build(args: AppBuildArguments, manifest_path: pathlib.Path, builddir: pathlib.Path,
+                statedir: pathlib.Path, reporter: run.Reporter) -> None:
+    """Build, and optionally export and install, the app described by a generated manifest."""
+    with manifest_path.open('r') as f:
+        manifest = json.load(f)
+
+    builder = _Builder(args, manifest, builddir, reporter, await _default_arch())
+    await builder.init()
+    for module in manifest['modules']:
+        await builder.module(module)
+    await builder.finish(manifest_path)
+
+    if args.export:
+        await builder.export(args.repo)
+    if args.install:
+        # Like flatpak-builder, install from a repo in the state directory
+        # when not exporting
+        repo = args.repo
+        if not args.export:
+            repo = (statedir / 'repo').as_posix()
+            await builder.export(repo)
+        await builder.install(repo)
@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Plan how the game directories of several archives are layered.
+
+A description may have several archives, such as the base game, DLC, and
+mods. Each provides a `game` directory, either at its root (after stripping
+components) or one level down. These are merged in the order the archives are
+listed, with later archives overriding earlier ones. The plan is made from
+the archive indexes on the host, without extracting anything.
+"""
+
+from __future__ import annotations
+import dataclasses
+import pathlib
+import tarfile
+import typing
+import zipfile
+
+if typing.TYPE_CHECKING:
+    from .description import Archive, Description
+
+
+@dataclasses.dataclass
+class Layer:
+
+    archive: pathlib.Path
+    root: str
+    files: typing.Set[str] = dataclasses.field(default_factory=set)
+
+
+@dataclasses.dataclass
+class Plan:
+
+    layers: typing.List[Layer] = dataclasses.field(default_factory=list)
+
+    # Archives whose contents could not be listed, so must be discovered at
+    # build time
+    unplanned: typing.List[pathlib.Path] = dataclasses.field(default_factory=list)
+
+    @property
+    def roots(self) -> typing.List[str]:
+        """The game directories, in the order they are layered."""
+        return self.roots_for([l.archive for l in self.layers])
+
+    def roots_for(self, archives: typing.Collection[pathlib.Path]) -> typing.List[str]:
+        """The game directories of some of the archives, in the order they are layered."""
+        roots: typing.List[str] = []
+        for layer in self.layers:
+            if layer.archive not in archives:
+                continue
+            # Archives with a top level game directory are all extracted into
+            # the same place, in order, by flatpak-builder
+            if layer.root not in roots:
+                roots.append(layer.root)
+        if 'game' in roots:
+            roots.remove('game')
+        return ['game', *roots]
+
+    def conflicts(self) -> typing.Dict[str, typing.List[pathlib.Path]]:
+        """Files provided by more than one archive, and the archives that provide them."""
+        providers: typing.Dict[str, typing.List[pathlib.Path]] = {}
+        roots = self.roots
+        for layer in sorted(self.layers, key=lambda l: roots.index(l.root)):
+            for f in layer.files:
+                providers.setdefault(f, []).append(layer.archive)
+        return {f: a for f, a in sorted(providers.items()) if len(a) > 1}
+
+    def report(self) -> str:
+        lines = []
+        for f, archives in self.conflicts().items():
+            lines.append(f'{f}: {archives[-1].name} overrides {", ".join(a.name for a in archives[:-1])}')
+        for a in self.unplanned:
+            lines.append(f'{a.name}: could not be listed, its game directory will be discovered while building')
+        return '\n'.join(lines)
+
+
+def _list(archive: Archive) -> typing.Optional[typing.List[str]]:
+    """List the files of an archive, after stripping components.
+
+    Zip files have an index, tar files have to be read (and decompressed) in
+    full, but without writing anything out.
+    """
+    if zipfile.is_zipfile(archive.path):
+        with zipfile.ZipFile(archive.path) as z:
+            names = [i.filename for i in z.infolist() if not i.is_dir()]
+    else:
+        try:
+            with tarfile.open(archive.path, 'r:*') as t:
+                names = [m.name.removeprefix('./') for m in t if not m.isdir()]
+        except (OSError, EOFError, tarfile.TarError):
+            return None
+    stripped = [n.split('/')[archive.strip_components:] for n in names]
+    return ['/'.join(p) for p in stripped if p]
+
+
+def plan(description: Description) -> Plan:
+    result = Plan()
+    for archive in description.sources.archives:
+        files = _list(archive)
+        if files is None:
+            result.unplanned.append(archive.path)
+            continue
+
+        layers: typing.Dict[str, Layer] = {}
+        for f in files:
+            parts = f.split('/')
+            if len(parts) > 1 and parts[0] == 'game':
+                root, rel = 'game', parts[1:]
+            elif len(parts) > 2 and parts[1] == 'game':
+                root, rel = f'{parts[0]}/game', parts[2:]
+            else:
+                continue
+            layers.setdefault(root, Layer(archive.path, root)).files.add('/'.join(rel))
+        result.layers.extend(layers[r] for r in sorted(layers))
+
+    return result
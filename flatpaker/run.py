@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Running build commands, with their output captured and summarized.
+
+Each command's output is streamed into a log file for the job, while the
+terminal only shows the current stage of each running job. Optionally, every
+change is also written as a JSON object per line, for other tools to consume.
+"""
+
+from __future__ import annotations
+import asyncio
+import collections
+import json
+import os
+import pathlib
+import re
+import signal
+import subprocess
+import sys
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    from .entry import RunArguments
+
+# Lines of flatpak-builder and flatpak output that mark a new stage
+_STAGES: typing.List[typing.Tuple[re.Pattern[str], str]] = [
+    (re.compile(r'^Downloading sources'), 'downloading sources'),
+    (re.compile(r'^Initializing build dir'), 'initializing'),
+    (re.compile(r'^Cache hit for (\S+)'), 'cached {0}'),
+    (re.compile(r'^Building module (\S+)'), 'building {0}'),
+    (re.compile(r'^Committing stage (\S+)'), 'committing {0}'),
+    (re.compile(r'^Cleaning up'), 'cleaning up'),
+    (re.compile(r'^Finishing app'), 'finishing'),
+    (re.compile(r'^Exporting (\S+)'), 'exporting'),
+    (re.compile(r'^Pruning cache'), 'pruning cache'),
+    (re.compile(r'^Installing'), 'installing'),
+    (re.compile(r'^Generating delta'), 'generating deltas'),
+    (re.compile(r'^Updating summary'), 'updating summary'),
+]
+
+# How many lines of output to show when a command fails
+_TAIL = 20
+
+
+def default_log_dir() -> pathlib.Path:
+    root = os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state'))
+    return pathlib.Path(root, 'flatpaker', 'logs')
+
+
+class Reporter:
+    """Shows the progress of jobs, and writes an event stream."""
+
+    def __init__(self, log_dir: pathlib.Path, events: typing.Optional[str] = None,
+                 verbose: bool = False, stream: typing.TextIO = sys.stderr):
+        self.log_dir = log_dir
+        self.verbose = verbose
+        self.stream = stream
+        self.tty = stream.isatty()
+        self.stages: typing.Dict[str, str] = {}
+        self._drawn = 0
+        self._events: typing.Optional[typing.TextIO] = None
+        if events == '-':
+            self._events = sys.stdout
+        elif events is not None:
+            self._events = open(events, 'a')
+
+    @classmethod
+    def from_args(cls, args: RunArguments) -> Reporter:
+        return cls(pathlib.Path(args.log_dir), args.events, args.verbose)
+
+    def __enter__(self) -> Reporter:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self._clear()
+        if self._events is not None and self._events is not sys.stdout:
+            self._events.close()
+
+    def log_path(self, job: str) -> pathlib.Path:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        return self.log_dir / f'{job}.log'
+
+    def event(self, job: str, event: str, **data: object) -> None:
+        if self._events is not None:
+            self._events.write(json.dumps({'time': time.time(), 'job': job, 'event': event, **data}) + '\n')
+            self._events.flush()
+
+        if event == 'stage':
+            self.stages[job] = typing.cast('str', data['stage'])
+            if self.tty:
+                self._draw()
+            else:
+                self.message(f'{job}: {data["stage"]}')
+        elif event in {'finish', 'error', 'timeout', 'cancelled'}:
+            self.stages.pop(job, None)
+
+    def output(self, job: str, line: str) -> None:
+        if self.verbose:
+            self.message(f'[{job}] {line}')
+
+    def message(self, text: str) -> None:
+        """Print a line above the progress view."""
+        self._clear()
+        print(text, file=self.stream)
+        self._draw()
+
+    def _clear(self) -> None:
+        if self.tty and self._drawn:
+            self.stream.write(f'\x1b[{self._drawn}A\x1b[J')
+            self._drawn = 0
+
+    def _draw(self) -> None:
+        if not self.tty:
+            return
+        self._clear()
+        for job, stage in self.stages.items():
+            self.stream.write(f'{job}: {stage}\n')
+        self._drawn = len(self.stages)
+        self.stream.flush()
+
+
+def _stage(line: str) -> typing.Optional[str]:
+    for pattern, stage in _STAGES:
+        if (m := pattern.match(line)):
+            return stage.format(*m.groups())
+    return None
+
+
+async def _terminate(proc: asyncio.subprocess.Process) -> None:
+    if proc.returncode is not None:
+        return
+    proc.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), 10)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+async def run_async(reporter: Reporter, job: str, command: typing.Sequence[str],
+                    timeout: typing.Optional[float] = None) -> None:
+    """Run a command, streaming its output into the job's log.
+
+    Raises subprocess.CalledProcessError if the command fails, and
+    asyncio.TimeoutError if it takes longer than `timeout` seconds.
+    """
+    log = reporter.log_path(job)
+    tail: typing.Deque[str] = collections.deque(maxlen=_TAIL)
+    reporter.event(job, 'start', command=list(command), log=log.as_posix())
+    start = time.monotonic()
+
+    proc = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        stdin=asyncio.subprocess.DEVNULL)
+    assert proc.stdout is not None, 'for mypy'
+
+    async def consume(stdout: asyncio.StreamReader) -> None:
+        with log.open('a') as f:
+            f.write(f'$ {" ".join(command)}\n')
+            while (raw := await stdout.readline()):
+                line = raw.decode(errors='replace').rstrip()
+                f.write(line + '\n')
+                tail.append(line)
+                reporter.output(job, line)
+                if (stage := _stage(line)) is not None:
+                    reporter.event(job, 'stage', stage=stage)
+        await proc.wait()
+
+    try:
+        await asyncio.wait_for(consume(proc.stdout), timeout)
+    except asyncio.TimeoutError:
+        await _terminate(proc)
+        reporter.event(job, 'timeout', elapsed=time.monotonic() - start)
+        reporter.message(f'{job}: timed out after {timeout}s, see {log}')
+        raise
+    except asyncio.CancelledError:
+        await _terminate(proc)
+        reporter.event(job, 'cancelled', elapsed=time.monotonic() - start)
+        raise
+
+    assert proc.returncode is not None, 'for mypy'
+    if proc.returncode != 0:
+        reporter.event(job, 'error', returncode=proc.returncode, elapsed=time.monotonic() - start)
+        reporter.message('\n'.join([f'{job}: failed with {proc.returncode}, last output:', *tail, f'see {log}']))
+        raise subprocess.CalledProcessError(proc.returncode, list(command))
+
+    reporter.event(job, 'finish', elapsed=time.monotonic() - start)
+
+
+def run(reporter: Reporter, job: str, command: typing.Sequence[str],
+        timeout: typing.Optional[float] = None) -> None:
+    """Synchronous wrapper around run_async, for callers outside an event loop."""
+    asyncio.run(run_async(reporter, job, command, timeout))
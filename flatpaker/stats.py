@@ -0,0 +1,201 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+"""Historical build costs, used to schedule and to spot regressions."""
+
+from __future__ import annotations
+import contextlib
+import os
+import pathlib
+import sqlite3
+import statistics
+import threading
+import time
+import typing
+
+from . import cache, util
+from .description import load_description
+
+if typing.TYPE_CHECKING:
+    from .description import Description
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS builds (
+        id INTEGER PRIMARY KEY,
+        appid TEXT NOT NULL,
+        started REAL NOT NULL,
+        wall_time REAL NOT NULL,
+        peak_disk INTEGER NOT NULL,
+        source_bytes INTEGER NOT NULL,
+        success INTEGER NOT NULL,
+        builder TEXT NOT NULL DEFAULT 'flatpak-builder'
+    )
+'''
+
+# How many recent builds are used to estimate the next one
+_HISTORY = 5
+
+
+class Build(typing.NamedTuple):
+
+    started: float
+    wall_time: float
+    peak_disk: int
+    source_bytes: int
+    builder: str
+
+
+def default_path() -> pathlib.Path:
+    root = os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share'))
+    return pathlib.Path(root, 'flatpaker', 'stats.sqlite')
+
+
+def source_bytes(description: Description) -> int:
+    sources: typing.List[typing.Any] = [
+        *description.sources.archives, *description.sources.files, *description.sources.patches]
+    return sum(s.path.stat().st_size for s in sources if s.path.exists())
+
+
+class StatsDB:
+
+    def __init__(self, path: typing.Optional[pathlib.Path] = None):
+        path = path or default_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        with self.conn:
+            self.conn.execute(_SCHEMA)
+            # Databases from before builders were recorded
+            columns = [r[1] for r in self.conn.execute('PRAGMA table_info(builds)')]
+            if 'builder' not in columns:
+                self.conn.execute("ALTER TABLE builds ADD COLUMN builder TEXT NOT NULL DEFAULT 'flatpak-builder'")
+
+    def record(self, appid: str, started: float, wall_time: float, peak_disk: int,
+               source_bytes: int, success: bool, builder: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO builds (appid, started, wall_time, peak_disk, source_bytes, success, builder) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (appid, started, wall_time, peak_disk, source_bytes, success, builder))
+
+    def history(self, appid: str) -> typing.List[Build]:
+        """Successful builds of an app, oldest first."""
+        cur = self.conn.execute(
+            'SELECT started, wall_time, peak_disk, source_bytes, builder FROM builds '
+            'WHERE appid = ? AND success ORDER BY started',
+            (appid, ))
+        return [Build(*r) for r in cur.fetchall()]
+
+    def appids(self) -> typing.List[str]:
+        cur = self.conn.execute('SELECT DISTINCT appid FROM builds ORDER BY appid')
+        return [r[0] for r in cur.fetchall()]
+
+    def expected_disk(self, appid: str, size: int) -> int:
+        """Estimate the disk space a build needs.
+
+        This is the largest peak of the recent builds, or a guess of three
+        times the size of the sources (extracted, then installed and
+        committed) for a new app. Builds that ran at the same time as another
+        one are skipped, as their peaks include what the others used.
+        """
+        cur = self.conn.execute(
+            'SELECT peak_disk FROM builds AS b WHERE appid = ? AND success AND NOT EXISTS ('
+            '    SELECT 1 FROM builds AS o WHERE o.id != b.id '
+            '    AND o.started < b.started + b.wall_time AND b.started < o.started + o.wall_time) '
+            'ORDER BY started DESC LIMIT ?',
+            (appid, _HISTORY))
+        peaks: typing.List[int] = [r[0] for r in cur.fetchall()]
+        if peaks:
+            return max(peaks)
+        return size * 3
+
+    def seconds_per_byte(self) -> typing.Optional[float]:
+        cur = self.conn.execute(
+            'SELECT wall_time, source_bytes FROM builds WHERE success AND source_bytes > 0')
+        rates = [w / b for w, b in cur.fetchall()]
+        return statistics.median(rates) if rates else None
+
+    def estimate(self, appid: str, size: int, rate: typing.Optional[float]) -> float:
+        """Estimate the cost of building an app.
+
+        This is the median of the recent builds if there are any, otherwise it
+        is extrapolated from the size of the sources. Without any history at
+        all, the size of the sources is the only thing to go on.
+        """
+        history = self.history(appid)[-_HISTORY:]
+        if history:
+            return statistics.median(b.wall_time for b in history)
+        if rate is not None:
+            return size * rate
+        return float(size)
+
+
+@contextlib.contextmanager
+def record_build(description: Description, builder: str = 'flatpak-builder') -> typing.Iterator[None]:
+    """Record the cost of building an app, whether or not it succeeds."""
+    started = time.time()
+    start = time.monotonic()
+    # Builds happen in the cache, which may be on a different filesystem
+    monitor = DiskMonitor(cache.root().as_posix())
+    success = False
+    try:
+        with monitor:
+            yield
+        success = True
+    finally:
+        StatsDB().record(
+            util.appid(description), started, time.monotonic() - start, monitor.peak,
+            source_bytes(description), success, builder)
+
+
+class DiskMonitor(threading.Thread):
+    """Sample the free space of a filesystem, to find the peak used by a build.
+
+    This uses the whole filesystem rather than walking the build directory,
+    which is much cheaper but will also count anything else writing to it,
+    including other builds running at the same time.
+    """
+
+    def __init__(self, path: str = '.', interval: float = 1.0):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_free = self._free()
+        self.min_free = self.start_free
+
+    def _free(self) -> int:
+        st = os.statvfs(self.path)
+        return st.f_bavail * st.f_frsize
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.min_free = min(self.min_free, self._free())
+
+    @property
+    def peak(self) -> int:
+        return max(0, self.start_free - self.min_free)
+
+    def __enter__(self) -> DiskMonitor:
+        self.start()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.stopped.set()
+        self.join()
+        self.min_free = min(self.min_free, self._free())
+
+
+def schedule(descriptions: typing.Sequence[str]) -> typing.List[str]:
+    """Order descriptions so that the most expensive are built first."""
+    db = StatsDB()
+    rate = db.seconds_per_byte()
+
+    def cost(name: str) -> float:
+        try:
+            description = load_description(name)
+        except Exception:
+            # Let the build report the problem
+            return 0.0
+        return db.estimate(util.appid(description), source_bytes(description), rate)
+
+    return sorted(descriptions, key=cost, reverse=True)
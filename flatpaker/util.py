@@ -4,15 +4,18 @@
 from __future__ import annotations
 from xml.etree import ElementTree as ET
 import contextlib
+import fcntl
 import hashlib
+import importlib.resources
+import os
 import pathlib
-import shutil
-import tempfile
 import textwrap
 import typing
 
+from . import cache
+
 if typing.TYPE_CHECKING:
-    from .description import Description
+    from .description import Archive, Description, File, Patch
 
 RUNTIME_VERSION = "24.08"
 
@@ -23,10 +26,9 @@ def _subelem(elem: ET.Element, tag: str, text: typing.Optional[str] = None, **ex
     return new
 
 
-def extract_sources(description: Description) -> typing.List[typing.Dict[str, object]]:
+def archive_sources(archives: typing.Sequence[Archive]) -> typing.List[typing.Dict[str, object]]:
     sources: typing.List[typing.Dict[str, object]] = []
-
-    for archive in description.sources.archives:
+    for archive in archives:
         sha = archive.sha256
         if sha is None:
             sha = sha256(archive.path)
@@ -41,7 +43,12 @@ def extract_sources(description: Description) -> typing.List[typing.Dict[str, ob
                 'type': 'shell',
                 'commands': archive.commands
             })
-    for source in description.sources.files:
+    return sources
+
+
+def file_sources(files: typing.Sequence[File]) -> typing.List[typing.Dict[str, object]]:
+    sources: typing.List[typing.Dict[str, object]] = []
+    for source in files:
         p = source.path
         sha = source.sha256
         if sha is None:
@@ -56,14 +63,40 @@ def extract_sources(description: Description) -> typing.List[typing.Dict[str, ob
                 'type': 'shell',
                 'commands': source.commands
             })
-    for patch in description.sources.patches:
-        sources.append({
+    return sources
+
+
+def patch_sources(patches: typing.Sequence[Patch]) -> typing.List[typing.Dict[str, object]]:
+    return [
+        {
             'type': 'patch',
             'path': patch.path.as_posix(),
             'strip-components': patch.strip_components,
-        })
+        }
+        for patch in patches
+    ]
+
+
+def layered(description: Description) -> bool:
+    """Whether a game can be built with its mods and files in a layer of their own.
+
+    The prologue, patches, and commands may all touch the files of any source,
+    and only see them if every source is unpacked into the same directory.
+    """
+    s = description.sources
+    return (description.quirks.x_configure_prologue is None and not s.patches
+            and not any(a.commands for a in s.archives) and not any(f.commands for f in s.files))
 
-    return sources
+
+def data_file_source(workdir: pathlib.Path, name: str) -> typing.Dict[str, object]:
+    """Copy a helper script from flatpaker's data into the workdir, and return a source for it."""
+    dest = workdir / name
+    dest.write_bytes((importlib.resources.files('flatpaker') / 'data' / 'files' / name).read_bytes())
+    return {
+        'path': dest.as_posix(),
+        'sha256': sha256(dest),
+        'type': 'file',
+    }
 
 
 def create_appdata(description: Description, workdir: pathlib.Path, appid: str) -> pathlib.Path:
@@ -145,13 +178,61 @@ def sanitize_name(name: str) -> str:
         .replace("'", '')
 
 
+def appid(description: Description) -> str:
+    return f"{description.common.reverse_url}.{sanitize_name(description.common.name)}"
+
+
 @contextlib.contextmanager
 def tmpdir(name: str, cleanup: bool = True) -> typing.Iterator[pathlib.Path]:
-    tdir = pathlib.Path(tempfile.gettempdir()) / 'flatpaker' / name
-    tdir.mkdir(parents=True, exist_ok=True)
-    yield tdir
-    if cleanup:
-        shutil.rmtree(tdir)
+    with cache.entry('workdirs', name, cleanup) as tdir:
+        yield tdir
+
+
+@contextlib.contextmanager
+def repo_lock(repo: str, exclusive: bool = False) -> typing.Iterator[None]:
+    """Lock a flatpak repo against concurrent maintenance.
+
+    Builds take a shared lock, maintenance that removes objects takes an
+    exclusive lock. The lock file lives next to the repo, so that it can be
+    taken before the repo is created.
+    """
+    path = pathlib.Path(repo).absolute()
+    lockfile = path.with_name(f'{path.name}.lock')
+    with lockfile.open('w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def repo_refs(repo: pathlib.Path) -> typing.Dict[str, str]:
+    """Read the branch heads of a repo directly, skipping the generated appstream refs."""
+    heads = repo / 'refs' / 'heads'
+    refs: typing.Dict[str, str] = {}
+    for dirpath, _, filenames in os.walk(heads):
+        for fn in filenames:
+            p = pathlib.Path(dirpath, fn)
+            ref = p.relative_to(heads).as_posix()
+            if not ref.startswith('appstream'):
+                refs[ref] = p.read_text().strip()
+    return refs
+
+
+def format_size(size: float) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TiB'
+
+
+def bd_prune_command(engine: typing.Literal['renpy', 'rpgmaker'], root: str, description: Description) -> str:
+    """Remove files from the game that the engine can never use on Linux, see prune.py."""
+    return ' '.join([
+        f'python3 prune.py {engine} {root}',
+        *[f"--keep '{k}'" for k in description.quirks.x_prune_keep],
+    ])
 
 
 def bd_metadata(desktop: pathlib.Path, appdata: pathlib.Path, game: list[str]) -> dict[str, typing.Any]:
@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import typing
+
+import pytest
+
+from flatpaker import cache
+
+
+@pytest.mark.parametrize('size, expected', [
+    (4096, 4096),
+    ('4096', 4096),
+    ('512K', 512 * 1024),
+    ('512M', 512 * 1024 ** 2),
+    ('20G', 20 * 1024 ** 3),
+    ('1T', 1024 ** 4),
+    ('1.5G', int(1.5 * 1024 ** 3)),
+    ('20GiB', 20 * 1024 ** 3),
+    ('20GB', 20 * 1024 ** 3),
+    ('20gb', 20 * 1024 ** 3),
+    (' 20 G ', 20 * 1024 ** 3),
+    ('100B', 100),
+])
+def test_parse_size(size: typing.Union[str, int], expected: int) -> None:
+    assert cache.parse_size(size) == expected
+
+
+@pytest.mark.parametrize('size', ['', 'G', '20X', '-1G', '20 G B', '1e3'])
+def test_parse_size_invalid(size: str) -> None:
+    with pytest.raises(ValueError):
+        cache.parse_size(size)
+
+
+def test_config_read_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    calls = []
+
+    def load_config() -> typing.Any:
+        calls.append(None)
+        return {'cache': {'min-free': '1G', 'budgets': {'build': '10G'}}}
+
+    monkeypatch.setattr(cache.config, 'load_config', load_config)
+    cache._config.cache_clear()
+    try:
+        assert cache.min_free() == 1024 ** 3
+        assert cache.budgets() == {'build': 10 * 1024 ** 3}
+        assert len(calls) == 1
+    finally:
+        cache._config.cache_clear()
@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import shutil
+import stat
+import subprocess
+import typing
+import zipfile
+
+import pytest
+
+from flatpaker import native, run
+from flatpaker.actions.build_flatpak import _flatpak_builder
+
+_SDK = ('org.freedesktop.Sdk', 'org.freedesktop.Platform', '24.08')
+
+
+def _zip(path: pathlib.Path) -> pathlib.Path:
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('Game-1.0/game/script.rpy', 'label start:\n')
+        # Only DOS attributes, as in archives made on Windows
+        info = zipfile.ZipInfo('Game-1.0/game/images/bg.png')
+        info.external_attr = 0x20
+        z.writestr(info, b'png')
+        info = zipfile.ZipInfo('Game-1.0/game.sh')
+        info.external_attr = (stat.S_IFREG | 0o755) << 16
+        z.writestr(info, '#!/bin/sh\n')
+        info = zipfile.ZipInfo('Game-1.0/link')
+        info.external_attr = (stat.S_IFLNK | 0o777) << 16
+        z.writestr(info, 'game.sh')
+        z.writestr('Game-1.0/Thumbs.db', '')
+    return path
+
+
+def _tree(root: pathlib.Path) -> typing.Dict[str, typing.Tuple[int, bytes]]:
+    """Every path under root, with its mode and contents or link target."""
+    tree: typing.Dict[str, typing.Tuple[int, bytes]] = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for n in [*dirnames, *filenames]:
+            p = pathlib.Path(dirpath, n)
+            mode = p.lstat().st_mode
+            if stat.S_ISLNK(mode):
+                # The mode of a link means nothing
+                entry = (0, os.readlink(p).encode())
+            elif stat.S_ISREG(mode):
+                entry = (stat.S_IMODE(mode), p.read_bytes())
+            else:
+                entry = (stat.S_IMODE(mode), b'')
+            tree[p.relative_to(root).as_posix()] = entry
+    return tree
+
+
+def test_strip() -> None:
+    assert native._strip('Game-1.0/game/script.rpy', 1) == pathlib.PurePosixPath('game/script.rpy')
+    assert native._strip('Game-1.0/', 1) is None
+    with pytest.raises(RuntimeError):
+        native._strip('Game-1.0/../../etc/passwd', 1)
+
+
+@pytest.mark.parametrize('path, pattern, expected', [
+    # Patterns without a leading / match at any depth, like flatpak-builder
+    (['lib', 'game', 'a.rpy'], '*.rpy', True),
+    (['lib', 'game', 'a.rpyc'], '*.rpy', False),
+    (['lib', 'game', 'a.rpyc.bak'], '*.rpyc.bak', True),
+    (['share', 'doc'], '/share/doc', True),
+    (['lib', 'share', 'doc'], '/share/doc', False),
+    (['lib', 'share', 'doc'], 'share/doc', True),
+])
+def test_matches(path: typing.List[str], pattern: str, expected: bool) -> None:
+    assert native._matches(path, pattern) is expected
+
+
+def test_extract_zip(tmp_path: pathlib.Path) -> None:
+    dest = tmp_path / 'out'
+    native._extract_zip(_zip(tmp_path / 'game.zip'), dest, 1)
+
+    assert (dest / 'game' / 'script.rpy').read_text() == 'label start:\n'
+    assert stat.S_IMODE((dest / 'game.sh').stat().st_mode) == 0o755
+    assert stat.S_IMODE((dest / 'game' / 'images' / 'bg.png').stat().st_mode) == 0o644
+    assert os.readlink(dest / 'link') == 'game.sh'
+
+
+def test_cleanup(tmp_path: pathlib.Path) -> None:
+    for f in ['lib/game/game/a.rpy', 'lib/game/game/a.rpyc', 'lib/game/game/a.rpyc.bak', 'share/doc/x/README']:
+        p = tmp_path / f
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text('')
+    native._cleanup(tmp_path, ['*.rpy', '*.rpyc.bak', '/share/doc'])
+
+    assert sorted(_tree(tmp_path)) == ['lib', 'lib/game', 'lib/game/game', 'lib/game/game/a.rpyc', 'share']
+
+
+def _sdk_installed() -> bool:
+    if shutil.which('flatpak-builder') is None:
+        return False
+    sdk, platform, version = _SDK
+    return all(subprocess.run(['flatpak', 'info', f'{r}//{version}'], capture_output=True).returncode == 0
+               for r in [sdk, platform])
+
+
+@pytest.mark.skipif(not _sdk_installed(), reason='needs flatpak-builder and the freedesktop Sdk')
+def test_same_as_flatpak_builder(tmp_path: pathlib.Path) -> None:
+    sdk, platform, version = _SDK
+    readme = tmp_path / 'README.txt'
+    readme.write_text('readme\n')
+    manifest = tmp_path / 'com.example.Game.json'
+    manifest.write_text(json.dumps({
+        'id': 'com.example.Game',
+        'sdk': sdk,
+        'runtime': platform,
+        'runtime-version': version,
+        'command': 'game.sh',
+        'build-options': {'no-debuginfo': True, 'strip': False},
+        'finish-args': ['--socket=wayland'],
+        'cleanup': ['*.rpy'],
+        'modules': [
+            {
+                'buildsystem': 'simple',
+                'name': 'game',
+                'sources': [
+                    {'type': 'archive', 'path': _zip(tmp_path / 'game.zip').as_posix(), 'strip-components': 1},
+                    {'type': 'shell', 'commands': ['rm Thumbs.db']},
+                    {'type': 'file', 'path': readme.as_posix()},
+                ],
+                'build-commands': [
+                    'mkdir -p $FLATPAK_DEST/lib/game',
+                    'mv game game.sh link README.txt $FLATPAK_DEST/lib/game/',
+                    'install -Dm755 /dev/null $FLATPAK_DEST/bin/game.sh',
+                ],
+            },
+        ],
+    }))
+    args = typing.cast(typing.Any, argparse.Namespace(
+        timeout=None, export=False, install=False, gpg=None, repo=(tmp_path / 'repo').as_posix()))
+    reporter = run.Reporter(tmp_path / 'logs')
+
+    results = []
+    for name in ['flatpak-builder', 'native']:
+        builddir = tmp_path / f'build-{name}'
+        statedir = tmp_path / f'state-{name}'
+        builddir.mkdir()
+        statedir.mkdir()
+        if name == 'native':
+            asyncio.run(native.build(args, manifest, builddir, statedir, reporter))
+        else:
+            asyncio.run(_flatpak_builder(args, manifest, builddir, statedir, reporter, 'com.example.Game'))
+        files = _tree(builddir / 'files')
+        files.pop('manifest.json')
+        results.append(files)
+
+    assert results[0] == results[1]
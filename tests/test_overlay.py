@@ -0,0 +1,80 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import pathlib
+import tarfile
+import typing
+import zipfile
+
+from flatpaker import overlay
+from flatpaker.description import Archive, Description, Sources
+
+
+def _description(*archives: Archive) -> Description:
+    description = Description.__new__(Description)
+    description.sources = Sources(archives=list(archives))
+    return description
+
+
+def _zip(path: pathlib.Path, files: typing.Iterable[str]) -> Archive:
+    with zipfile.ZipFile(path, 'w') as z:
+        for f in files:
+            z.writestr(f, f)
+    return Archive(path)
+
+
+def _tar(path: pathlib.Path, files: typing.Iterable[str]) -> Archive:
+    src = path.with_suffix('.d')
+    with tarfile.open(path, 'w:gz') as t:
+        for f in files:
+            p = src / f
+            p.parent.mkdir(parents=True, exist_ok=True)
+            p.write_text(f)
+            t.add(p, f)
+    return Archive(path)
+
+
+def test_zip_and_tar_are_planned(tmp_path: pathlib.Path) -> None:
+    base = _zip(tmp_path / 'base.zip', ['Game-1.0/game/script.rpy', 'Game-1.0/Game.exe'])
+    mod = _tar(tmp_path / 'mod.tar.gz', ['Mod-1.0/Mod/game/script.rpy', 'Mod-1.0/Mod/game/new.rpy'])
+    plan = overlay.plan(_description(base, mod))
+
+    assert not plan.unplanned
+    assert [(l.archive, l.root, l.files) for l in plan.layers] == [
+        (base.path, 'game', {'script.rpy'}),
+        (mod.path, 'Mod/game', {'script.rpy', 'new.rpy'}),
+    ]
+    assert plan.report() == 'script.rpy: mod.tar.gz overrides base.zip'
+
+
+def test_roots_follow_the_listed_order(tmp_path: pathlib.Path) -> None:
+    # Listed before the base game, but stripped archives are merged first
+    zmod = _zip(tmp_path / 'z.zip', ['Z-1.0/ZMod/game/a.rpy'])
+    base = _zip(tmp_path / 'base.zip', ['Game-1.0/game/a.rpy'])
+    amod = _tar(tmp_path / 'a.tar.gz', ['A-1.0/AMod/game/a.rpy'])
+    patch = _zip(tmp_path / 'patch.zip', ['Patch/game/a.rpy'])
+    plan = overlay.plan(_description(zmod, base, amod, patch))
+
+    assert plan.roots == ['game', 'ZMod/game', 'AMod/game']
+    assert plan.roots_for([amod.path]) == ['game', 'AMod/game']
+    assert plan.conflicts() == {'a.rpy': [base.path, patch.path, zmod.path, amod.path]}
+
+
+def test_strip_components(tmp_path: pathlib.Path) -> None:
+    archive = _zip(tmp_path / 'deep.zip', ['a/b/game/x.rpy', 'a/top.txt'])
+    archive.strip_components = 2
+    plan = overlay.plan(_description(archive))
+
+    assert [(l.root, l.files) for l in plan.layers] == [('game', {'x.rpy'})]
+
+
+def test_unknown_archives_are_unplanned(tmp_path: pathlib.Path) -> None:
+    junk = tmp_path / 'game.7z'
+    junk.write_bytes(b'7z\xbc\xaf\x27\x1c')
+    plan = overlay.plan(_description(Archive(junk), Archive(tmp_path / 'missing.zip')))
+
+    assert plan.layers == []
+    assert plan.unplanned == [junk, tmp_path / 'missing.zip']
+    assert plan.roots == ['game']
+    assert 'game.7z: could not be listed' in plan.report()
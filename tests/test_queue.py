@@ -0,0 +1,161 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import argparse
+import pathlib
+import shutil
+import subprocess
+import typing
+
+import pytest
+
+from flatpaker import run
+from flatpaker.actions import queue
+
+
+def _args(repo: pathlib.Path, gpg: typing.Optional[str]) -> typing.Any:
+    return argparse.Namespace(repo=repo.as_posix(), gpg=gpg)
+
+
+def _local_repo(path: pathlib.Path) -> pathlib.Path:
+    heads = path / 'refs' / 'heads'
+    (heads / 'app' / 'com.example.Game' / 'x86_64').mkdir(parents=True)
+    (heads / 'app' / 'com.example.Game' / 'x86_64' / 'stable').write_text('a' * 64 + '\n')
+    (heads / 'runtime' / 'com.example.Game.Debug' / 'x86_64').mkdir(parents=True)
+    (heads / 'runtime' / 'com.example.Game.Debug' / 'x86_64' / 'stable').write_text('b' * 64 + '\n')
+    return path
+
+
+@pytest.fixture
+def publish_commands(monkeypatch: pytest.MonkeyPatch) -> typing.List[typing.List[str]]:
+    commands: typing.List[typing.List[str]] = []
+    monkeypatch.setattr(run, 'run', lambda reporter, job, command, *a: commands.append(list(command)))
+    monkeypatch.setattr(queue, 'update_summary', lambda repo, gpg: None)
+    return commands
+
+
+def test_publish_signs_pulled_commits(tmp_path: pathlib.Path,
+                                      publish_commands: typing.List[typing.List[str]]) -> None:
+    local = _local_repo(tmp_path / 'local')
+    central = tmp_path / 'repo'
+    queue._publish(_args(central, 'KEY'), local, 'job', run.Reporter(tmp_path))
+
+    assert publish_commands[0][:3] == ['ostree', f'--repo={central}', 'pull-local']
+    assert publish_commands[1:] == [
+        ['ostree', f'--repo={central}', 'gpg-sign', 'a' * 64, 'KEY'],
+        ['ostree', f'--repo={central}', 'gpg-sign', 'b' * 64, 'KEY'],
+    ]
+
+
+def test_publish_without_key(tmp_path: pathlib.Path,
+                             publish_commands: typing.List[typing.List[str]]) -> None:
+    local = _local_repo(tmp_path / 'local')
+    queue._publish(_args(tmp_path / 'repo', None), local, 'job', run.Reporter(tmp_path))
+
+    assert [c[2] for c in publish_commands] == ['pull-local']
+
+
+@pytest.mark.skipif(shutil.which('ostree') is None or shutil.which('gpg') is None,
+                    reason='needs ostree and gpg')
+def test_publish_signed_commit(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    home = tmp_path / 'gnupg'
+    home.mkdir(mode=0o700)
+    monkeypatch.setenv('GNUPGHOME', home.as_posix())
+    monkeypatch.setattr(queue, 'update_summary', lambda repo, gpg: None)
+    subprocess.run(
+        ['gpg', '--batch', '--passphrase', '', '--quick-gen-key', 'flatpaker test <test@example.com>',
+         'default', 'default', 'never'],
+        check=True, capture_output=True)
+    out = subprocess.run(['gpg', '--list-keys', '--with-colons'], check=True, capture_output=True, text=True)
+    key = next(l.split(':')[9] for l in out.stdout.splitlines() if l.startswith('fpr:'))
+
+    local = tmp_path / 'local'
+    central = tmp_path / 'repo'
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'file').write_text('content')
+    for r in [local, central]:
+        subprocess.run(['ostree', 'init', '--mode=archive-z2', f'--repo={r}'], check=True)
+    ref = 'app/com.example.Game/x86_64/stable'
+    subprocess.run(['ostree', 'commit', f'--repo={local}', '-b', ref, f'--tree=dir={tree}'],
+                   check=True, capture_output=True)
+
+    queue._publish(_args(central, key), local, 'job', run.Reporter(tmp_path))
+
+    out = subprocess.run(['ostree', 'show', f'--repo={central}', ref], check=True, capture_output=True, text=True)
+    assert 'Good signature' in out.stdout
+
+
+@pytest.fixture
+def jobs(tmp_path: pathlib.Path) -> queue.JobQueue:
+    return queue.JobQueue((tmp_path / 'queue.sqlite').as_posix(), lease=10, max_attempts=2)
+
+
+def test_enqueue_skips_queued(jobs: queue.JobQueue) -> None:
+    assert jobs.enqueue('a.toml')
+    assert not jobs.enqueue('a.toml')
+    assert jobs.claim('w1') == (1, 'a.toml')
+    assert not jobs.enqueue('a.toml')
+    assert jobs.finish(1, 'w1')
+    assert jobs.enqueue('a.toml')
+
+
+def test_claim_in_order(jobs: queue.JobQueue) -> None:
+    jobs.enqueue('a.toml')
+    jobs.enqueue('b.toml')
+    assert jobs.claim('w1') == (1, 'a.toml')
+    assert jobs.claim('w2') == (2, 'b.toml')
+    assert jobs.claim('w3') is None
+
+
+def test_expired_lease_is_claimed_again(jobs: queue.JobQueue, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1000.0
+    monkeypatch.setattr(queue.time, 'time', lambda: now)
+    jobs.enqueue('a.toml')
+    assert jobs.claim('w1') == (1, 'a.toml')
+    assert jobs.claim('w2') is None
+
+    now += 11
+    assert jobs.claim('w2') == (1, 'a.toml')
+    # The first worker lost its lease, and can't overwrite the result
+    assert not jobs.finish(1, 'w1')
+    assert jobs.finish(1, 'w2')
+    assert jobs.status() == {'done': 1}
+
+
+def test_renew_keeps_the_lease(jobs: queue.JobQueue, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1000.0
+    monkeypatch.setattr(queue.time, 'time', lambda: now)
+    jobs.enqueue('a.toml')
+    jobs.claim('w1')
+    now += 8
+    jobs.renew(1, 'w1')
+    now += 8
+    assert jobs.claim('w2') is None
+    # Only the worker holding the lease can renew it
+    now += 3
+    jobs.renew(1, 'w2')
+    assert jobs.claim('w2') == (1, 'a.toml')
+
+
+def test_expired_too_often_fails(jobs: queue.JobQueue, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1000.0
+    monkeypatch.setattr(queue.time, 'time', lambda: now)
+    jobs.enqueue('a.toml')
+    jobs.claim('w1')
+    now += 11
+    jobs.claim('w2')
+    now += 11
+    assert jobs.claim('w3') is None
+    assert jobs.failures() == [('a.toml', 'lease expired')]
+
+
+def test_failed_job_is_retried(jobs: queue.JobQueue) -> None:
+    jobs.enqueue('a.toml')
+    jobs.claim('w1')
+    assert jobs.finish(1, 'w1', 'boom')
+    assert jobs.status() == {'pending': 1}
+    jobs.claim('w1')
+    assert jobs.finish(1, 'w1', 'boom')
+    assert jobs.failures() == [('a.toml', 'boom')]
@@ -0,0 +1,162 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import importlib.util
+import json
+import pathlib
+import types
+import typing
+
+import pytest
+
+import flatpaker
+
+
+def _load() -> types.ModuleType:
+    # A build time script, installed with a name that can't be imported
+    path = pathlib.Path(flatpaker.__file__).parent / 'data' / 'files' / 'rpgmaker-plugins.py'
+    spec = importlib.util.spec_from_file_location('rpgmaker_plugins', path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+plugins = _load()
+
+
+def _tokens(src: str) -> typing.List[typing.Tuple[str, str]]:
+    return [t for t in plugins._tokens(src) if t[0] != 'space']
+
+
+@pytest.mark.parametrize('src', [
+    'var a = "x\\"y" + \'z\'; // comment\n/* block\n comment */ b();',
+    'x = `a ${b + `c ${d}`} e ${ {f: 1}.f }`;',
+    'if (/[/]+\\//g.test(s)) { a = b / c / d; }',
+    'var s = "unterminated\nvar t = 1;',
+    '/* unterminated',
+])
+def test_tokens_round_trip(src: str) -> None:
+    assert ''.join(t for _, t in plugins._tokens(src)) == src
+
+
+def test_regex_or_division() -> None:
+    assert _tokens('a = b / c / d') == [
+        ('word', 'a'), ('punct', '='), ('word', 'b'), ('punct', '/'), ('word', 'c'), ('punct', '/'), ('word', 'd')]
+    # Flags are left as a word after the literal
+    assert _tokens('a = /b/g') == [('word', 'a'), ('punct', '='), ('literal', '/b/'), ('word', 'g')]
+    assert ('literal', '/[/]x/') in _tokens('return /[/]x/.test(s)')
+    assert ('literal', '/x/') not in _tokens('f(a) / x / 2')
+
+
+def test_template_substitutions_are_code() -> None:
+    tokens = _tokens('`a ${ {b: `c`}.b } d`')
+    assert tokens == [
+        ('literal', '`a ${'), ('punct', '{'), ('word', 'b'), ('punct', ':'), ('literal', '`c`'),
+        ('punct', '}'), ('punct', '.'), ('word', 'b'), ('literal', '} d`')]
+
+
+def test_minify() -> None:
+    src = '''
+        // A comment
+        var a = 1; /* inline */ var b = 2;
+
+        /*
+         * Block
+         */
+        var s = `line one
+            line two`;
+        if (a) {
+            b = a / 2;
+        }
+    '''
+    assert plugins.minify(src) == '\n'.join([
+        'var a = 1;   var b = 2;',
+        'var s = `line one',
+        '            line two`;',
+        'if (a) {',
+        'b = a / 2;',
+        '}',
+    ])
+
+
+def test_minify_keeps_comment_markers_in_literals() -> None:
+    src = 'var url = "http://example.com"; var re = /\\/\\/x/;'
+    assert plugins.minify(src) == src
+
+
+@pytest.mark.parametrize('src, strict', [
+    ('"use strict";\nvar a;', True),
+    ("// header\n'use strict'\nvar a;", True),
+    ('"other"; "use strict"; var a;', True),
+    ('var a; "use strict";', False),
+    ('(function() {\n"use strict";\n})();', False),
+])
+def test_scan_strict(src: str, strict: bool) -> None:
+    assert plugins._scan(src).strict is strict
+
+
+def test_scan_declared() -> None:
+    script = plugins._scan('''
+        function Top() {}
+        async function asyncTop() {}
+        function* generatorTop() {}
+        class Window_Top extends Window_Base {}
+        let topLet = 1, other = 2;
+        const topConst = function inner() {};
+        var topVar = 1;
+        (function() { function Nested() {} })();
+        x = function expression() {};
+        y = class Expr {};
+    ''')
+    assert script.declared == {'Top', 'asyncTop', 'generatorTop', 'Window_Top', 'topLet', 'topConst'}
+    assert {'Window_Base', 'Nested', 'topVar', 'x', 'y'} <= script.words
+
+
+def test_find_unsafe() -> None:
+    names = ['A.js', 'B.js', 'C.js', 'D.js']
+    sources = [
+        'if (typeof Helper === "undefined") { window.x = 1; }',
+        'function Helper() {}',
+        'function Helper() {}',
+        '"use strict";\nvar y = 1;',
+    ]
+    assert plugins.find_unsafe(names, sources) == [
+        'B.js declares Helper, which an earlier plugin uses',
+        'C.js declares Helper, as does B.js',
+        'D.js is strict mode code',
+    ]
+
+
+def test_find_unsafe_ok() -> None:
+    sources = [
+        'var Imported = Imported || {};\n(function() { function local() {} })();',
+        'function Later() {}\nLater();',
+        '(() => { "use strict"; })();',
+    ]
+    assert plugins.find_unsafe(['A.js', 'B.js', 'C.js'], sources) == []
+
+
+@pytest.mark.parametrize('mz', [False, True])
+def test_find_plugins(tmp_path: pathlib.Path, mz: bool) -> None:
+    (tmp_path / 'js').mkdir()
+    if mz:
+        (tmp_path / 'js' / 'rmmz_managers.js').write_text('')
+    entries = [
+        {'name': 'Core', 'status': True},
+        {'name': 'Off', 'status': False},
+        {'name': 'sub/Extra', 'status': True},
+        {'name': 'Extra', 'status': True},
+    ]
+    (tmp_path / 'js' / 'plugins.js').write_text(
+        '\ufeff// Generated by RPG Maker.\nvar $plugins =\n' + json.dumps(entries) + ';\n', encoding='utf-8')
+
+    if mz:
+        assert plugins.find_plugins(tmp_path) == ['Core', 'sub/Extra']
+    else:
+        assert plugins.find_plugins(tmp_path) == ['Core.js', 'sub/Extra.js', 'Extra.js']
+
+
+def test_find_plugins_unreadable(tmp_path: pathlib.Path) -> None:
+    assert plugins.find_plugins(tmp_path) is None
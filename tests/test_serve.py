@@ -0,0 +1,149 @@
+# SPDX-License-Identifier: MIT
+# Copyright © 2025 Dylan Baker
+
+from __future__ import annotations
+import email.utils
+import http.client
+import pathlib
+import threading
+import typing
+
+import pytest
+
+from flatpaker.actions import serve
+
+_DATA = bytes(range(256)) * 4
+
+
+def _range(header: str, size: int = 100) -> typing.Optional[typing.Tuple[int, int]]:
+    return serve._Handler._range(typing.cast(serve._Handler, None), header, size)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 10)),
+    ('bytes=10-', (10, 90)),
+    ('bytes=90-200', (90, 10)),
+    ('bytes=-10', (90, 10)),
+    ('bytes=-200', (0, 100)),
+    ('bytes=99-99', (99, 1)),
+    # Several ranges, other units, and nonsense get the whole file
+    ('bytes=0-9,20-29', (0, 100)),
+    ('items=0-9', (0, 100)),
+    ('bytes=a-b', (0, 100)),
+    # Unsatisfiable
+    ('bytes=100-', None),
+    ('bytes=20-10', None),
+    ('bytes=-0', None),
+])
+def test_range(header: str, expected: typing.Optional[typing.Tuple[int, int]]) -> None:
+    assert _range(header) == expected
+
+
+@pytest.fixture
+def server(tmp_path: pathlib.Path) -> typing.Iterator[int]:
+    (tmp_path / 'config').write_text('')
+    (tmp_path / 'objects').mkdir()
+    (tmp_path / 'objects' / 'ab.file').write_bytes(_DATA)
+    srv = serve._Server(('127.0.0.1', 0), tmp_path.as_posix(), False)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield srv.server_address[1]
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+
+def _get(port: int, path: str, headers: typing.Optional[typing.Dict[str, str]] = None,
+         method: str = 'GET') -> typing.Tuple[http.client.HTTPResponse, bytes]:
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    conn.request(method, path, headers=headers or {})
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, body
+
+
+def test_get(server: int) -> None:
+    resp, body = _get(server, '/objects/ab.file')
+    assert resp.status == 200
+    assert body == _DATA
+    assert resp.getheader('Content-Length') == str(len(_DATA))
+    assert resp.getheader('Cache-Control') == 'public, max-age=31536000, immutable'
+
+    resp, body = _get(server, '/config')
+    assert resp.getheader('Cache-Control') == 'no-cache'
+
+
+def test_head(server: int) -> None:
+    resp, body = _get(server, '/objects/ab.file', method='HEAD')
+    assert resp.status == 200
+    assert resp.getheader('Content-Length') == str(len(_DATA))
+    assert body == b''
+
+
+def test_missing_and_outside(server: int) -> None:
+    assert _get(server, '/objects/missing')[0].status == 404
+    assert _get(server, '/../../etc/passwd')[0].status == 404
+    assert _get(server, '/objects')[0].status == 404
+
+
+def test_range_request(server: int) -> None:
+    resp, body = _get(server, '/objects/ab.file', {'Range': 'bytes=10-19'})
+    assert resp.status == 206
+    assert body == _DATA[10:20]
+    assert resp.getheader('Content-Range') == f'bytes 10-19/{len(_DATA)}'
+
+    resp, body = _get(server, '/objects/ab.file', {'Range': f'bytes={len(_DATA)}-'})
+    assert resp.status == 416
+    assert resp.getheader('Content-Range') == f'bytes */{len(_DATA)}'
+    assert body == b''
+
+
+def test_if_range(server: int) -> None:
+    etag = _get(server, '/objects/ab.file')[0].getheader('ETag')
+    assert etag is not None
+
+    resp, body = _get(server, '/objects/ab.file', {'Range': 'bytes=10-19', 'If-Range': etag})
+    assert resp.status == 206
+    assert body == _DATA[10:20]
+
+    # The file changed since the download started, so all of it is sent
+    resp, body = _get(server, '/objects/ab.file', {'Range': 'bytes=10-19', 'If-Range': '"stale"'})
+    assert resp.status == 200
+    assert body == _DATA
+
+
+def test_not_modified(server: int) -> None:
+    resp, _ = _get(server, '/objects/ab.file')
+    etag = resp.getheader('ETag')
+    modified = resp.getheader('Last-Modified')
+    assert etag is not None and modified is not None
+
+    for headers in [{'If-None-Match': etag}, {'If-None-Match': f'"other", {etag}'},
+                    {'If-None-Match': '*'}, {'If-Modified-Since': modified}]:
+        resp, body = _get(server, '/objects/ab.file', headers)
+        assert resp.status == 304, headers
+        assert resp.getheader('Content-Length') is None
+        assert resp.getheader('ETag') == etag
+        assert body == b''
+
+    resp, _ = _get(server, '/objects/ab.file', {'If-None-Match': '"other"'})
+    assert resp.status == 200
+    old = email.utils.formatdate(0, usegmt=True)
+    resp, _ = _get(server, '/objects/ab.file', {'If-Modified-Since': old})
+    assert resp.status == 200
+
+
+def test_persistent_connection(server: int) -> None:
+    conn = http.client.HTTPConnection('127.0.0.1', server, timeout=10)
+    try:
+        for _ in range(3):
+            conn.request('GET', '/objects/ab.file', headers={'If-None-Match': '*'})
+            resp = conn.getresponse()
+            assert resp.status == 304
+            resp.read()
+        conn.request('GET', '/objects/ab.file')
+        assert conn.getresponse().read() == _DATA
+    finally:
+        conn.close()